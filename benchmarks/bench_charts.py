@@ -0,0 +1,77 @@
+"""
+Benchmark: rendering chart previews one after another vs on the chart worker pool.
+
+Builds line, bar and scatter charts from a synthetic dataset and renders 1, 3 and
+10 of them serially in this process and with render_charts. The pool is started
+once ("cold" includes worker start-up) and reused afterwards, as it is across warm
+Lambda invocations.
+
+Usage:
+    python benchmarks/bench_charts.py [--workers 4] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lambda_final  # noqa: E402
+from lambda_final import extract_chart_series, render_chart_png, render_charts  # noqa: E402
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+ROWS = [{'Month': f"{MONTHS[i % 12]} {2020 + i // 12}", 'Revenue': 1000 + 37 * i, 'Cost': 800 + (i * 53) % 400}
+        for i in range(20)]
+
+
+def make_charts(count):
+    kinds = ('line', 'bar', 'scatter')
+    columns = ('Revenue', 'Cost')
+    return [extract_chart_series(ROWS, 'Month', columns[i % 2], kinds[i % 3]) for i in range(count)]
+
+
+def timed(func, charts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = func(charts)
+    assert all(results), "a chart failed to render"
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4, help='chart worker processes')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per chart count')
+    args = parser.parse_args()
+
+    lambda_final.CHART_RENDER_WORKERS = args.workers
+
+    # Silence the per-chart logging from lambda_final while timing
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+    rows = []
+    try:
+        sys.stdout = devnull
+        render_chart_png(make_charts(1)[0])  # Import matplotlib before timing the serial path
+
+        start = time.perf_counter()
+        render_charts(make_charts(2))
+        cold_start = time.perf_counter() - start
+
+        for count in (1, 3, 10):
+            charts = make_charts(count)
+            serial = timed(lambda c: [render_chart_png(chart) for chart in c], charts, args.repeat)
+            pooled = timed(render_charts, charts, args.repeat)
+            rows.append((count, serial, pooled))
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+
+    print(f"{args.workers} workers on {os.cpu_count()} CPUs; pool cold start (2 charts): {cold_start:.2f}s")
+    print(f"{'charts':>6}{'serial':>10}{'pool':>10}{'speedup':>10}")
+    for count, serial, pooled in rows:
+        print(f"{count:>6}{serial:>9.2f}s{pooled:>9.2f}s{serial / pooled:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
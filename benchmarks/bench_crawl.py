@@ -0,0 +1,103 @@
+"""
+Benchmark: serial URL crawling vs the concurrent crawl stage in lambda_final.
+
+Starts a local HTTP stub that answers every request after an artificial delay,
+then crawls the same URL list both ways and prints the wall time.
+
+Usage:
+    python benchmarks/bench_crawl.py [--urls 6] [--hosts 3] [--latency 0.5]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lambda_final  # noqa: E402
+from lambda_final import crawl_url, crawl_urls  # noqa: E402
+
+# Both passes must hit the network, so keep the crawl cache out of the measurement
+lambda_final.CRAWL_CACHE.enabled = False
+
+PAGE = ("<html><head><style>body {color: red}</style><script>var x = 1;</script></head><body>"
+        + "<p>Amazon Bedrock makes foundation models available through an API.</p>" * 50
+        + '<img src="/images/architecture-diagram.png"><img src="/images/hero-banner.jpg">'
+        + "</body></html>").encode('utf-8')
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    latency = 0.5
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(latency):
+    SlowHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def crawl_serial(urls):
+    results = []
+    for url in urls:
+        try:
+            results.append(crawl_url(url))
+        except Exception as e:
+            results.append({'url': url, 'error': str(e)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--urls', type=int, default=6, help='number of URLs to crawl')
+    parser.add_argument('--hosts', type=int, default=3, help='number of distinct hosts')
+    parser.add_argument('--latency', type=float, default=0.5, help='stub latency per request (s)')
+    args = parser.parse_args()
+
+    # One stub server per host; each port counts as its own host for the per-host limit
+    servers = [start_stub(args.latency) for _ in range(args.hosts)]
+    urls = [f"http://127.0.0.1:{servers[i % args.hosts].server_address[1]}/page/{i}"
+            for i in range(args.urls)]
+
+    # Silence the per-URL logging from lambda_final while timing
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+    try:
+        sys.stdout = devnull
+        start = time.perf_counter()
+        serial = crawl_serial(urls)
+        serial_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        concurrent = crawl_urls(urls)
+        concurrent_time = time.perf_counter() - start
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+        for server in servers:
+            server.shutdown()
+
+    assert [r['url'] for r in concurrent] == urls, "crawl_urls must preserve URL order"
+    assert not any('error' in r for r in serial + concurrent), "stub requests failed"
+    assert [r.get('content') for r in serial] == [r.get('content') for r in concurrent]
+
+    print(f"{args.urls} URLs across {args.hosts} hosts, {args.latency:.2f}s latency per request")
+    print(f"  serial:     {serial_time:.2f}s")
+    print(f"  concurrent: {concurrent_time:.2f}s  ({serial_time / concurrent_time:.1f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark: decoding and parsing a whole CSV upload vs chunked streaming ingestion.
+
+Builds a synthetic CSV, base64-encodes it as the API receives it, and runs each
+path in a forked child process, reporting wall time and the peak resident memory
+the child added on top of the payload (Linux only: reads /proc/self/status).
+
+Usage:
+    python benchmarks/bench_csv_stream.py [--rows 250000 1000000 2000000]
+"""
+import argparse
+import base64
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_dataset import synthetic_csv  # noqa: E402
+from lambda_final import parse_csv_stream, parse_excel_data  # noqa: E402
+
+
+def memory_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def parse_full(csv_b64):
+    return parse_excel_data(base64.b64decode(csv_b64), '.csv')
+
+
+def run_child(func, csv_b64, conn):
+    sys.stdout = open(os.devnull, 'w')  # Silence the logging from lambda_final
+    baseline = memory_kb('VmRSS')
+    start = time.perf_counter()
+    summary, _ = func(csv_b64)
+    elapsed = time.perf_counter() - start
+    conn.send((elapsed, memory_kb('VmHWM') - baseline, summary['row_count'] if summary else 0))
+
+
+def measure(func, csv_b64):
+    context = multiprocessing.get_context('fork')
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=run_child, args=(func, csv_b64, child_conn))
+    process.start()
+    result = parent_conn.recv()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[250000, 1000000, 2000000], help='rows per CSV')
+    args = parser.parse_args()
+
+    print(f"{'rows':>9}{'csv':>9}  {'impl':<10}{'time':>8}{'peak added':>12}")
+    for rows in args.rows:
+        csv_bytes = synthetic_csv(rows)
+        csv_b64 = base64.b64encode(csv_bytes).decode('utf-8')
+        del csv_bytes
+        for label, func in (('full', parse_full), ('streaming', parse_csv_stream)):
+            elapsed, peak_kb, parsed_rows = measure(func, csv_b64)
+            assert parsed_rows == rows, f"{label} parsed {parsed_rows} rows"
+            print(f"{rows:>9}{len(csv_b64) * 3 / 4 / 1024 / 1024:>7.0f}MB  {label:<10}{elapsed:>7.2f}s"
+                  f"{peak_kb / 1024:>10.0f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark: list-of-dict rows vs the columnar dataset for a large CSV upload.
+
+Generates a synthetic CSV (default 1M rows: date, region, units, revenue, cost),
+then runs the data path both ways: parse, build the summary and extract one chart
+series. Prints wall time, peak traced memory and the memory still held by the
+parsed data afterwards.
+
+Usage:
+    python benchmarks/bench_dataset.py [--rows 1000000]
+"""
+import argparse
+import datetime
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lambda_final import extract_chart_series, parse_excel_data  # noqa: E402
+
+
+def synthetic_csv(rows):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(7)
+    units = rng.integers(1, 100, rows)
+    frame = pd.DataFrame({
+        'Date': pd.date_range('2020-01-01', periods=rows, freq='min').strftime('%Y-%m-%d %H:%M'),
+        'Region': np.array(['North', 'South', 'East', 'West', 'Central'])[rng.integers(0, 5, rows)],
+        'Units': units,
+        'Revenue': np.round(units * 19.99, 2),
+        'Cost': np.round(units * rng.uniform(8, 14, rows), 2)
+    })
+    return frame.to_csv(index=False).encode('utf-8')
+
+
+def legacy_path(file_content):
+    """The previous data path: records, a per-cell cleanup loop and a per-row chart loop"""
+    import numpy as np
+    import pandas as pd
+
+    df = pd.read_csv(BytesIO(file_content)).dropna(axis=1, how='all').dropna(axis=0, how='all')
+    df = df.reset_index(drop=True)
+    rows = df.to_dict('records')
+    for row in rows:
+        for key, value in list(row.items()):
+            if isinstance(value, (datetime.datetime, datetime.date, pd.Timestamp)):
+                row[key] = str(value)
+            elif pd.isna(value):
+                row[key] = None
+    summary = {'columns': list(df.columns), 'row_count': len(rows), 'sample_data': rows[:5]}
+
+    x_values, y_values = [], []
+    for row in rows:
+        x_val, y_val = row.get('Date'), row.get('Revenue')
+        if x_val is None or y_val is None:
+            continue
+        try:
+            y_float = float(y_val)
+            if np.isnan(y_float):
+                continue
+            x_str = str(x_val).strip()
+            if not x_str or x_str.lower() in ['none', 'nan', '']:
+                continue
+            x_values.append(x_str)
+            y_values.append(y_float)
+        except (ValueError, TypeError):
+            continue
+    return summary, rows, (x_values[:20], y_values[:20])
+
+
+def columnar_path(file_content):
+    summary, dataset = parse_excel_data(file_content, '.csv')
+    return summary, dataset, extract_chart_series(dataset, 'Date', 'Revenue', 'line')
+
+
+def measure(func, file_content):
+    gc.collect()
+    start = time.perf_counter()
+    func(file_content)
+    elapsed = time.perf_counter() - start
+
+    # Memory is traced in a separate run; tracing slows the allocation-heavy row path a lot
+    gc.collect()
+    tracemalloc.start()
+    summary, data, chart = func(file_content)
+    _, peak = tracemalloc.get_traced_memory()
+    del summary, chart
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return elapsed, peak, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='rows in the synthetic CSV')
+    args = parser.parse_args()
+
+    file_content = synthetic_csv(args.rows)
+
+    # Silence the logging from lambda_final while timing
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+    try:
+        sys.stdout = devnull
+        results = [(label, measure(func, file_content))
+                   for label, func in (('rows', legacy_path), ('columnar', columnar_path))]
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+
+    print(f"{args.rows} rows, {len(file_content) / 1024 / 1024:.1f} MB CSV")
+    print(f"{'impl':<10}{'time':>9}{'peak mem':>11}{'retained':>11}")
+    for label, (elapsed, peak, retained) in results:
+        print(f"{label:<10}{elapsed:>8.2f}s{peak / 1024 / 1024:>9.0f}MB{retained / 1024 / 1024:>9.0f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark: two full Excel parses (detect the header, then re-read) vs header
+detection on a bounded preview followed by a single parse.
+
+Generates synthetic .xlsx workbooks of about 10k, 100k and 1M cells (10 columns,
+with a title row and a blank row above the header, so the legacy path re-reads
+the file) and prints the legacy read time next to the whole parse_excel_data
+call, which also cleans the frame and builds the rows and summary.
+
+Usage:
+    python benchmarks/bench_excel.py [--sizes 10000 100000 1000000] [--repeat 1]
+"""
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lambda_final import parse_excel_data  # noqa: E402
+
+COLUMNS = ['Date', 'Region', 'Product', 'Units', 'Price', 'Revenue', 'Cost', 'Margin', 'Returns', 'Rating']
+
+
+def synthetic_workbook(cells):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Data')
+    sheet.append(['Quarterly sales export'])
+    sheet.append([])
+    sheet.append(COLUMNS)
+    for i in range(cells // len(COLUMNS)):
+        units = 10 + i % 90
+        sheet.append([f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}", f"Region {i % 7}", f"SKU-{i % 500}",
+                      units, 19.99, units * 19.99, units * 12.5, units * 7.49, i % 5, 1 + i % 5])
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def read_legacy(file_content):
+    """The previous parse_excel_data read path: full parse, header scan, full re-read"""
+    import pandas as pd
+
+    df = pd.read_excel(BytesIO(file_content))
+    header_row = None
+    for idx in range(min(10, len(df))):
+        if df.iloc[idx].notna().sum() >= 3:
+            header_row = idx
+            break
+    if header_row is not None and header_row > 0:
+        df = pd.read_excel(BytesIO(file_content), header=header_row)
+    return df
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='cells per workbook')
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs per workbook')
+    args = parser.parse_args()
+
+    print(f"{'cells':>9}{'size':>10}{'two-pass':>11}{'single-pass':>13}{'speedup':>9}")
+    for cells in args.sizes:
+        workbook = synthetic_workbook(cells)
+
+        # Silence the logging from lambda_final while timing
+        devnull = open(os.devnull, 'w')
+        stdout = sys.stdout
+        try:
+            sys.stdout = devnull
+            legacy = timed(lambda: read_legacy(workbook), args.repeat)
+            single = timed(lambda: parse_excel_data(workbook, '.xlsx'), args.repeat)
+            summary, _ = parse_excel_data(workbook, '.xlsx')
+        finally:
+            sys.stdout = stdout
+            devnull.close()
+
+        assert summary and summary['columns'] == COLUMNS, "header row was not detected"
+        print(f"{cells:>9}{len(workbook) / 1024:>8.0f}KB{legacy:>10.2f}s{single:>12.2f}s{legacy / single:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark: single-shot slide generation vs outline-then-fill, against a fake Bedrock.
+
+Both paths run against benchmarks/fake_bedrock.py, which models time to first token,
+prefill and decode speed. The script prints wall time, time to the first finished
+slide and token usage, including prompt-cache reads and writes. Times are rescaled to real-model seconds, since the fake
+sleeps time_scale times as long.
+
+Usage:
+    python benchmarks/bench_generation.py [--slides 6 10] [--concurrency 4] [--time-scale 0.1]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bedrock import FakeBedrockClient  # noqa: E402
+from lambda_final import (SLIDE_MODEL_ID, SLIDES_SYSTEM_PROMPT, build_slides_prompt,  # noqa: E402
+                          generate_slides_outline_fill, invoke_claude_streaming, text_block)
+
+CONTENT = ("Amazon Bedrock is a fully managed service that offers a choice of high-performing foundation "
+           "models through a single API. Customers use it to build generative AI applications. ") * 60
+DESCRIPTION = "Generative AI on AWS"
+
+
+def run_single(client, slide_count):
+    first = []
+    started = time.perf_counter()
+    prompt = build_slides_prompt(DESCRIPTION, slide_count, CONTENT, "", [])
+    invoke_claude_streaming(client, SLIDE_MODEL_ID, {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 4000,
+        "system": [text_block(SLIDES_SYSTEM_PROMPT, cache=True)],
+        "messages": [{"role": "user", "content": [text_block(prompt)]}]
+    }, on_slide=lambda slide: first or first.append(time.perf_counter() - started))
+    return time.perf_counter() - started, first[0] if first else None
+
+
+def run_outline(client, slide_count, concurrency):
+    first = []
+    started = time.perf_counter()
+    generate_slides_outline_fill(client, DESCRIPTION, slide_count, CONTENT, "", [], max_workers=concurrency,
+                                 on_slide=lambda slide: first or first.append(time.perf_counter() - started))
+    return time.perf_counter() - started, first[0] if first else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--slides', type=int, nargs='+', default=[6, 10], help='slide counts to generate')
+    parser.add_argument('--concurrency', type=int, default=4, help='parallel fill calls')
+    parser.add_argument('--time-scale', type=float, default=0.1, help='fake model delay multiplier')
+    args = parser.parse_args()
+
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+    print(f"{'slides':>6}  {'mode':<20}{'total':>9}{'first slide':>13}{'calls':>7}{'input tok':>11}{'output tok':>12}"
+          f"{'cache read':>12}{'cache write':>13}")
+    for slide_count in args.slides:
+        for label in ('single-shot', 'outline+fill'):
+            # One client per mode; the second single-shot run shows a warm prompt cache
+            client = FakeBedrockClient(time_scale=args.time_scale)
+            for run in range(2 if label == 'single-shot' else 1):
+                calls_before = len(client.calls)
+                try:
+                    sys.stdout = devnull
+                    if label == 'single-shot':
+                        total, first = run_single(client, slide_count)
+                    else:
+                        total, first = run_outline(client, slide_count, args.concurrency)
+                finally:
+                    sys.stdout = stdout
+                calls = client.calls[calls_before:]
+                scale = 1 / args.time_scale
+                name = label + (' (warm)' if run else '')
+                print(f"{slide_count:>6}  {name:<20}{total * scale:>8.1f}s{(first or 0) * scale:>12.1f}s{len(calls):>7}"
+                      f"{sum(c['input_tokens'] for c in calls):>11}{sum(c['output_tokens'] for c in calls):>12}"
+                      f"{sum(c['cache_read_input_tokens'] for c in calls):>12}"
+                      f"{sum(c['cache_creation_input_tokens'] for c in calls):>13}")
+    devnull.close()
+
+
+if __name__ == '__main__':
+    main()
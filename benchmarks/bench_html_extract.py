@@ -0,0 +1,105 @@
+"""
+Benchmark: legacy regex HTML extraction on the full page vs the streaming extractor.
+
+Runs each implementation over a corpus of saved pages (every *.html file in
+--corpus) and prints wall time, peak memory and bytes consumed per page. Without
+--corpus a synthetic corpus of 50 KB, 1 MB and 5 MB pages is generated.
+
+Usage:
+    python benchmarks/bench_html_extract.py [--corpus DIR] [--repeat 5]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lambda_final import extract_images_from_html, extract_page_from_stream, extract_text_from_html  # noqa: E402
+
+NAV = '<nav>' + ''.join(f'<a href="/section/{i}">Section {i}</a>' for i in range(40)) + '</nav>'
+SCRIPT = '<script>' + 'window.dataLayer = window.dataLayer || []; ' * 200 + '</script>'
+STYLE = '<style>' + '.card { margin: 0 auto; padding: 4px; } ' * 200 + '</style>'
+PARAGRAPH = ('<p>Amazon Bedrock is a fully managed service that offers a choice of high-performing '
+             'foundation models through a single API, along with capabilities to build generative AI '
+             'applications with security, privacy and responsible AI.</p>')
+FIGURE = '<figure><img src="/media/architecture-diagram-{0}.png" alt="Diagram {0}"></figure>'
+
+
+def synthetic_page(size):
+    parts = ['<html><head>', STYLE, SCRIPT, '</head><body>', NAV]
+    length = sum(len(p) for p in parts)
+    i = 0
+    while length < size:
+        block = SCRIPT if i % 10 == 9 else PARAGRAPH
+        if i % 25 == 0:
+            block += FIGURE.format(i)
+        parts.append(block)
+        length += len(block)
+        i += 1
+    parts.append('</body></html>')
+    return ''.join(parts).encode('utf-8')
+
+
+def load_corpus(directory):
+    if directory:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(directory, '*.html'))):
+            with open(path, 'rb') as f:
+                pages.append((os.path.basename(path), f.read()))
+        return pages
+    return [(f"synthetic-{label}", synthetic_page(size))
+            for label, size in (('50KB', 50 * 1024), ('1MB', 1024 * 1024), ('5MB', 5 * 1024 * 1024))]
+
+
+def run_regex(page):
+    html_content = BytesIO(page).read().decode('utf-8', errors='replace')
+    text = extract_text_from_html(html_content, mode='legacy')
+    images = extract_images_from_html(html_content, 'https://example.com/')
+    return text, images, len(page)
+
+
+def run_streaming(page):
+    return extract_page_from_stream(BytesIO(page), 'https://example.com/', mode='legacy')
+
+
+def run_readability(page):
+    return extract_page_from_stream(BytesIO(page), 'https://example.com/', mode='readability')
+
+
+def measure(func, page, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(page)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    func(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', help='directory of saved *.html pages')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per page')
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        sys.exit(f"No *.html files found in {args.corpus}")
+
+    print(f"{'page':<28}{'size':>10}  {'impl':<10}{'time':>10}{'peak mem':>12}{'bytes read':>12}  text/images")
+    for name, page in pages:
+        for label, func in (('regex', run_regex), ('streaming', run_streaming), ('readable', run_readability)):
+            (text, images, bytes_read), elapsed, peak = measure(func, page, args.repeat)
+            print(f"{name[:27]:<28}{len(page) / 1024:>8.0f}KB  {label:<10}{elapsed * 1000:>8.1f}ms"
+                  f"{peak / 1024:>10.0f}KB{bytes_read / 1024:>10.0f}KB  {len(text)}/{len(images)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark: parsing every sheet of a multi-sheet workbook in this process vs on the
+sheet worker processes.
+
+Generates a synthetic .xlsx workbook (default 8 sheets of 20k rows: month, region,
+revenue, cost, units) and times parse_workbook with EXCEL_SHEET_WORKERS=1 (sheets
+parsed one after another here) and with --workers processes, next to the previous
+behaviour of reading only the first sheet. The time and memory budgets are lifted so
+every sheet is parsed.
+
+Usage:
+    python benchmarks/bench_workbook.py [--sheets 8] [--rows 20000] [--workers 4]
+"""
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lambda_final  # noqa: E402
+from lambda_final import parse_excel_data, parse_workbook  # noqa: E402
+
+
+def synthetic_workbook(sheets, rows):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    for k in range(sheets):
+        sheet = workbook.create_sheet(f"Entity {k + 1}")
+        sheet.append(['Month', 'Region', 'Revenue', 'Cost', 'Units'])
+        for i in range(rows):
+            units = 10 + (i * (k + 3)) % 90
+            sheet.append([f"{2015 + i // 12 % 10}-{1 + i % 12:02d}-01", f"Region {i % 6}",
+                          units * 19.99, units * 12.5, units])
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sheets', type=int, default=8, help='sheets in the synthetic workbook')
+    parser.add_argument('--rows', type=int, default=20000, help='rows per sheet')
+    parser.add_argument('--workers', type=int, default=4, help='sheet worker processes')
+    args = parser.parse_args()
+
+    workbook = synthetic_workbook(args.sheets, args.rows)
+    lambda_final.EXCEL_PARSE_TIME_BUDGET = 3600
+    lambda_final.EXCEL_MEMORY_BUDGET_BYTES = 1 << 40
+    lambda_final.EXCEL_MAX_SHEETS = args.sheets
+
+    # Silence the logging from lambda_final while timing
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+    results = []
+    try:
+        sys.stdout = devnull
+        elapsed, _ = timed(lambda: parse_excel_data(workbook, '.xlsx'))
+        results.append(('first sheet', elapsed, 1))
+        for label, workers in (('inline', 1), (f"{args.workers} workers", args.workers)):
+            lambda_final.EXCEL_SHEET_WORKERS = workers
+            elapsed, (summary, _) = timed(lambda: parse_workbook(workbook, '.xlsx'))
+            results.append((label, elapsed, sum(1 for sheet in summary['sheets'] if sheet['status'] == 'parsed')))
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+
+    print(f"{args.sheets} sheets x {args.rows} rows, {len(workbook) / 1024 / 1024:.1f} MB workbook, {os.cpu_count()} CPUs")
+    print(f"{'impl':<14}{'time':>9}{'sheets':>8}")
+    for label, elapsed, sheets in results:
+        print(f"{label:<14}{elapsed:>8.2f}s{sheets:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Offline stand-in for the bedrock-runtime client, for benchmarks and local runs.
+
+Answers the prompts lambda_final sends (single-shot deck, outline, per-slide fill,
+data analysis) with well-formed JSON, and sleeps like a real model would: a fixed
+time to first token, prefill time per input token and decode time per output token.
+Model IDs containing 'haiku' decode faster. cache_control breakpoints are honoured
+like Bedrock prompt caching, and usage reports cache read/write tokens. All delays are multiplied by time_scale.
+
+Usage:
+    from fake_bedrock import FakeBedrockClient
+    lambda_final.boto3.client = lambda name, **kw: FakeBedrockClient()
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from io import BytesIO
+
+IMAGE_TOKENS = 1500
+MIN_CACHE_TOKENS = 1024
+BULLET = "Revenue increased sharply across urban markets"
+
+
+class FakeBedrockClient:
+
+    def __init__(self, tokens_per_second=60.0, first_token_latency=0.6, prefill_per_token=0.00005,
+                 fast_model_speedup=3.0, time_scale=1.0):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_latency = first_token_latency
+        self.prefill_per_token = prefill_per_token
+        self.fast_model_speedup = fast_model_speedup
+        self.time_scale = time_scale
+        self.calls = []
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    # --- replies -----------------------------------------------------------------
+
+    def _reply(self, prompt):
+        match = re.search(r'Plan a (\d+)-slide PowerPoint presentation about: (.*)', prompt)
+        if match:
+            count, description = int(match.group(1)), match.group(2).strip()
+            slides = [{"title": description, "focus": "Overview of the topics covered", "image_index": None}]
+            slides += [{"title": f"Insight {i}", "focus": f"Key finding number {i} with supporting data",
+                        "image_index": (i - 1) if i <= 2 else None} for i in range(1, count - 1)]
+            slides.append({"title": "Thank You", "focus": "Closing and questions", "image_index": None})
+            return 'outline', json.dumps({"slides": slides})
+
+        match = re.search(r'Write the bullet points for slide (\d+)', prompt)
+        if match:
+            return 'fill', json.dumps({"content": [f"{BULLET} {i}" for i in range(5)]})
+
+        if 'Data Analysis Request' in prompt:
+            return 'analysis', json.dumps({"insights": ["Sales grew steadily"], "visualizations": [], "slide_content": []})
+
+        match = re.search(r'Create a (\d+)-slide PowerPoint presentation about: (.*)', prompt)
+        count = int(match.group(1)) if match else 6
+        description = match.group(2).strip() if match else 'Presentation'
+        slides = [{"title": description, "content": [f"{BULLET} {i}" for i in range(5)], "image_index": None}]
+        slides += [{"title": f"Insight {i}", "content": [f"{BULLET} {j}" for j in range(5)],
+                    "image_index": (i - 1) if i <= 2 else None} for i in range(1, count - 1)]
+        slides.append({"title": "Thank You", "content": ["Questions and discussion welcome"], "image_index": None})
+        return 'slides', json.dumps({"slides": slides})
+
+    def _prepare(self, modelId, body):
+        request = json.loads(body)
+        blocks = list(request.get('system', []))
+        for message in request['messages']:
+            content = message['content']
+            blocks += [{"type": "text", "text": content}] if isinstance(content, str) else content
+
+        # Prompt caching: the prefix up to the last cache_control block is read from the
+        # cache if an earlier call wrote it, otherwise written (if long enough to cache)
+        input_tokens = 0
+        cached_tokens = 0
+        prefix = hashlib.sha256(modelId.encode('utf-8'))
+        prompt = ''
+        for block in blocks:
+            tokens = len(block['text']) // 4 if block['type'] == 'text' else IMAGE_TOKENS
+            prompt += block.get('text', '')
+            prefix.update(json.dumps(block, sort_keys=True).encode('utf-8'))
+            input_tokens += tokens
+            if 'cache_control' in block:
+                cached_tokens, cache_key = input_tokens, prefix.hexdigest()
+        cache_read = cache_write = 0
+        if cached_tokens >= MIN_CACHE_TOKENS:
+            # An entry only becomes readable once the call that wrote it has finished prefill
+            now = time.monotonic()
+            with self._lock:
+                if self._cache.get(cache_key, float('inf')) <= now:
+                    cache_read = cached_tokens
+                else:
+                    cache_write = cached_tokens
+                    prefill = self.first_token_latency + input_tokens * self.prefill_per_token
+                    self._cache.setdefault(cache_key, now + prefill * self.time_scale)
+
+        kind, text = self._reply(prompt)
+        output_tokens = max(1, len(text) // 4)
+        speed = self.tokens_per_second * (self.fast_model_speedup if 'haiku' in modelId else 1.0)
+        usage = {'input_tokens': input_tokens - cache_read - cache_write, 'output_tokens': output_tokens,
+                 'cache_read_input_tokens': cache_read, 'cache_creation_input_tokens': cache_write}
+        with self._lock:
+            self.calls.append({'model': modelId, 'kind': kind, **usage})
+        # Cached prefix tokens skip most of the prefill work
+        prefill = self.first_token_latency + (input_tokens - cache_read * 0.9) * self.prefill_per_token
+        return text, usage, prefill * self.time_scale, self.time_scale / speed
+
+    # --- bedrock-runtime API -----------------------------------------------------
+
+    def invoke_model(self, modelId, body, **kwargs):
+        text, usage, prefill, per_token = self._prepare(modelId, body)
+        time.sleep(prefill + usage['output_tokens'] * per_token)
+        payload = {'content': [{'type': 'text', 'text': text}], 'usage': usage}
+        return {'body': BytesIO(json.dumps(payload).encode('utf-8'))}
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        text, usage, prefill, per_token = self._prepare(modelId, body)
+
+        def events():
+            time.sleep(prefill)
+            yield self._event({'type': 'message_start', 'message': {'usage': {'input_tokens': usage['input_tokens'], 'output_tokens': 1}}})
+            for i in range(0, len(text), 16):  # ~4 tokens per event
+                time.sleep(4 * per_token)
+                yield self._event({'type': 'content_block_delta', 'index': 0,
+                                   'delta': {'type': 'text_delta', 'text': text[i:i + 16]}})
+            yield self._event({'type': 'message_delta', 'usage': {'output_tokens': usage['output_tokens']}})
+            yield self._event({'type': 'message_stop'})
+
+        return {'body': events()}
+
+    @staticmethod
+    def _event(data):
+        return {'chunk': {'bytes': json.dumps(data).encode('utf-8')}}
@@ -4,7 +4,7 @@
 docker run --rm --entrypoint /bin/sh -v "$PWD":/var/task "public.ecr.aws/lambda/python:3.9" -c "
     yum install -y zip &&
     mkdir -p /tmp/layer/python &&
-    pip install python-pptx matplotlib pandas openpyxl -t /tmp/layer/python/ &&
+    pip install python-pptx matplotlib pandas openpyxl brotli -t /tmp/layer/python/ &&
     cd /tmp/layer &&
     zip -r /var/task/pptx-layer-linux.zip . &&
     echo 'Lambda layer created successfully'
@@ -12,5 +12,5 @@ docker run --rm --entrypoint /bin/sh -v "$PWD":/var/task "public.ecr.aws/lambda/
 
 echo ""
 echo "✅ Linux-compatible layer created: pptx-layer-linux.zip"
-echo "📦 Includes: python-pptx, matplotlib, pandas, openpyxl"
+echo "📦 Includes: python-pptx, matplotlib, pandas, openpyxl, brotli"
 echo "📊 Size: $(ls -lh pptx-layer-linux.zip | awk '{print $5}')"
\ No newline at end of file
@@ -2,10 +2,15 @@ import streamlit as st
 import requests
 import json
 import re
+import time
 import PyPDF2
 from docx import Document
 import io
 
+# Async job polling (seconds)
+JOB_POLL_INTERVAL = 2
+JOB_POLL_TIMEOUT = 900
+
 # Page config
 st.set_page_config(page_title="AI PPT Generator Chatbot", page_icon="🤖", layout="wide")
 
@@ -238,6 +243,7 @@ if prompt := st.chat_input("Type your message here..."):
                     try:
                         # Call API
                         api_url = "https://lorf2f330g.execute-api.us-west-2.amazonaws.com/prod/generate-ppt"
+                        jobs_url = "https://lorf2f330g.execute-api.us-west-2.amazonaws.com/prod/jobs"
 
                         request_data = {
                             "description": st.session_state.topic,
@@ -298,15 +304,48 @@ API Gateway has a 10MB payload limit. Your document text is too large to send di
                             request_data['csv_data'] = file_b64
                             request_data['file_extension'] = file_extension
 
+                        # Submit as an async job and poll its status, so long generations
+                        # aren't cut off by API Gateway's 29s integration timeout
                         response = requests.post(
-                            api_url,
+                            jobs_url,
                             json=request_data,
                             headers={'Content-Type': 'application/json'},
-                            timeout=120
+                            timeout=30
                         )
 
+                        if response.status_code in (403, 404):
+                            # Backend deployed without the /jobs endpoints: fall back to a blocking call
+                            response = requests.post(
+                                api_url,
+                                json=request_data,
+                                headers={'Content-Type': 'application/json'},
+                                timeout=120
+                            )
+                        elif response.status_code == 202:
+                            job_id = response.json()['job_id']
+                            status_placeholder = st.empty()
+                            deadline = time.time() + JOB_POLL_TIMEOUT
+                            while True:
+                                response = requests.get(f"{jobs_url}/{job_id}", timeout=30)
+                                if response.status_code != 200:
+                                    break
+                                job = response.json()
+                                status_placeholder.caption(
+                                    f"⏳ {job['stage'].replace('_', ' ').capitalize()}... ({int(job['progress'] * 100)}%)"
+                                )
+                                if job['status'] == 'done':
+                                    break
+                                if job['status'] == 'failed':
+                                    raise Exception(job.get('error', 'Generation failed'))
+                                if time.time() > deadline:
+                                    raise requests.Timeout()
+                                time.sleep(JOB_POLL_INTERVAL)
+                            status_placeholder.empty()
+
                         if response.status_code == 200:
                             result = response.json()
+                            if 'result' in result:
+                                result = result['result']
 
                             if 'download_url' in result:
                                 info = result.get('pptx_info', {})
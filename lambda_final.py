@@ -1,38 +1,185 @@
+import abc
 import json
+import urllib.error
 import urllib.request
+import hashlib
+import struct
 import re
 import boto3
 import uuid
 import os
 import base64
 from urllib.parse import urljoin, urlparse, quote, unquote
-from io import BytesIO
+from io import BufferedReader, BytesIO, RawIOBase
+from html.parser import HTMLParser
+import codecs
 import csv
+import random
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+# URL crawling limits (overridable through Lambda environment variables)
+CRAWL_MAX_WORKERS = int(os.environ.get('CRAWL_MAX_WORKERS', '8'))
+CRAWL_PER_HOST_LIMIT = int(os.environ.get('CRAWL_PER_HOST_LIMIT', '2'))
+CRAWL_DEADLINE_SECONDS = float(os.environ.get('CRAWL_DEADLINE_SECONDS', '30'))
+CRAWL_URL_TIMEOUT = 15
+
+# Image acquisition limits
+MAX_IMAGES_TO_SEND = 5  # Images sent to Claude per deck
+IMAGE_MAX_WORKERS = int(os.environ.get('IMAGE_MAX_WORKERS', '8'))
+IMAGE_DEADLINE_SECONDS = float(os.environ.get('IMAGE_DEADLINE_SECONDS', '20'))
+IMAGE_URL_TIMEOUT = 10
+MAX_IMAGE_BYTES = int(3.75 * 1024 * 1024)  # Claude's per-image limit
+IMAGE_PROBE_BYTES = 32 * 1024  # Range request size used to sniff type, size and dimensions
+IMAGE_PROBE_TIMEOUT = 5
+IMAGE_MIN_DIMENSION = 100  # Smaller images are icons, spacers and avatars
+CLAUDE_IMAGE_MAX_EDGE = 1568  # Claude's recommended maximum edge length
+IMAGE_RANK_PIXEL_CAP = CLAUDE_IMAGE_MAX_EDGE * CLAUDE_IMAGE_MAX_EDGE
+IMAGE_DUPLICATE_MAX_DISTANCE = 6  # dHash bits that may differ between near-duplicate images
+
+# Image normalization before sending to Claude and embedding in slides
+SLIDE_IMAGE_WIDTH_INCHES = 3.8  # Width of the picture box on image slides
+SLIDE_IMAGE_MAX_HEIGHT_INCHES = 6.1  # Room below the picture's top edge
+SLIDE_IMAGE_DPI = int(os.environ.get('SLIDE_IMAGE_DPI', '150'))
+IMAGE_OUTPUT_FORMAT = os.environ.get('IMAGE_OUTPUT_FORMAT', 'JPEG').upper()  # JPEG or WEBP for vision input
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '85'))
+
+# HTML extraction budgets per crawled page
+HTML_TEXT_BUDGET = 2000  # Characters of text kept per page
+HTML_IMAGE_TAG_BUDGET = 20  # <img> tags inspected per page
+HTML_IMAGE_BUDGET = 10  # Image candidates kept per page
+HTML_IMAGE_SCAN_BYTES = 512 * 1024  # Extra bytes scanned for images once the text budget is full
+HTML_MAX_BYTES = 5 * 1024 * 1024  # Hard cap on bytes read from one page
+# 'readability' keeps the densest main-content blocks; 'legacy' keeps the first characters of the page
+HTML_EXTRACTION_MODE = os.environ.get('HTML_EXTRACTION_MODE', 'readability').lower()
+
+EXCEL_HEADER_SCAN_ROWS = 11  # Rows read to find the header (title rows, blank rows, then the header)
+
+class ColumnarDataset:
+    """
+    Column-oriented table parsed from an uploaded spreadsheet.
+
+    Holds one NumPy array per column, a kind per column ('numeric', 'date' or
+    'text', as in data_summary['data_types']) and a null mask per column. Chart and
+    analysis code read whole columns; row dicts are only built for JSON samples.
+    """
+
+    def __init__(self, columns, arrays, kinds, nulls):
+        self.columns = columns
+        self.arrays = arrays
+        self.kinds = kinds
+        self.nulls = nulls
+        self.length = len(nulls[columns[0]]) if columns else 0
+        self.row_weight = 1.0  # Rows of the full upload each row stands for (> 1 for sampled datasets)
+
+    @classmethod
+    def from_frame(cls, df):
+        import numpy as np
+        import pandas as pd
+
+        columns = list(df.columns)
+        arrays, kinds, nulls = {}, {}, {}
+        for col in columns:
+            series = df[col]
+            nulls[col] = series.isna().to_numpy()
+            if pd.api.types.is_numeric_dtype(series):
+                kinds[col] = 'numeric'
+                values = np.asarray(series.to_numpy())
+                if nulls[col].any() or values.dtype == object:
+                    values = series.to_numpy(dtype='float64', na_value=np.nan)
+            elif pd.api.types.is_datetime64_any_dtype(series):
+                kinds[col] = 'date'
+                values = series.to_numpy()
+            else:
+                kinds[col] = 'text'
+                values = series.to_numpy(dtype=object)
+            arrays[col] = values
+        return cls(columns, arrays, kinds, nulls)
+
+    @classmethod
+    def from_records(cls, rows):
+        import pandas as pd
+        return cls.from_frame(pd.DataFrame.from_records(rows))
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def nbytes(self):
+        """Bytes held by the column arrays and null masks (object columns count references only)"""
+        return sum(self.arrays[col].nbytes + self.nulls[col].nbytes for col in self.columns)
+
+    def memory_usage(self):
+        """nbytes plus the Python objects (strings) referenced by object columns"""
+        import pandas as pd
+
+        return self.nbytes + sum(
+            pd.Series(self.arrays[col]).memory_usage(deep=True, index=False) - self.arrays[col].nbytes
+            for col in self.columns if self.arrays[col].dtype == object
+        )
+
+    def strings(self, col, indices=None):
+        """A column as display strings (object array, None for nulls)"""
+        import pandas as pd
+
+        values = self.arrays[col] if indices is None else self.arrays[col][indices]
+        nulls = self.nulls[col] if indices is None else self.nulls[col][indices]
+        strings = pd.Series(values, dtype=None if self.kinds[col] == 'date' else object).astype(str).to_numpy(dtype=object)
+        strings[nulls] = None
+        return strings
+
+    def numbers(self, col):
+        """A column as float64 (NaN for nulls and non-numeric values)"""
+        import numpy as np
+        import pandas as pd
+
+        if self.kinds[col] == 'numeric':
+            return self.arrays[col].astype('float64')
+        if self.kinds[col] == 'date':
+            return np.full(self.length, np.nan)
+        return pd.to_numeric(pd.Series(self.arrays[col]), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+
+    def rows(self, indices):
+        """Materialize the selected rows (slice or index array) as JSON-friendly dicts"""
+        import datetime
+        import numpy as np
 
-def parse_excel_data(file_content, file_extension):
-    """Parse Excel/CSV data and return structured information"""
+        indices = np.arange(self.length)[indices] if isinstance(indices, slice) else np.asarray(indices, dtype=int)
+        columns = []
+        for col in self.columns:
+            values = self.strings(col, indices) if self.kinds[col] == 'date' else self.arrays[col][indices].tolist()
+            columns.append([
+                None if null else (str(value) if isinstance(value, datetime.date) else value)
+                for value, null in zip(values, self.nulls[col][indices])
+            ])
+        return [dict(zip(self.columns, row)) for row in zip(*columns)]
+
+def parse_excel_data(file_content, file_extension, sheet_name=0):
+    """Parse Excel/CSV data (one sheet of a workbook, the first by default) and return structured information"""
     try:
         import pandas as pd
         from io import BytesIO
 
         # Determine file type and parse accordingly
         if file_extension in ['.xlsx', '.xls']:
-            # Excel file - skip empty rows at top
-            df = pd.read_excel(BytesIO(file_content))
-
-            # Find the actual header row (look for row with most non-null values)
-            header_row = None
-            for idx in range(min(10, len(df))):  # Check first 10 rows
-                row = df.iloc[idx]
-                non_null_count = row.notna().sum()
-                if non_null_count >= 3:  # At least 3 columns with data
+            # Excel file - skip title/empty rows at top. The header row is found on a
+            # small preview, so the workbook is only parsed in full once.
+            preview = pd.read_excel(BytesIO(file_content), sheet_name=sheet_name, header=None, nrows=EXCEL_HEADER_SCAN_ROWS)
+
+            # Find the actual header row (first row with at least 3 columns with data)
+            header_row = 0
+            for idx in range(len(preview)):
+                if preview.iloc[idx].notna().sum() >= 3:
                     header_row = idx
                     break
 
-            # Re-read with correct header
-            if header_row is not None and header_row > 0:
-                print(f"Detected header at row {header_row}, re-reading Excel...")
-                df = pd.read_excel(BytesIO(file_content), header=header_row)
+            if header_row > 0:
+                print(f"Detected header at row {header_row}")
+            df = pd.read_excel(BytesIO(file_content), sheet_name=sheet_name, header=header_row)
         else:
             # CSV file
             df = pd.read_csv(BytesIO(file_content))
@@ -53,50 +200,38 @@ def parse_excel_data(file_content, file_extension):
             print("DataFrame is empty after cleaning")
             return None, None
 
-        # Convert to list of dictionaries
-        rows = df.to_dict('records')
+        # Keep the data column-oriented; row dicts are only built for the JSON sample
+        dataset = ColumnarDataset.from_frame(df)
+        del df
 
         # Get column names (excluding Unnamed columns if possible)
-        columns = list(df.columns)
+        columns = dataset.columns
 
         # If we have mostly "Unnamed" columns, the file structure is problematic
         unnamed_count = sum(1 for col in columns if str(col).startswith('Unnamed'))
         if unnamed_count > len(columns) / 2:
             print(f"Warning: {unnamed_count}/{len(columns)} columns are 'Unnamed' - Excel structure may be incorrect")
 
-        # Convert any datetime objects in rows to strings for JSON serialization
-        import datetime
-        for row in rows:
-            for key, value in list(row.items()):
-                if isinstance(value, (datetime.datetime, datetime.date, pd.Timestamp)):
-                    row[key] = str(value)
-                elif pd.isna(value):
-                    row[key] = None
-
-        # Analyze data
+        # Analyze data (dates as strings and NaN as None in the JSON sample)
+        sample_rows = dataset.rows(slice(0, 5))
         data_summary = {
             'columns': columns,
-            'row_count': len(rows),
-            'sample_data': rows[:5],  # First 5 rows
-            'data_types': {}
+            'row_count': len(dataset),
+            'sample_data': sample_rows,  # First 5 rows
+            'data_types': dict(dataset.kinds)  # numeric/date/text from the pandas dtypes
         }
 
-        # Detect numeric columns using pandas dtypes
-        for col in columns:
-            if pd.api.types.is_numeric_dtype(df[col]):
-                data_summary['data_types'][col] = 'numeric'
-            elif pd.api.types.is_datetime64_any_dtype(df[col]):
-                data_summary['data_types'][col] = 'date'
-            else:
-                data_summary['data_types'][col] = 'text'
-
         # Debug logging
         print(f"Detected columns: {columns}")
         print(f"Data types: {data_summary['data_types']}")
-        print(f"Sample row 0: {rows[0] if rows else 'None'}")
-        print(f"Sample row 1: {rows[1] if len(rows) > 1 else 'None'}")
+        print(f"Sample row 0: {sample_rows[0] if sample_rows else 'None'}")
+        print(f"Sample row 1: {sample_rows[1] if len(sample_rows) > 1 else 'None'}")
+        print(f"Columnar dataset: {len(dataset)} rows, {dataset.nbytes} array bytes")
 
-        return data_summary, rows
+        data_summary['profile'] = profile_dataset(dataset)
+        print(f"Candidate visualizations: {format_candidates(data_summary['profile']['candidates'])}")
+
+        return data_summary, dataset
     except Exception as e:
         print(f"Error parsing Excel/CSV: {str(e)}")
         return None, None
@@ -109,20 +244,819 @@ def parse_csv_data(csv_content):
         print(f"Error parsing CSV: {str(e)}")
         return None, None
 
-def generate_chart_with_matplotlib(data_rows, x_column, y_column, chart_type='line'):
-    """Generate a chart from data using matplotlib"""
+# Multi-sheet workbooks: every sheet is parsed and profiled on capped worker processes under a
+# global time and memory budget; the most chart-worthy sheets are merged for the analysis
+EXCEL_SHEET_WORKERS = int(os.environ.get('EXCEL_SHEET_WORKERS', str(min(4, os.cpu_count() or 1))))
+EXCEL_MAX_SHEETS = int(os.environ.get('EXCEL_MAX_SHEETS', '24'))  # Sheets past this are not read
+EXCEL_PARSE_TIME_BUDGET = float(os.environ.get('EXCEL_PARSE_TIME_BUDGET', '20'))  # Seconds for all sheets
+# Memory for the parsed sheets plus the workers still parsing: half the function's memory, the
+# rest is left for the runtime, the deck and the images
+EXCEL_MEMORY_BUDGET_BYTES = int(os.environ.get(
+    'EXCEL_MEMORY_BUDGET_BYTES', str(int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '1024')) * 1024 * 1024 // 2)
+))
+EXCEL_WORKER_MEMORY_FACTOR = 4  # Worker peak per byte of uncompressed sheet XML (DataFrame, dataset, pickled reply)
+EXCEL_WORKER_BASE_BYTES = 8 * 1024 * 1024
+EXCEL_CHART_SHEETS = int(os.environ.get('EXCEL_CHART_SHEETS', '3'))  # Sheets whose profiles go to the analysis
+
+def sheet_chart_score(data_summary):
+    """How chart-worthy a parsed sheet is: its best candidate, plus a little for more candidates and rows"""
+    candidates = data_summary['profile']['candidates']
+    if not candidates:
+        return 0.0
+    return round(candidates[0]['score'] + 0.1 * min(len(candidates), 5) + 0.5 * min(data_summary['row_count'], 1000) / 1000, 3)
+
+def sheet_worker(conn, file_content, file_extension, sheet_name):
+    """Workbook sheet worker: parse one sheet and send (data_summary, dataset) back over the pipe"""
+    conn.send(parse_excel_data(file_content, file_extension, sheet_name))
+    conn.close()
+
+def sheet_memory_estimates(workbook, file_content, sheet_names):
+    """
+    Rough peak memory of parsing each sheet in a worker: EXCEL_WORKER_MEMORY_FACTOR times
+    the uncompressed size of its worksheet XML plus the shared strings every worker
+    loads. Sheets that cannot be sized that way (.xls) count the whole file instead.
+    """
+    import zipfile
+
+    estimates = {name: EXCEL_WORKER_BASE_BYTES + EXCEL_WORKER_MEMORY_FACTOR * len(file_content) for name in sheet_names}
+    try:
+        with zipfile.ZipFile(BytesIO(file_content)) as package:
+            sizes = {info.filename: info.file_size for info in package.infolist()}
+        shared_strings = sizes.get('xl/sharedStrings.xml', 0)
+        for name in sheet_names:
+            path = getattr(workbook.book[name], '_worksheet_path', None)
+            if path in sizes:
+                estimates[name] = EXCEL_WORKER_BASE_BYTES + EXCEL_WORKER_MEMORY_FACTOR * (sizes[path] + shared_strings)
+    except Exception as e:
+        print(f"Sizing sheets from the workbook file instead of the sheet XML: {str(e)}")
+    return estimates
+
+def parse_workbook_sheets(file_content, file_extension, sheet_names, estimates):
+    """
+    Parse and profile each sheet in its own forked worker, at most EXCEL_SHEET_WORKERS
+    at a time. A sheet starts only while the parsed sheets plus the estimated peak of
+    the workers still running and of the new one (see sheet_memory_estimates) fit in
+    EXCEL_MEMORY_BUDGET_BYTES; a sheet that does not fit even with no worker running is
+    skipped. No sheet starts after EXCEL_PARSE_TIME_BUDGET, and workers still parsing at
+    the deadline are terminated (threads could not be stopped, and would keep running
+    into the next warm invocation). The first sheet is always parsed and waited for.
+    EXCEL_SHEET_WORKERS=1 parses the sheets in this process.
+
+    Returns ({sheet: (data_summary, dataset)}, {sheet: status}).
+    """
+    from multiprocessing.connection import wait as wait_for_connections
+
+    deadline = time.monotonic() + EXCEL_PARSE_TIME_BUDGET
+    parsed = {}
+    status = {}
+    queued = list(sheet_names)
+    running = {}
+    memory_used = 0
+
+    def next_sheet():
+        """Pop the next queued sheet that may start now, or None to wait (or stop)"""
+        in_flight = sum(estimates[name] for name, _ in running.values())
+        while queued:
+            if not parsed and not running:
+                return queued.pop(0)
+            if time.monotonic() >= deadline:
+                return None
+            if memory_used + in_flight + estimates[queued[0]] <= EXCEL_MEMORY_BUDGET_BYTES:
+                return queued.pop(0)
+            if running:
+                return None
+            # Nothing left to finish and free up, so this sheet will never fit
+            name = queued.pop(0)
+            status[name] = 'skipped: memory budget'
+            print(f"Skipping sheet {name}: about {estimates[name]} bytes to parse, "
+                  f"{EXCEL_MEMORY_BUDGET_BYTES - memory_used} bytes of budget left")
+        return None
+
+    def record(name, result):
+        nonlocal memory_used
+        data_summary, dataset = result
+        if data_summary and dataset:
+            parsed[name] = (data_summary, dataset)
+            memory_used += dataset.memory_usage()
+            status[name] = 'parsed'
+        else:
+            status[name] = 'empty'
+
+    if EXCEL_SHEET_WORKERS <= 1:
+        name = next_sheet()
+        while name is not None:
+            record(name, parse_excel_data(file_content, file_extension, name))
+            name = next_sheet()
+    else:
+        # Pipes rather than ProcessPoolExecutor, as for the chart pool: Lambda has no /dev/shm
+        context = multiprocessing.get_context('fork')
+        try:
+            while queued or running:
+                name = next_sheet() if len(running) < EXCEL_SHEET_WORKERS else None
+                while name is not None:
+                    parent_conn, child_conn = context.Pipe(duplex=False)
+                    process = context.Process(target=sheet_worker, args=(child_conn, file_content, file_extension, name),
+                                              daemon=True)
+                    process.start()
+                    child_conn.close()
+                    running[parent_conn] = (name, process)
+                    name = next_sheet() if len(running) < EXCEL_SHEET_WORKERS else None
+                if not running:
+                    break
+                timeout = max(0.0, deadline - time.monotonic()) if parsed else None
+                ready = wait_for_connections(list(running), timeout=timeout)
+                if not ready:
+                    print(f"Workbook time budget of {EXCEL_PARSE_TIME_BUDGET}s spent with {len(running)} sheets still parsing")
+                    for name, _ in running.values():
+                        status[name] = 'skipped: time budget'
+                    break
+                for conn in ready:
+                    name, process = running.pop(conn)
+                    try:
+                        result = conn.recv()
+                    except EOFError:
+                        print(f"Sheet worker for {name} exited without a result")
+                        result = (None, None)
+                    conn.close()
+                    process.join()
+                    record(name, result)
+        finally:
+            # Stops the workers cut off by the deadline, or by an error in this loop
+            for conn, (name, process) in running.items():
+                process.terminate()
+                conn.close()
+                status.setdefault(name, 'failed')
+
+    for name in queued:
+        status[name] = 'skipped: time budget'
+    print(f"Parsed {len(parsed)}/{len(sheet_names)} sheets, {memory_used} bytes")
+    return parsed, status
+
+def merge_sheet_summaries(parsed, selected, other_sheets):
+    """
+    One compact data summary for the analysis from the selected sheets: columns and
+    profile entries are qualified as "Sheet / Column", and the candidates are taken
+    round-robin across sheets (best of each first) and tagged with their sheet.
+    """
+    columns = []
+    data_types = {}
+    profile_columns = {}
+    correlations = []
+    sheet_candidates = []
+    for name in selected:
+        data_summary = parsed[name][0]
+        profile = data_summary['profile']
+        for col in data_summary['columns']:
+            key = f"{name} / {col}"
+            columns.append(key)
+            data_types[key] = data_summary['data_types'][col]
+            profile_columns[key] = profile['columns'][col]
+        correlations.extend((f"{name} / {x}", f"{name} / {y}", r) for x, y, r in profile['correlations'])
+        sheet_candidates.append([dict(c, sheet=name, title=f"{c['title']} ({name})") for c in profile['candidates']])
+
+    candidates = []
+    for rank in range(max((len(c) for c in sheet_candidates), default=0)):
+        candidates.extend(c[rank] for c in sheet_candidates if rank < len(c))
+
+    return {
+        'columns': columns,
+        'row_count': sum(parsed[name][0]['row_count'] for name in selected),
+        'sample_data': parsed[selected[0]][0]['sample_data'],
+        'data_types': data_types,
+        'profile': {
+            'columns': profile_columns,
+            'correlations': sorted(correlations, key=lambda c: -abs(c[2]))[:5],
+            'candidates': candidates[:PROFILE_MAX_CANDIDATES],
+            'other_sheets': other_sheets
+        }
+    }
+
+def parse_workbook(file_content, file_extension):
+    """
+    Parse every sheet of an Excel workbook (up to EXCEL_MAX_SHEETS), profile each and
+    merge the EXCEL_CHART_SHEETS most chart-worthy sheets into one data summary.
+
+    Returns (data_summary, datasets) where datasets maps sheet name to its
+    ColumnarDataset; data_summary['primary_sheet'] is the best sheet and
+    data_summary['sheets'] lists every sheet with its status and score. Workbooks with
+    one sheet keep parse_excel_data's summary as is.
+    """
+    try:
+        import pandas as pd
+        from io import BytesIO
+
+        with pd.ExcelFile(BytesIO(file_content)) as workbook:
+            sheet_names = list(workbook.sheet_names)
+            estimates = sheet_memory_estimates(workbook, file_content, sheet_names[:EXCEL_MAX_SHEETS])
+    except Exception as e:
+        print(f"Error reading workbook sheets: {str(e)}")
+        return None, {}
+
+    if len(sheet_names) <= 1:
+        data_summary, dataset = parse_excel_data(file_content, file_extension)
+        if not data_summary:
+            return None, {}
+        data_summary['primary_sheet'] = sheet_names[0] if sheet_names else None
+        return data_summary, {data_summary['primary_sheet']: dataset}
+
+    print(f"Workbook has {len(sheet_names)} sheets: {sheet_names}")
+    parsed, status = parse_workbook_sheets(file_content, file_extension, sheet_names[:EXCEL_MAX_SHEETS], estimates)
+    for name in sheet_names[EXCEL_MAX_SHEETS:]:
+        status[name] = 'skipped: sheet limit'
+    if not parsed:
+        return None, {}
+
+    # Most chart-worthy first; ties keep the workbook order
+    scores = {name: sheet_chart_score(parsed[name][0]) for name in parsed}
+    ranked = sorted(parsed, key=lambda name: (-scores[name], sheet_names.index(name)))
+    selected = [name for name in ranked if scores[name] > 0][:EXCEL_CHART_SHEETS] or ranked[:1]
+
+    sheets = []
+    other_sheets = []
+    for name in sheet_names:
+        row_count = parsed[name][0]['row_count'] if name in parsed else None
+        sheets.append({'name': name, 'status': status.get(name), 'rows': row_count,
+                       'score': scores.get(name), 'selected': name in selected})
+        if name in parsed and name not in selected:
+            other_sheets.append(f"{name} ({row_count} rows, {len(parsed[name][0]['columns'])} columns)")
+    print(f"Sheets selected for charts: {selected} (scores {[scores[name] for name in selected]})")
+
+    data_summary = merge_sheet_summaries(parsed, selected, other_sheets)
+    data_summary['sheets'] = sheets
+    data_summary['primary_sheet'] = selected[0]
+    print(f"Candidate visualizations: {format_candidates(data_summary['profile']['candidates'])}")
+    return data_summary, {name: parsed[name][1] for name in selected}
+
+# Streaming CSV ingestion: CSV uploads at least this large (decoded) are parsed in chunks.
+# Uploads arrive base64 in the request body, which Lambda caps at 6 MB (about 4.4 MB decoded)
+# and the UI at 3 MB decoded, so the default has to sit below both to ever apply.
+CSV_STREAM_MIN_BYTES = int(os.environ.get('CSV_STREAM_MIN_BYTES', str(2 * 1024 * 1024)))
+CSV_CHUNK_ROWS = int(os.environ.get('CSV_CHUNK_ROWS', '50000'))
+CSV_SERIES_ROWS = 5000  # Evenly spaced rows kept for charting
+CSV_RESERVOIR_ROWS = 10  # Uniform random rows shown to Claude next to the column statistics
+CSV_TOP_K = 5  # Most frequent values reported per text column
+CSV_TOP_K_CAPACITY = 1000  # Values tracked per text column before the rarest are pruned
+
+class Base64Stream(RawIOBase):
+    """Readable binary stream that decodes a base64 string a block at a time"""
+
+    BLOCK_CHARS = 4 * 65536
+
+    def __init__(self, text):
+        self.text = text
+        self.position = 0
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while len(self.buffer) < len(target) and self.position < len(self.text):
+            block = self.text[self.position:self.position + self.BLOCK_CHARS]
+            self.position += len(block)
+            self.buffer += base64.b64decode(block)
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+class HyperLogLog:
+    """Distinct-count sketch over 64-bit hashes: 2**p registers, about 1.04/sqrt(2**p) relative error"""
+
+    def __init__(self, p=12):
+        import numpy as np
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        import numpy as np
+
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.intp)
+        rest = (hashes & np.uint64((1 << (64 - self.p)) - 1)).astype(np.float64)  # Exact: fewer than 53 bits
+        # Rank = position of the leftmost 1-bit in the remaining 64 - p bits (frexp gives the bit length)
+        rank = (64 - self.p) - np.frexp(rest)[1] + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def estimate(self):
+        import numpy as np
+
+        m = len(self.registers)
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(int)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return int(round(m * np.log(m / zeros)))  # Linear counting for small cardinalities
+        return int(round(raw))
+
+class StreamingColumnStats:
+    """
+    Running statistics for one CSV column across chunks: count, nulls, a distinct-count
+    sketch, min/max/mean while the column is numeric, and approximate top values
+    otherwise (counts are lower bounds once rare values have been pruned).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.nulls = 0
+        self.numeric = True
+        self.numeric_count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.distinct = HyperLogLog()
+        self.top_counts = None
+
+    def update(self, series):
+        import pandas as pd
+
+        present = series.dropna()
+        self.count += len(present)
+        self.nulls += len(series) - len(present)
+        if not len(present):
+            return
+        self.distinct.add_hashes(pd.util.hash_pandas_object(present, index=False).to_numpy())
+
+        if self.numeric and pd.api.types.is_numeric_dtype(present):
+            values = present.to_numpy(dtype='float64')
+            self.numeric_count += len(values)
+            self.total += float(values.sum())
+            low, high = float(values.min()), float(values.max())
+            self.minimum = low if self.minimum is None else min(self.minimum, low)
+            self.maximum = high if self.maximum is None else max(self.maximum, high)
+        else:
+            # Text values (or a numeric column that turned out to hold text): merge value counts
+            self.numeric = False
+            counts = present.astype(str).value_counts()
+            self.top_counts = counts if self.top_counts is None else self.top_counts.add(counts, fill_value=0)
+            if len(self.top_counts) > CSV_TOP_K_CAPACITY:
+                self.top_counts = self.top_counts.nlargest(CSV_TOP_K_CAPACITY)
+
+    @property
+    def kind(self):
+        return 'numeric' if self.numeric and self.numeric_count else 'text'
+
+    def summary(self):
+        stats = {'count': self.count, 'nulls': self.nulls, 'distinct': self.distinct.estimate()}
+        if self.kind == 'numeric':
+            stats.update(min=self.minimum, max=self.maximum, mean=round(self.total / self.numeric_count, 6))
+        elif self.top_counts is not None and self.top_counts.max() > 1:  # Skip all-unique columns (ids, timestamps)
+            stats['top'] = {value: int(count) for value, count in self.top_counts.nlargest(CSV_TOP_K).items()}
+        return stats
+
+def parse_csv_stream(csv_b64):
+    """
+    Parse a base64 CSV upload in CSV_CHUNK_ROWS chunks with bounded memory.
+
+    The payload is decoded block by block, so neither the decoded bytes nor a full
+    DataFrame are ever held. Per column, running statistics are kept
+    (StreamingColumnStats). Across rows, a reservoir sample of CSV_RESERVOIR_ROWS
+    rows is kept for the prompt, and an evenly spaced sample of at most
+    2 * CSV_SERIES_ROWS rows for charting (the stride doubles whenever it fills up).
+    Returns (data_summary, dataset) like parse_excel_data; the dataset is the evenly
+    spaced sample (row_weight set), and data_summary adds 'column_stats' and
+    'random_sample'.
+    """
+    try:
+        import numpy as np
+        import pandas as pd
+
+        rng = np.random.default_rng(0)  # Deterministic reservoir for identical uploads
+        stats = {}
+        head = None
+        reservoir = None
+        seen = 0  # Non-empty rows so far
+        series_parts, series_rows, stride = [], 0, 1
+
+        chunks = pd.read_csv(BufferedReader(Base64Stream(csv_b64), buffer_size=1024 * 1024), chunksize=CSV_CHUNK_ROWS)
+        for chunk in chunks:
+            chunk = chunk.dropna(axis=0, how='all')
+            if not len(chunk):
+                continue
+            if head is None:
+                head = chunk.head(5)
+            for col in chunk.columns:
+                stats.setdefault(col, StreamingColumnStats()).update(chunk[col])
+
+            # Reservoir sample (Algorithm R, vectorized per chunk)
+            positions = np.arange(seen, seen + len(chunk))
+            if reservoir is None or len(reservoir) < CSV_RESERVOIR_ROWS:
+                fill = CSV_RESERVOIR_ROWS - (0 if reservoir is None else len(reservoir))
+                reservoir = pd.concat([reservoir, chunk.iloc[:fill]]) if reservoir is not None else chunk.iloc[:fill]
+                positions, candidates = positions[fill:], chunk.iloc[fill:]
+            else:
+                candidates = chunk
+            if len(candidates):
+                slots = rng.integers(0, positions + 1)
+                replaced = np.flatnonzero(slots < CSV_RESERVOIR_ROWS)
+                if len(replaced):
+                    # Later rows win a contested slot, as in the sequential algorithm
+                    source = np.arange(len(reservoir))
+                    source[slots[replaced]] = len(reservoir) + np.arange(len(replaced))
+                    reservoir = pd.concat([reservoir, candidates.iloc[replaced]]).iloc[source]
+            seen += len(chunk)
+
+            # Evenly spaced sample by original row number; double the stride when full
+            kept = chunk[chunk.index.to_numpy() % stride == 0]
+            series_parts.append(kept)
+            series_rows += len(kept)
+            while series_rows > 2 * CSV_SERIES_ROWS:
+                stride *= 2
+                series = pd.concat(series_parts)
+                series = series[series.index.to_numpy() % stride == 0]
+                series_parts, series_rows = [series], len(series)
+
+        if head is None:
+            return None, None
+
+        # Drop completely empty columns
+        columns = [col for col in stats if stats[col].count]
+        series = pd.concat(series_parts)[columns].reset_index(drop=True)
+        dataset = ColumnarDataset.from_frame(series)
+        dataset.row_weight = seen / len(series)
+        reservoir = reservoir[columns].sort_index()
+
+        data_summary = {
+            'columns': columns,
+            'row_count': seen,
+            'sample_data': ColumnarDataset.from_frame(head[columns].reset_index(drop=True)).rows(slice(0, 5)),
+            'data_types': {col: stats[col].kind for col in columns},
+            'column_stats': {col: stats[col].summary() for col in columns},
+            'random_sample': ColumnarDataset.from_frame(reservoir.reset_index(drop=True)).rows(slice(None))
+        }
+
+        # Profile the charting sample with the exact whole-file stats; examples come from the reservoir
+        data_summary['profile'] = profile_dataset(dataset, data_summary['column_stats'])
+        for col in columns:
+            examples = [row[col] for row in data_summary['random_sample'] if row[col] is not None][:2]
+            if examples:
+                data_summary['profile']['columns'][col]['examples'] = examples
+
+        print(f"Streamed CSV: {seen} rows, {len(columns)} columns; kept {len(series)} rows for charts "
+              f"(every {stride}), {len(reservoir)} reservoir rows")
+        print(f"Data types: {data_summary['data_types']}")
+        return data_summary, dataset
+    except Exception as e:
+        print(f"Error streaming CSV: {str(e)}")
+        return None, None
+
+# Column profiling: grounds Claude's analysis in computed facts instead of raw rows
+PROFILE_MAX_CANDIDATES = 6
+PROFILE_MAX_CATEGORIES = 50  # Text columns with more distinct values are not bar-chart axes
+PROFILE_DATE_SAMPLE = 1000  # Evenly spaced values checked for date-likeness and time order
+PROFILE_MIN_CORRELATION = 0.5
+MONTH_PATTERN = r'^(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?(?:[\s,-]+\d{2,4})?$'
+DATE_PATTERN = r'^\d{1,4}[-/.]\d{1,2}(?:[-/.]\d{1,4})?(?:[ T]\d{1,2}:\d{2}(?::\d{2})?)?$|^(?:\d{4}[ -]?q[1-4]|q[1-4][ -]?\d{2,4})$'
+MEAN_COLUMN_PATTERN = r'rate|price|avg|average|mean|percent|pct|ratio|score|margin|%'
+ID_COLUMN_PATTERN = r'(?:^|[\s_#-])(?:id|idx|index|row|seq|period|rank|no)$|^#$'
+PROFILE_YEAR_RANGE = (1900, 2100)  # Counting-up whole numbers in this range are years
+
+def profile_time_order(strings):
+    """Parse date-like strings (dates, quarters, month names) to sortable numbers; NaN if unparseable"""
+    import numpy as np
+    import pandas as pd
+
+    series = pd.Series(strings, dtype=object).str.strip().str.lower()
+    months = series.str.extract(r'^([a-z]{3})', expand=False).map(
+        {m: i for i, m in enumerate(['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'])}
+    )
+    years = pd.to_numeric(series.str.extract(r'(\d{4})$', expand=False), errors='coerce').fillna(0)
+    order = (years * 12 + months).to_numpy(dtype='float64', na_value=np.nan)
+
+    quarters = series.str.extract(r'(\d{4})[ -]?q([1-4])|q([1-4])[ -]?(\d{4})')
+    quarter_order = (pd.to_numeric(quarters[0].fillna(quarters[3]), errors='coerce') * 4
+                     + pd.to_numeric(quarters[1].fillna(quarters[2]), errors='coerce'))
+    order = np.where(np.isnan(order), quarter_order.to_numpy(dtype='float64', na_value=np.nan), order)
+
+    remaining = np.isnan(order)
+    if remaining.any():
+        stamps = pd.to_datetime(series[remaining], errors='coerce', format='mixed').to_numpy(dtype='datetime64[ns]')
+        order[remaining] = np.where(np.isnat(stamps), np.nan, stamps.astype('int64'))
+    return order
+
+def profile_dataset(dataset, column_stats=None):
+    """
+    Profile every column of a ColumnarDataset with vectorized NumPy/pandas operations.
+
+    Per column: kind, nulls, distinct count and cardinality ratio, monotonicity,
+    date-likeness of text columns, and for numeric columns min/max/mean, the trend
+    across the rows (fitted slope as a fraction of the mean) and IQR outliers. Also
+    computes the correlation matrix of the numeric columns (strong pairs are kept)
+    and deterministically ranks candidate visualizations. column_stats (from a
+    streamed upload) supplies exact whole-file counts, min/max/mean and examples.
+    """
+    import numpy as np
+    import pandas as pd
+
+    column_stats = column_stats or {}
+    rows = len(dataset)
+    columns = {}
+    numbers = {}
+    for col in dataset.columns:
+        kind = dataset.kinds[col]
+        nulls = dataset.nulls[col]
+        profile = {'kind': kind, 'nulls': int(nulls.sum())}
+        present = np.flatnonzero(~nulls)
+        if kind == 'numeric':
+            numbers[col] = dataset.numbers(col)
+            values = numbers[col][present]
+            values = values[np.isfinite(values)]
+            profile['distinct'] = int(len(np.unique(values)))
+            if len(values):
+                profile.update(min=float(values.min()), max=float(values.max()), mean=float(values.mean()))
+            steps = np.diff(values)
+            if len(steps) and profile['distinct'] > 1:
+                if (steps >= 0).all():
+                    profile['monotonic'] = 'increasing'
+                elif (steps <= 0).all():
+                    profile['monotonic'] = 'decreasing'
+            # Whole numbers counting up by exactly 1 are axes, not measures, when they are row ids
+            # (by name) or years; cumulative counts or a plain 0..n column of units are still measures
+            counts_up = bool(len(steps) and np.all(steps == 1) and np.all(values == np.round(values)))
+            profile['sequential'] = counts_up and bool(
+                re.search(ID_COLUMN_PATTERN, str(col).strip().lower())
+                or PROFILE_YEAR_RANGE[0] <= profile['min'] and profile['max'] <= PROFILE_YEAR_RANGE[1]
+            )
+            if len(values) >= 3 and profile['distinct'] > 1:
+                slope = np.polyfit(np.arange(len(values), dtype='float64'), values, 1)[0]
+                scale = abs(profile['mean']) or float(values.std()) or 1.0
+                profile['trend'] = float(slope * (len(values) - 1) / scale)
+                q1, q3 = np.percentile(values, [25, 75])
+                spread = q3 - q1
+                if spread > 0:
+                    profile['outliers'] = int(((values < q1 - 1.5 * spread) | (values > q3 + 1.5 * spread)).sum())
+            profile['examples'] = [int(v) if float(v).is_integer() else float(f"{v:.4g}") for v in values[:2]]
+        else:
+            strings = pd.Series(dataset.strings(col)[present], dtype=object)
+            profile['distinct'] = int(strings.nunique())
+            step = max(1, len(strings) // PROFILE_DATE_SAMPLE)
+            sample = strings.iloc[::step].str.strip()
+            if kind == 'date':
+                profile['date_like'] = True
+                order = dataset.arrays[col][present][::step].astype('datetime64[ns]').astype('int64').astype('float64')
+            else:
+                lowered = sample.str.lower()
+                matches = lowered.str.match(MONTH_PATTERN) | lowered.str.match(DATE_PATTERN)
+                profile['date_like'] = bool(len(sample) and matches.mean() >= 0.9)
+                order = profile_time_order(sample.to_numpy()) if profile['date_like'] else None
+            if order is not None:
+                order = order[~np.isnan(order)]
+                steps = np.diff(order)
+                if len(steps) and (steps >= 0).all() and (steps > 0).any():
+                    profile['monotonic'] = 'increasing'
+                elif len(steps) and (steps <= 0).all() and (steps < 0).any():
+                    profile['monotonic'] = 'decreasing'
+            profile['examples'] = [str(v)[:40] for v in strings.drop_duplicates().iloc[:2]]
+
+        # Streamed uploads: exact whole-file statistics replace the sample's
+        stats = column_stats.get(col)
+        if stats:
+            profile['nulls'] = stats['nulls']
+            profile['distinct'] = stats['distinct']
+            for key in ('min', 'max', 'mean'):
+                if key in stats:
+                    profile[key] = stats[key]
+            if stats.get('top'):
+                profile['top'] = stats['top']
+        profile['cardinality'] = round(profile['distinct'] / max(1, rows if not stats else stats['count']), 4)
+        columns[col] = profile
+
+    # Correlation matrix of the numeric measures; only strong pairs are reported
+    measures = [col for col in numbers if not columns[col].get('sequential') and columns[col]['distinct'] > 1]
+    correlations = []
+    if len(measures) >= 2 and rows >= 3:
+        matrix = pd.DataFrame({col: numbers[col] for col in measures}).corr().to_numpy()
+        upper = np.triu_indices(len(measures), k=1)
+        for i, j in zip(*upper):
+            r = matrix[i, j]
+            if np.isfinite(r) and abs(r) >= PROFILE_MIN_CORRELATION:
+                correlations.append((measures[i], measures[j], round(float(r), 3)))
+        correlations.sort(key=lambda pair: -abs(pair[2]))
+
+    return {
+        'columns': columns,
+        'correlations': correlations[:5],
+        'candidates': rank_visualizations(dataset, columns, measures, correlations)
+    }
+
+def rank_visualizations(dataset, columns, measures, correlations):
+    """
+    Deterministically rank candidate charts from a column profile: measures over a
+    time axis (line, stronger trends first), measures across a low-cardinality
+    category (bar, with sum/mean aggregation when categories repeat, more varied
+    groups first) and strongly correlated measure pairs (scatter).
+    """
+    import numpy as np
+    import pandas as pd
+
+    # Time axis preference: ordered dates, then sequential years, then row ids and periods, then unordered dates
+    time_axes = ([col for col, p in columns.items() if p.get('date_like') and p.get('monotonic') == 'increasing']
+                 + sorted((col for col, p in columns.items() if p.get('sequential')),
+                          key=lambda col: not PROFILE_YEAR_RANGE[0] <= columns[col]['min'] <= PROFILE_YEAR_RANGE[1])
+                 + [col for col, p in columns.items() if p.get('date_like') and p.get('monotonic') != 'increasing'])
+    categories = [col for col, p in columns.items()
+                  if p['kind'] == 'text' and not p.get('date_like') and 2 <= p['distinct'] <= PROFILE_MAX_CATEGORIES]
+    time_x = time_axes[0] if time_axes else None
+    category_x = min(categories, key=lambda col: columns[col]['distinct']) if categories else None
+
+    candidates = []
+    for order, y in enumerate(measures):
+        if time_x:
+            trend = columns[y].get('trend', 0.0)
+            candidates.append({'x_column': time_x, 'y_column': y, 'chart_type': 'line', 'title': f"{y} over {time_x}",
+                               'score': 2 + min(abs(trend), 1.0), 'reason': f"trend {trend:+.0%}", 'order': order})
+        if category_x:
+            repeats = columns[category_x]['distinct'] < len(dataset) - columns[category_x]['nulls']
+            aggregation = None
+            if repeats:
+                aggregation = 'mean' if re.search(MEAN_COLUMN_PATTERN, str(y), re.IGNORECASE) else 'sum'
+            groups = pd.Series(dataset.numbers(y)).groupby(pd.Series(dataset.strings(category_x))).mean()
+            variation = float(groups.std() / abs(groups.mean())) if len(groups) > 1 and groups.mean() else 0.0
+            candidate = {'x_column': category_x, 'y_column': y, 'chart_type': 'bar',
+                         'title': f"{'Total ' if aggregation == 'sum' else 'Average ' if aggregation == 'mean' else ''}{y} by {category_x}",
+                         'score': 1.5 + min(variation if np.isfinite(variation) else 0.0, 1.0),
+                         'reason': f"{columns[category_x]['distinct']} categories", 'order': order}
+            if aggregation:
+                candidate['aggregation'] = aggregation
+            candidates.append(candidate)
+    for order, (x, y, r) in enumerate(correlations):
+        candidates.append({'x_column': x, 'y_column': y, 'chart_type': 'scatter', 'title': f"{y} vs {x}",
+                           'score': 1 + abs(r), 'reason': f"r={r:+.2f}", 'order': len(measures) + order})
+
+    # Best of each chart type first, then the runners-up, so the top picks cover different views
+    candidates.sort(key=lambda c: (-round(c['score'], 6), c['order']))
+    type_rank = {}
+    for candidate in candidates:
+        candidate['type_rank'] = type_rank[candidate['chart_type']] = type_rank.get(candidate['chart_type'], -1) + 1
+    candidates.sort(key=lambda c: c['type_rank'])
+    ranked = []
+    for candidate in candidates[:PROFILE_MAX_CANDIDATES]:
+        candidate.pop('order')
+        candidate.pop('type_rank')
+        candidate['score'] = round(candidate['score'], 3)
+        ranked.append(candidate)
+    return ranked
+
+def format_profile(profile):
+    """Compact one-line-per-column text rendering of a profile for the analysis prompt"""
+    lines = []
+    for col, p in profile['columns'].items():
+        facts = [p['kind'] + (', date-like' if p.get('date_like') and p['kind'] != 'date' else '')]
+        if p.get('monotonic'):
+            facts.append(f"monotonic {p['monotonic']}")
+        if p.get('sequential'):
+            facts.append('sequential ids/years')
+        facts.append(f"{p['distinct']} distinct")
+        if p['nulls']:
+            facts.append(f"{p['nulls']} nulls")
+        if 'min' in p:
+            facts.append(f"min {p['min']:.4g}, max {p['max']:.4g}, mean {p['mean']:.4g}")
+        if 'trend' in p:
+            facts.append(f"trend {p['trend']:+.0%} over rows")
+        if p.get('outliers'):
+            facts.append(f"{p['outliers']} outliers")
+        if p.get('top'):
+            facts.append('top ' + ', '.join(f"{value} ({count})" for value, count in list(p['top'].items())[:3]))
+        facts.append('e.g. ' + ', '.join(json.dumps(value) for value in p['examples']))
+        lines.append(f"- {col}: " + '; '.join(facts))
+    if profile['correlations']:
+        lines.append('Strong correlations: ' + ', '.join(f"{x} ~ {y} (r={r:+.2f})" for x, y, r in profile['correlations']))
+    if profile.get('other_sheets'):
+        lines.append('Other sheets (not profiled here): ' + ', '.join(profile['other_sheets']))
+    return '\n'.join(lines)
+
+def profile_insights(profile, row_count, limit=3):
+    """
+    Insights and slide bullets computed directly from a profile: the strongest trends,
+    correlations, outliers and most frequent categories. Used alongside a cached
+    visualization plan so every quoted figure comes from the current upload.
+    Returns (insights, slide_content).
+    """
+    findings = []  # (weight, text)
+    for col, p in profile['columns'].items():
+        if p['kind'] != 'numeric' or p.get('sequential') or 'mean' not in p:
+            continue
+        trend = p.get('trend', 0.0)
+        if abs(trend) >= 0.05:
+            findings.append((abs(trend), f"{col} {'rose' if trend > 0 else 'fell'} by about {abs(trend):.0%} across the data "
+                                         f"(min {p['min']:,.4g}, max {p['max']:,.4g}, mean {p['mean']:,.4g})"))
+        if p.get('outliers'):
+            findings.append((0.1 + p['outliers'] / max(1, row_count), f"{col} has {p['outliers']} outlying values"))
+    for x, y, r in profile['correlations']:
+        findings.append((abs(r) / 2, f"{x} and {y} are {'positively' if r > 0 else 'negatively'} correlated (r={r:+.2f})"))
+    for col, p in profile['columns'].items():
+        if p.get('top'):
+            value, count = next(iter(p['top'].items()))
+            findings.append((0.05, f"{value} is the most frequent {col} ({count:,} rows)"))
+    findings.sort(key=lambda finding: -finding[0])
+
+    overview = f"{row_count:,} rows across {len(profile['columns'])} columns"
+    insights = [text for _, text in findings[:limit]]
+    return insights or [f"The data has {overview}"], [overview] + insights[:limit - 1]
+
+def format_candidates(candidates):
+    if not candidates:
+        return '(none)'
+    return '\n'.join(
+        f"{i}. {c['chart_type']}: " + (f"sheet={c['sheet']}, " if c.get('sheet') else '') + f"x={c['x_column']}, y={c['y_column']}"
+        + (f", aggregation={c['aggregation']}" if c.get('aggregation') else '') + f" - {c['title']} ({c['reason']})"
+        for i, c in enumerate(candidates, 1)
+    )
+
+def resolve_visualizations(visualizations, candidates):
+    """Expand {"candidate": n, "title": ...} picks into full visualization specs; explicit specs pass through"""
+    resolved = []
+    for viz in visualizations or []:
+        if not isinstance(viz, dict):
+            continue
+        if viz.get('candidate') is not None:
+            try:
+                number = int(viz['candidate'])
+                if number < 1:
+                    raise IndexError(number)
+                candidate = candidates[number - 1]
+            except (ValueError, TypeError, IndexError):
+                print(f"Ignoring unknown visualization candidate: {viz}")
+                continue
+            spec = {key: value for key, value in candidate.items() if key not in ('score', 'reason')}
+            if viz.get('title'):
+                spec['title'] = viz['title']
+            resolved.append(spec)
+        elif viz.get('x_column') and viz.get('y_column'):
+            resolved.append(viz)
+    return resolved
+
+# Chart palette, shared by the matplotlib previews and the native PowerPoint charts
+CHART_PRIMARY_COLOR = '#1F3864'  # Dark blue (matches slide title color)
+CHART_ACCENT_COLOR = '#3A7BD5'   # Lighter blue for highlights
+CHART_TEXT_COLOR = '#404040'
+CHART_AXIS_COLOR = '#CCCCCC'
+
+# Editable python-pptx charts in the deck; matplotlib only renders the preview Claude sees
+NATIVE_CHARTS = os.environ.get('NATIVE_CHARTS', 'true').lower() != 'false'
+# Off by default: Claude gets describe_chart text, so no matplotlib import or PNG render per chart
+CHART_VISION_PREVIEW = os.environ.get('CHART_VISION_PREVIEW', 'false').lower() == 'true'
+CHART_MAX_POINTS = int(os.environ.get('CHART_MAX_POINTS', '100'))  # Line/scatter points after LTTB downsampling
+CHART_MAX_BARS = int(os.environ.get('CHART_MAX_BARS', '20'))
+CHART_MARKER_MAX_POINTS = 30  # Denser series are drawn without (or with smaller) markers
+# Previews render inline by default: on 1-2 vCPU Lambdas the pool measured 0.9-1.1x of inline
+# (benchmarks/bench_charts.py). Set CHART_RENDER_WORKERS > 1 where it proves faster.
+CHART_RENDER_WORKERS = int(os.environ.get('CHART_RENDER_WORKERS', '1'))
+CHART_RENDER_TIMEOUT = float(os.environ.get('CHART_RENDER_TIMEOUT', '20'))  # Seconds before the pool is abandoned
+
+def lttb_indices(x, y, target):
+    """
+    Largest-Triangle-Three-Buckets downsampling: indices of `target` points that keep
+    the visual shape of the (x, y) series. Keeps the first and last point; from each
+    bucket in between, picks the point forming the largest triangle with the previously
+    picked point and the average of the next bucket. Linear in len(x).
+    """
+    import numpy as np
+
+    n = len(y)
+    if target >= n or target < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, target - 1).astype(int)  # target - 2 buckets over the middle points
+    selected = np.empty(target, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(target - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+def extract_chart_series(dataset, x_column, y_column, chart_type='line', aggregation=None, max_points=None):
+    """
+    Resolve the chart's columns in the data and extract clean (x, y) points.
+
+    Reads whole columns of a ColumnarDataset (a list of row dicts is converted
+    first). With aggregation ('sum' or 'mean'), rows
+    sharing an x value are combined. Series longer than the target are reduced to
+    represent the whole dataset: line and scatter charts with LTTB, bar charts by
+    keeping the largest categories. Returns a chart spec dict (chart_type, x_values,
+    y_values, x_label, y_label, title, source_points) used by both render_chart_png
+    and add_native_chart, or None if there is not enough data.
+    """
     try:
-        import matplotlib
-        matplotlib.use('Agg')  # Non-interactive backend
-        import matplotlib.pyplot as plt
         import numpy as np
+        import pandas as pd
+
+        if not isinstance(dataset, ColumnarDataset):
+            dataset = ColumnarDataset.from_records(dataset)
 
         # Check if columns exist (case-insensitive match)
-        if not data_rows:
+        if not len(dataset):
             print("No data rows provided")
             return None
 
-        available_columns = list(data_rows[0].keys())
+        available_columns = dataset.columns
         print(f"Available columns in data: {available_columns}")
 
         # Try to find matching column names (case-insensitive)
@@ -151,65 +1085,95 @@ def generate_chart_with_matplotlib(data_rows, x_column, y_column, chart_type='li
 
         print(f"Using columns: X='{actual_x_col}', Y='{actual_y_col}'")
 
-        # Extract and clean data
-        x_values = []
-        y_values = []
+        # Extract and clean data: numeric y, non-empty x (as string for the categorical axis)
+        x_series = pd.Series(dataset.strings(actual_x_col))
+        y_series = pd.Series(dataset.numbers(actual_y_col))
+        valid = x_series.notna() & y_series.notna()
+        if dataset.kinds[actual_x_col] == 'text':
+            x_series = x_series.where(x_series.isna(), x_series.str.strip())
+            valid &= ~x_series.str.lower().isin(['none', 'nan', ''])
+        series = pd.DataFrame({'x': x_series[valid], 'y': y_series[valid]})
+        source_points = len(series)
+
+        if aggregation in ('sum', 'mean') and series['x'].duplicated().any():
+            series = series.groupby('x', sort=False)['y'].agg(aggregation).reset_index()
+            if aggregation == 'sum':
+                series['y'] *= dataset.row_weight  # Scale sums over a sample up to the full upload
+            print(f"Aggregated {source_points} rows into {len(series)} {aggregation} values by '{actual_x_col}'")
 
-        for row in data_rows:
-            x_val = row.get(actual_x_col)
-            y_val = row.get(actual_y_col)
+        # Check if we have enough data
+        print(f"Extracted {len(series)} valid data points")
+        if len(series) > 0:
+            print(f"  Sample X values: {series['x'].head(3).tolist()}")
+            print(f"  Sample Y values: {series['y'].head(3).tolist()}")
 
-            # Skip rows with missing data
-            if x_val is None or y_val is None:
-                continue
+        if len(series) < 2:
+            print(f"Not enough valid data points for chart: {len(series)} points (need at least 2)")
+            return None
 
-            # Convert to appropriate types
-            try:
-                # Convert y to float, skip if not numeric
-                y_float = float(y_val)
-                if np.isnan(y_float):
-                    continue
-
-                # Convert x to string for categorical axis
-                x_str = str(x_val).strip()
-                if not x_str or x_str.lower() in ['none', 'nan', '']:
-                    continue
-
-                x_values.append(x_str)
-                y_values.append(y_float)
-            except (ValueError, TypeError):
-                continue
+        # Reduce to a readable number of points that still covers the whole dataset
+        if max_points is None:
+            max_points = CHART_MAX_BARS if chart_type == 'bar' else CHART_MAX_POINTS
+        if len(series) > max_points:
+            if chart_type == 'bar':
+                # Keep the largest categories, in their original order
+                keep = np.sort(np.argsort(-series['y'].to_numpy(), kind='stable')[:max_points])
+            else:
+                # Numeric x keeps its spacing; categorical x (dates, labels) is spaced by position
+                if dataset.kinds[actual_x_col] == 'numeric':
+                    x_axis = pd.to_numeric(series['x']).to_numpy(dtype='float64')
+                else:
+                    x_axis = np.arange(len(series), dtype=float)
+                keep = lttb_indices(x_axis, series['y'].to_numpy(), max_points)
+            print(f"Downsampled {len(series)} points to {len(keep)} for the {chart_type} chart")
+            series = series.iloc[keep]
 
-        # Check if we have enough data
-        print(f"Extracted {len(x_values)} valid data points")
-        if len(x_values) > 0:
-            print(f"  Sample X values: {x_values[:3]}")
-            print(f"  Sample Y values: {y_values[:3]}")
+        return {
+            'chart_type': chart_type,
+            'x_values': series['x'].tolist(),
+            'y_values': series['y'].tolist(),
+            'x_label': x_column,
+            'y_label': y_column,
+            'title': f'{y_column} by {x_column}',
+            'source_points': source_points
+        }
+    except Exception as e:
+        print(f"Error extracting chart data: {str(e)}")
+        return None
 
-        if len(x_values) < 2:
-            print(f"Not enough valid data points for chart: {len(x_values)} points (need at least 2)")
-            return None
+def render_chart_png(chart):
+    """
+    Render a chart spec (see extract_chart_series) to PNG bytes with matplotlib.
+
+    Uses the object-oriented Figure/FigureCanvasAgg API rather than pyplot, so no
+    global figure state is shared between renders (threads or pool workers).
+    """
+    try:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-        # Limit to first 20 data points for readability
-        if len(x_values) > 20:
-            x_values = x_values[:20]
-            y_values = y_values[:20]
+        chart_type = chart['chart_type']
+        x_values = chart['x_values']
+        y_values = chart['y_values']
+        x_column = chart['x_label']
+        y_column = chart['y_label']
 
         # Create figure with professional styling
-        fig, ax = plt.subplots(figsize=(10, 6))
+        fig = Figure(figsize=(10, 6))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
 
         # Professional color palette
-        primary_color = '#1F3864'    # Dark blue (matches slide title color)
-        accent_color = '#3A7BD5'     # Lighter blue for highlights
+        primary_color = CHART_PRIMARY_COLOR
+        accent_color = CHART_ACCENT_COLOR
+        dense = len(x_values) > CHART_MARKER_MAX_POINTS
 
         if chart_type == 'line':
-            # Line chart with professional styling
+            # Line chart with professional styling (markers only while they stay legible)
             ax.plot(range(len(x_values)), y_values,
-                   marker='o', linewidth=2.5, markersize=8,
+                   marker=None if dense else 'o', linewidth=2.5, markersize=8,
                    color=primary_color, markerfacecolor=accent_color,
                    markeredgewidth=2, markeredgecolor=primary_color)
-            ax.set_xticks(range(len(x_values)))
-            ax.set_xticklabels(x_values)
         elif chart_type == 'bar':
             # Bar chart with professional styling
             bars = ax.bar(range(len(x_values)), y_values, color=primary_color, alpha=0.8)
@@ -217,20 +1181,21 @@ def generate_chart_with_matplotlib(data_rows, x_column, y_column, chart_type='li
             max_idx = y_values.index(max(y_values))
             bars[max_idx].set_color(accent_color)
             bars[max_idx].set_alpha(1.0)
-            ax.set_xticks(range(len(x_values)))
-            ax.set_xticklabels(x_values)
         elif chart_type == 'scatter':
             # Scatter chart with professional styling
-            ax.scatter(range(len(x_values)), y_values, s=120,
-                      color=primary_color, alpha=0.7, edgecolors=accent_color, linewidths=2)
-            ax.set_xticks(range(len(x_values)))
-            ax.set_xticklabels(x_values)
+            ax.scatter(range(len(x_values)), y_values, s=30 if dense else 120,
+                      color=primary_color, alpha=0.7, edgecolors=accent_color, linewidths=1 if dense else 2)
+
+        # Label at most CHART_MAX_BARS ticks so long (downsampled) series stay readable
+        step = max(1, -(-len(x_values) // CHART_MAX_BARS))
+        ax.set_xticks(range(0, len(x_values), step))
+        ax.set_xticklabels(x_values[::step])
 
         # Professional axis styling
-        ax.set_xlabel(x_column, fontsize=11, fontweight='normal', color='#404040')
-        ax.set_ylabel(y_column, fontsize=11, fontweight='normal', color='#404040')
-        ax.set_title(f'{y_column} by {x_column}', fontsize=13, fontweight='bold',
-                    color='#1F3864', pad=15)
+        ax.set_xlabel(x_column, fontsize=11, fontweight='normal', color=CHART_TEXT_COLOR)
+        ax.set_ylabel(y_column, fontsize=11, fontweight='normal', color=CHART_TEXT_COLOR)
+        ax.set_title(chart['title'], fontsize=13, fontweight='bold',
+                    color=CHART_PRIMARY_COLOR, pad=15)
 
         # Minimal gridlines (only horizontal, subtle)
         ax.grid(True, alpha=0.15, axis='y', linestyle='--', linewidth=0.5)
@@ -239,66 +1204,322 @@ def generate_chart_with_matplotlib(data_rows, x_column, y_column, chart_type='li
         # Clean up spines (remove top and right borders)
         ax.spines['top'].set_visible(False)
         ax.spines['right'].set_visible(False)
-        ax.spines['left'].set_color('#CCCCCC')
-        ax.spines['bottom'].set_color('#CCCCCC')
+        ax.spines['left'].set_color(CHART_AXIS_COLOR)
+        ax.spines['bottom'].set_color(CHART_AXIS_COLOR)
 
         # Rotate x-axis labels if needed
         if len(x_values) > 5:
-            plt.xticks(rotation=45, ha='right', fontsize=9)
+            ax.tick_params(axis='x', labelsize=9, labelrotation=45)
+            for label in ax.get_xticklabels():
+                label.set_horizontalalignment('right')
         else:
-            plt.xticks(fontsize=10)
+            ax.tick_params(axis='x', labelsize=10)
 
         # Y-axis formatting
-        plt.yticks(fontsize=10)
+        ax.tick_params(axis='y', labelsize=10)
 
-        plt.tight_layout(pad=1.5)
+        fig.tight_layout(pad=1.5)
 
         # Save to bytes
         img_buffer = BytesIO()
-        plt.savefig(img_buffer, format='png', dpi=150, bbox_inches='tight')
+        fig.savefig(img_buffer, format='png', dpi=150, bbox_inches='tight')
         img_buffer.seek(0)
-        plt.close()
 
         print(f"Successfully generated {chart_type} chart with {len(x_values)} data points")
         return img_buffer.getvalue()
     except Exception as e:
-        print(f"Error generating chart: {str(e)}")
+        print(f"Error rendering chart: {str(e)}")
         import traceback
         traceback.print_exc()
         return None
 
-def analyze_data_with_claude(bedrock_client, data_summary, rows):
-    """Use Claude to analyze data and suggest visualizations"""
+def chart_worker_loop(conn):
+    """Chart pool worker: import matplotlib once, then render chart specs sent over the pipe"""
+    # Import matplotlib once per worker, before the first chart arrives
+    import matplotlib.backends.backend_agg
+    import matplotlib.figure
+    print(f"Chart worker {os.getpid()} ready (matplotlib {matplotlib.__version__})")
+    while True:
+        try:
+            chart = conn.recv()
+        except EOFError:
+            break
+        conn.send(render_chart_png(chart))
+
+class ChartRenderPool:
+    """
+    Persistent worker processes that render chart specs to PNG bytes in parallel.
+
+    Workers talk over Pipes: multiprocessing queues (and so ProcessPoolExecutor)
+    need /dev/shm semaphores, which Lambda does not provide.
+    """
+
+    def __init__(self, workers):
+        context = multiprocessing.get_context('fork')
+        self.workers = []
+        for _ in range(workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=chart_worker_loop, args=(child_conn,), daemon=True)
+            process.start()
+            child_conn.close()
+            self.workers.append((process, parent_conn))
+        self.lock = threading.Lock()
+        print(f"Started chart render pool with {workers} workers")
+
+    def alive(self):
+        return all(process.is_alive() for process, _ in self.workers)
+
+    def render(self, charts, timeout=None):
+        """
+        Render charts in parallel; results are in input order (None for failed renders).
+        Returns (results, unfinished): the indices of charts not rendered within timeout
+        seconds (default CHART_RENDER_TIMEOUT), e.g. because a worker hangs. The pool must
+        be closed after a timeout.
+        """
+        from multiprocessing.connection import wait as wait_for_connections
+
+        timeout = CHART_RENDER_TIMEOUT if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        results = [None] * len(charts)
+        pending = list(enumerate(charts))
+        idle = [conn for _, conn in self.workers]
+        busy = {}
+        with self.lock:
+            while pending or busy:
+                while pending and idle:
+                    conn = idle.pop()
+                    index, chart = pending.pop(0)
+                    conn.send(chart)
+                    busy[conn] = index
+                ready = wait_for_connections(list(busy), timeout=max(0.0, deadline - time.monotonic()))
+                if not ready:
+                    print(f"Chart render pool timed out after {timeout}s with {len(busy)} charts still rendering")
+                    break
+                for conn in ready:
+                    results[busy.pop(conn)] = conn.recv()
+                    idle.append(conn)
+        return results, sorted(list(busy.values()) + [index for index, _ in pending])
+
+    def close(self, wait=1):
+        """Stop the workers, terminating any still busy after wait seconds"""
+        for process, conn in self.workers:
+            conn.close()
+            process.join(timeout=wait)
+            if process.is_alive():
+                process.terminate()
+
+# Worker pool kept alive across warm invocations
+_chart_pool = None
+
+def render_charts(charts):
+    """
+    Render chart specs to PNG bytes: in this process by default, or in parallel on the
+    warm worker pool when CHART_RENDER_WORKERS > 1.
+
+    Falls back to rendering in this process when the pool cannot be used, and renders
+    the charts a hung pool did not finish within CHART_RENDER_TIMEOUT here.
+    """
+    global _chart_pool
+
+    if CHART_RENDER_WORKERS > 1 and len(charts) > 1:
+        try:
+            if _chart_pool is None or not _chart_pool.alive():
+                if _chart_pool is not None:
+                    _chart_pool.close()
+                _chart_pool = ChartRenderPool(CHART_RENDER_WORKERS)
+            results, unfinished = _chart_pool.render(charts)
+            if unfinished:
+                # A hung worker: stop the pool and render what is left here
+                _chart_pool.close(wait=0)
+                _chart_pool = None
+                for index in unfinished:
+                    results[index] = render_chart_png(charts[index])
+            return results
+        except Exception as e:
+            print(f"Chart render pool failed, rendering inline: {str(e)}")
+            if _chart_pool is not None:
+                _chart_pool.close()
+            _chart_pool = None
+    return [render_chart_png(chart) for chart in charts]
+
+def generate_chart_with_matplotlib(dataset, x_column, y_column, chart_type='line'):
+    """Generate a chart from data using matplotlib"""
+    chart = extract_chart_series(dataset, x_column, y_column, chart_type)
+    return render_chart_png(chart) if chart else None
+
+def add_native_chart(slide, chart, left, top, width, height):
+    """
+    Add a chart spec (see extract_chart_series) to a slide as an editable PowerPoint
+    chart, styled with the same palette as render_chart_png. Returns the graphic frame.
+    """
+    from pptx.chart.data import CategoryChartData, XyChartData
+    from pptx.enum.chart import XL_CHART_TYPE, XL_MARKER_STYLE
+    from pptx.enum.dml import MSO_LINE_DASH_STYLE
+    from pptx.dml.color import RGBColor
+    from pptx.util import Pt
+
+    primary = RGBColor.from_string(CHART_PRIMARY_COLOR[1:])
+    accent = RGBColor.from_string(CHART_ACCENT_COLOR[1:])
+    text_color = RGBColor.from_string(CHART_TEXT_COLOR[1:])
+    axis_color = RGBColor.from_string(CHART_AXIS_COLOR[1:])
+    x_values, y_values = chart['x_values'], chart['y_values']
+
+    if chart['chart_type'] == 'scatter':
+        # XY charts need numeric x; categorical x falls back to its position, like the preview
+        try:
+            x_numbers = [float(x) for x in x_values]
+        except (TypeError, ValueError):
+            x_numbers = list(range(1, len(x_values) + 1))
+        chart_data = XyChartData()
+        series_data = chart_data.add_series(chart['y_label'])
+        for x, y in zip(x_numbers, y_values):
+            series_data.add_data_point(x, y)
+        chart_type = XL_CHART_TYPE.XY_SCATTER
+    else:
+        chart_data = CategoryChartData()
+        chart_data.categories = x_values
+        chart_data.add_series(chart['y_label'], y_values)
+        chart_type = XL_CHART_TYPE.COLUMN_CLUSTERED if chart['chart_type'] == 'bar' else XL_CHART_TYPE.LINE_MARKERS
+
+    frame = slide.shapes.add_chart(chart_type, left, top, width, height, chart_data)
+    pptx_chart = frame.chart
+    pptx_chart.has_legend = False
+    pptx_chart.has_title = True
+    pptx_chart.chart_title.text_frame.text = chart['title']
+    title_font = pptx_chart.chart_title.text_frame.paragraphs[0].font
+    title_font.size = Pt(13)
+    title_font.bold = True
+    title_font.color.rgb = primary
+
+    series = pptx_chart.plots[0].series[0]
+    if chart['chart_type'] == 'bar':
+        series.format.fill.solid()
+        series.format.fill.fore_color.rgb = primary
+        # Highlight the maximum value
+        highlight = series.points[y_values.index(max(y_values))].format.fill
+        highlight.solid()
+        highlight.fore_color.rgb = accent
+    elif chart['chart_type'] == 'line' and len(x_values) > CHART_MARKER_MAX_POINTS:
+        series.marker.style = XL_MARKER_STYLE.NONE
+        series.format.line.color.rgb = primary
+        series.format.line.width = Pt(2.5)
+        series.smooth = False
+    else:
+        series.marker.style = XL_MARKER_STYLE.CIRCLE
+        series.marker.size = 8 if chart['chart_type'] == 'line' else (10 if len(x_values) <= CHART_MARKER_MAX_POINTS else 5)
+        series.marker.format.fill.solid()
+        series.marker.format.fill.fore_color.rgb = accent if chart['chart_type'] == 'line' else primary
+        series.marker.format.line.color.rgb = primary if chart['chart_type'] == 'line' else accent
+        if chart['chart_type'] == 'line':
+            series.format.line.color.rgb = primary
+            series.format.line.width = Pt(2.5)
+            series.smooth = False
+        else:
+            series.format.line.fill.background()  # Markers only
+
+    # Minimal styling: subtle dashed horizontal gridlines, light axis lines, gray labels
+    value_axis = pptx_chart.value_axis
+    value_axis.has_major_gridlines = True
+    value_axis.major_gridlines.format.line.color.rgb = axis_color
+    value_axis.major_gridlines.format.line.dash_style = MSO_LINE_DASH_STYLE.DASH
+    for axis, label in ((pptx_chart.category_axis, chart['x_label']), (value_axis, chart['y_label'])):
+        axis.format.line.color.rgb = axis_color
+        axis.tick_labels.font.size = Pt(9 if len(x_values) > 5 else 10)
+        axis.tick_labels.font.color.rgb = text_color
+        axis.has_title = True
+        axis.axis_title.text_frame.text = str(label)
+        axis_font = axis.axis_title.text_frame.paragraphs[0].font
+        axis_font.size = Pt(11)
+        axis_font.bold = False
+        axis_font.color.rgb = text_color
+    return frame
+
+def describe_chart(chart):
+    """Text stand-in for a chart when no PNG preview is sent to Claude"""
+    points = ', '.join(f"{x}: {y:g}" for x, y in zip(chart['x_values'], chart['y_values']))
+    return f"[{chart['chart_type']} chart] {chart['title']} ({chart['x_label']} vs {chart['y_label']}): {points}"
+
+ANALYSIS_PROMPT_VERSION = '4'  # Bump when the analysis prompt changes to invalidate cached analyses
+
+def data_fingerprint(data_summary, dataset, sample_size=50):
+    """
+    Schema fingerprint used as the analysis cache key: column names, dtypes, a
+    power-of-two row-count bucket and a hash of the first sample_size rows. Only
+    leading rows are hashed, so re-uploading the same dataset with rows appended
+    maps to the same key until the row count crosses a power of two; edits to the
+    leading rows give a new key. Streamed CSVs keep a spaced sample rather than every
+    row, so only their first rows (sample_data) are hashed.
+    """
+    if dataset.row_weight == 1.0:
+        sample = dataset.rows(slice(0, sample_size))
+    else:
+        sample = data_summary['sample_data']
+    sample_hash = hashlib.sha256(json.dumps(sample, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    fingerprint = {
+        'version': ANALYSIS_PROMPT_VERSION,
+        'columns': [str(col) for col in data_summary['columns']],
+        'data_types': {str(col): dtype for col, dtype in data_summary['data_types'].items()},
+        'row_bucket': data_summary['row_count'].bit_length(),
+        'sample_hash': sample_hash
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()
+
+def analyze_data_with_claude(bedrock_client, data_summary, dataset, use_cache=True):
+    """
+    Use Claude to analyze data and suggest visualizations.
+
+    The visualization plan of a successful analysis is cached in ANALYSIS_CACHE by
+    data_fingerprint for ANALYSIS_CACHE_TTL_SECONDS. On a hit the insights and slide
+    bullets are recomputed from the current profile (profile_insights), since rows
+    appended to a re-upload change the figures they quote. use_cache=False skips
+    the lookup (the fresh plan still replaces the cached one).
+    """
     try:
+        # A compact column profile and pre-ranked chart candidates stand in for raw rows
+        profile = data_summary.get('profile') or profile_dataset(dataset, data_summary.get('column_stats'))
+        candidates = profile['candidates']
+
+        cache_key = data_fingerprint(data_summary, dataset)
+        if use_cache:
+            cached = ANALYSIS_CACHE.get('analysis', cache_key)
+            if ANALYSIS_CACHE.is_fresh(cached) and cached.get('visualizations') is not None:
+                ANALYSIS_CACHE.record('hits')
+                print(f"Using cached visualization plan for fingerprint {cache_key[:12]}")
+                insights, slide_content = profile_insights(profile, data_summary['row_count'])
+                return {'insights': insights, 'visualizations': cached['visualizations'], 'slide_content': slide_content}
+            ANALYSIS_CACHE.record('misses')
+        else:
+            ANALYSIS_CACHE.record('bypassed')
+
         # Prepare data summary for Claude
         summary_text = f"""
 Data Analysis Request:
 
-Columns: {', '.join(data_summary['columns'])}
+Columns: {', '.join(str(col) for col in data_summary['columns'])}
 Total Rows: {data_summary['row_count']}
 
-Data Types:
-{json.dumps(data_summary['data_types'], indent=2)}
+Column Profile (computed over the data):
+{format_profile(profile)}
 
-Sample Data (first 5 rows):
-{json.dumps(data_summary['sample_data'], indent=2)}
+Candidate Visualizations (ranked from the profile):
+{format_candidates(candidates)}
 
-IMPORTANT: Please analyze this data and provide visualizations. You MUST suggest at least 1-3 charts to visualize the numeric data.
+IMPORTANT: Please analyze this data and provide visualizations. Confirm the 1-3 candidate visualizations that best tell the data's story.
 
 Return your analysis as PURE JSON (no markdown, no explanations):
 {{
   "insights": ["insight 1 about trends in the data", "insight 2 about key findings", "insight 3 about patterns"],
   "visualizations": [
-    {{"x_column": "column_name", "y_column": "numeric_column_name", "chart_type": "line", "title": "Descriptive Chart Title"}},
-    {{"x_column": "column_name", "y_column": "another_numeric_column", "chart_type": "bar", "title": "Another Chart Title"}}
+    {{"candidate": 1, "title": "Descriptive Chart Title"}},
+    {{"candidate": 2, "title": "Another Chart Title"}}
   ],
   "slide_content": ["bullet point 1", "bullet point 2", "bullet point 3"]
 }}
 
 RULES:
-- For visualizations, x_column should be categorical (like Month, Category, Date) and y_column must be numeric
-- Identify which columns are numeric from the data_types above
-- Chart types can be: "line" (for trends over time), "bar" (for comparisons), "scatter" (for correlations)
+- Pick visualizations by candidate number and give each an insight-based title
+- Only if no candidate fits, use {{"x_column": "exact column name", "y_column": "numeric column name", "chart_type": "line|bar|scatter", "title": "..."}} instead (for a workbook, add "sheet": "sheet name" and use the column name without the sheet prefix)
+- Base insights on the profile's trends, outliers and correlations
 - Return ONLY the JSON, nothing else
 """
 
@@ -345,12 +1566,12 @@ RULES:
 
             # Fallback with default visualizations
             if not analysis:
-                # Try to create visualizations based on data types
+                # The profile's top candidates, else a visualization per numeric column
                 numeric_cols = [col for col, dtype in data_summary['data_types'].items() if dtype == 'numeric']
                 non_numeric_cols = [col for col, dtype in data_summary['data_types'].items() if dtype == 'text']
 
-                visualizations = []
-                if len(numeric_cols) > 0 and len(non_numeric_cols) > 0:
+                visualizations = resolve_visualizations([{'candidate': i} for i in range(1, min(3, len(candidates)) + 1)], candidates)
+                if not visualizations and len(numeric_cols) > 0 and len(non_numeric_cols) > 0:
                     # Create visualizations for each numeric column
                     x_col = non_numeric_cols[0]  # Use first text column as x-axis
                     for i, y_col in enumerate(numeric_cols[:3]):  # Max 3 charts
@@ -372,7 +1593,10 @@ RULES:
                     "slide_content": ["Data overview and key metrics", "Trends and insights from analysis", "Recommendations based on findings"]
                 }
                 print(f"Using fallback analysis with {len(visualizations)} auto-generated visualizations")
+                return analysis
 
+        analysis['visualizations'] = resolve_visualizations(analysis.get('visualizations'), candidates)
+        ANALYSIS_CACHE.put('analysis', cache_key, {'visualizations': analysis['visualizations']})
         return analysis
     except Exception as e:
         print(f"Error analyzing data with Claude: {str(e)}")
@@ -408,13 +1632,55 @@ def add_hyperlinks_to_paragraph(paragraph, text):
                 run = paragraph.add_run()
                 run.text = part
 
-def extract_text_from_html(html_content):
-    """Extract meaningful text from HTML using regex"""
+def extract_text_from_html(html_content, mode=None):
+    """
+    Extract meaningful text from HTML.
+
+    Uses readability-style main-content extraction (see StreamingHTMLExtractor) unless
+    mode (default HTML_EXTRACTION_MODE) is 'legacy', which keeps the original regex
+    behavior: strip script/style and tags, then take the first characters.
+    """
+    if (mode or HTML_EXTRACTION_MODE) != 'legacy':
+        extractor = StreamingHTMLExtractor('', mode='readability')
+        extractor.feed(html_content)
+        extractor.close()
+        return extractor.text
+
     html_content = re.sub(r'<script[^>]*>.*?</script>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
     html_content = re.sub(r'<style[^>]*>.*?</style>', '', html_content, flags=re.DOTALL | re.IGNORECASE)
     text = re.sub(r'<[^>]+>', '', html_content)
     text = re.sub(r'\s+', ' ', text)
-    return text.strip()[:2000]
+    return text.strip()[:HTML_TEXT_BUDGET]
+
+def normalize_image_candidate(img_url, base_url):
+    """Resolve an <img> src against the page URL, or return None for non-content images"""
+    # Convert relative URLs to absolute
+    if img_url.startswith('//'):
+        img_url = 'https:' + img_url
+    elif img_url.startswith('/'):
+        img_url = urljoin(base_url, img_url)
+    elif not img_url.startswith('http'):
+        img_url = urljoin(base_url, img_url)
+
+    # Skip obvious non-content images
+    skip_patterns = ['logo', 'icon', 'favicon', 'avatar', 'emoji', 'badge', 'button', 'sprite', 'pixel', 'tracker', 'ad.', 'ads.']
+
+    # Skip if URL contains skip patterns
+    if any(pattern in img_url.lower() for pattern in skip_patterns):
+        return None
+
+    # Skip data URLs and very small images
+    if img_url.startswith('data:') or 'spacer.gif' in img_url.lower():
+        return None
+
+    # Skip if filename is too short (likely an icon)
+    url_parts = img_url.split('/')
+    if url_parts:
+        filename = url_parts[-1].split('?')[0]
+        if len(filename) < 5:  # Very short filenames are usually icons
+            return None
+
+    return img_url
 
 def extract_images_from_html(html_content, base_url):
     """Extract image URLs from HTML"""
@@ -423,36 +1689,549 @@ def extract_images_from_html(html_content, base_url):
     img_pattern = r'<img[^>]+src=["\']([^"\']+)["\']'
     matches = re.findall(img_pattern, html_content, re.IGNORECASE)
 
-    for img_url in matches[:20]:  # Check first 20 images
-        # Convert relative URLs to absolute
-        if img_url.startswith('//'):
-            img_url = 'https:' + img_url
-        elif img_url.startswith('/'):
-            img_url = urljoin(base_url, img_url)
-        elif not img_url.startswith('http'):
-            img_url = urljoin(base_url, img_url)
+    for img_url in matches[:HTML_IMAGE_TAG_BUDGET]:  # Check first 20 images
+        img_url = normalize_image_candidate(img_url, base_url)
+        if img_url:
+            images.append(img_url)
 
-        # Skip obvious non-content images
-        skip_patterns = ['logo', 'icon', 'favicon', 'avatar', 'emoji', 'badge', 'button', 'sprite', 'pixel', 'tracker', 'ad.', 'ads.']
+    return images[:HTML_IMAGE_BUDGET]  # Return up to 10 images
 
-        # Skip if URL contains skip patterns
-        if any(pattern in img_url.lower() for pattern in skip_patterns):
-            continue
+class StreamingHTMLExtractor(HTMLParser):
+    """
+    Incremental HTML-to-text extractor fed chunk by chunk.
 
-        # Skip data URLs and very small images
-        if img_url.startswith('data:') or 'spacer.gif' in img_url.lower():
-            continue
+    Drops script/style content as it goes, collapses whitespace on the fly and
+    collects image candidates with the same rules as extract_images_from_html.
 
-        # Skip if filename is too short (likely an icon)
-        url_parts = img_url.split('/')
-        if url_parts:
-            filename = url_parts[-1].split('?')[0]
-            if len(filename) < 5:  # Very short filenames are usually icons
+    In 'legacy' mode the text is simply the first text_budget characters of the page.
+    In 'readability' mode the text is split into blocks (paragraphs, list items,
+    headings, ...) that are scored by text length, punctuation and link density, with
+    a bonus for article/content containers; blocks inside navigation, cookie-banner or
+    footer containers are dropped. The budget is filled with the highest-scoring
+    blocks, emitted in document order.
+    """
+
+    SKIP_TAGS = ('script', 'style')
+    READABILITY_SKIP_TAGS = ('script', 'style', 'noscript', 'template', 'svg', 'select', 'button')
+    BLOCK_TAGS = frozenset([
+        'p', 'div', 'section', 'article', 'main', 'li', 'ul', 'ol', 'dl', 'dt', 'dd', 'td', 'th', 'tr',
+        'table', 'blockquote', 'pre', 'header', 'footer', 'nav', 'aside', 'form', 'figure', 'figcaption',
+        'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'br', 'hr', 'body'
+    ])
+    HEADING_TAGS = frozenset(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+    BOILERPLATE_TAGS = frozenset(['nav', 'header', 'footer', 'aside', 'form', 'menu'])
+    VOID_TAGS = frozenset([
+        'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+        'track', 'wbr'
+    ])
+    NEGATIVE_HINTS = re.compile(
+        r'cookie|consent|gdpr|banner|menu|nav|footer|header|sidebar|comment|share|social|promo|advert|'
+        r'sponsor|subscribe|newsletter|breadcrumb|popup|modal|related|recommend|widget|masthead|skip',
+        re.IGNORECASE)
+    POSITIVE_HINTS = re.compile(r'article|content|main|post|entry|story|body|text|blog|prose', re.IGNORECASE)
+    MIN_BLOCK_CHARS = 25
+    CANDIDATE_FACTOR = 3  # Collect this many budgets of candidate text before choosing
+
+    def __init__(self, base_url, text_budget=HTML_TEXT_BUDGET, image_tag_budget=HTML_IMAGE_TAG_BUDGET,
+                 image_budget=HTML_IMAGE_BUDGET, mode=None):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.text_budget = text_budget
+        self.image_tag_budget = image_tag_budget
+        self.image_budget = image_budget
+        self.mode = mode or HTML_EXTRACTION_MODE
+        self.readability = self.mode == 'readability'
+        self.skip_tags = self.READABILITY_SKIP_TAGS if self.readability else self.SKIP_TAGS
+        self.image_urls = []
+        self.image_tags_seen = 0
+        self._pieces = []
+        self._text_length = 0
+        self._skip_depth = 0
+        self._last_was_space = True  # Also drops leading whitespace, like str.strip()
+
+        # Readability state: open element stack of (tag, weight) and the blocks seen so far
+        self._stack = [('', 0)]
+        self._link_depth = 0
+        self._block = []
+        self._block_link_chars = 0
+        self._block_weight = 0
+        self._block_tag = ''
+        self._blocks = []
+        self._candidate_chars = 0
+
+    def _hint_weight(self, tag, attrs):
+        weight = -1 if tag in self.BOILERPLATE_TAGS else 0
+        hints = ' '.join(value for name, value in attrs if name in ('class', 'id', 'role') and value)
+        if hints:
+            if self.NEGATIVE_HINTS.search(hints):
+                weight -= 1
+            if self.POSITIVE_HINTS.search(hints):
+                weight += 1
+        return weight
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skip_tags:
+            self._skip_depth += 1
+            return
+        if tag == 'img' and self.image_tags_seen < self.image_tag_budget:
+            src = dict(attrs).get('src')
+            if src:
+                self.image_tags_seen += 1
+                img_url = normalize_image_candidate(src, self.base_url)
+                if img_url and len(self.image_urls) < self.image_budget:
+                    self.image_urls.append(img_url)
+        if not self.readability:
+            return
+
+        if tag in self.BLOCK_TAGS:
+            self._flush_block()
+        if tag == 'a':
+            self._link_depth += 1
+        if tag not in self.VOID_TAGS:
+            self._stack.append((tag, self._stack[-1][1] + self._hint_weight(tag, attrs)))
+
+    def handle_endtag(self, tag):
+        if tag in self.skip_tags:
+            if self._skip_depth > 0:
+                self._skip_depth -= 1
+            return
+        if not self.readability:
+            return
+
+        if tag in self.BLOCK_TAGS:
+            self._flush_block()
+        if tag == 'a' and self._link_depth > 0:
+            self._link_depth -= 1
+        # Pop back to the matching open tag; stray end tags are ignored
+        for i in range(len(self._stack) - 1, 0, -1):
+            if self._stack[i][0] == tag:
+                del self._stack[i:]
+                break
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self.readability:
+            text = re.sub(r'\s+', ' ', data)
+            if text.strip():
+                if not self._block:
+                    self._block_weight = self._stack[-1][1]
+                    self._block_tag = self._stack[-1][0]
+                self._block.append(text)
+                if self._link_depth:
+                    self._block_link_chars += len(text.strip())
+        if self.text_full:
+            return
+        text = re.sub(r'\s+', ' ', data)
+        if self._last_was_space and text.startswith(' '):
+            text = text[1:]
+        if text:
+            self._pieces.append(text)
+            self._text_length += len(text)
+            self._last_was_space = text.endswith(' ')
+
+    def _flush_block(self):
+        if not self._block:
+            return
+        text = re.sub(r'\s+', ' ', ''.join(self._block)).strip()
+        link_chars = self._block_link_chars
+        self._block = []
+        self._block_link_chars = 0
+
+        is_heading = self._block_tag in self.HEADING_TAGS
+        if not text or (len(text) < self.MIN_BLOCK_CHARS and not is_heading):
+            return
+        if self._block_weight < 0:
+            return  # Inside navigation, cookie banners, sidebars, footers, ...
+        link_density = min(1.0, link_chars / len(text))
+        if link_density > 0.5:
+            return
+        score = (1 + text.count(',') + min(len(text) / 100, 3)) * (1 - link_density)
+        score += 3 * self._block_weight
+        if is_heading:
+            score = max(score, 2)  # Keep section headings that sit inside the content
+        self._blocks.append((score, len(self._blocks), text))
+        self._candidate_chars += len(text)
+
+    def close(self):
+        super().close()
+        self._flush_block()
+
+    @property
+    def text_full(self):
+        # One spare character so a trailing space can still be stripped
+        return self._text_length > self.text_budget
+
+    @property
+    def enough_text(self):
+        """True once enough text is buffered to stop reading the page"""
+        if self.readability:
+            return self._candidate_chars >= self.CANDIDATE_FACTOR * self.text_budget
+        return self.text_full
+
+    @property
+    def images_full(self):
+        return self.image_tags_seen >= self.image_tag_budget or len(self.image_urls) >= self.image_budget
+
+    @property
+    def text(self):
+        fallback = ''.join(self._pieces).strip()[:self.text_budget]
+        if not self.readability or not self._blocks:
+            return fallback
+
+        # Fill the budget with the best blocks that still fit (the best one is cut if it alone
+        # is too long), then restore document order. The budget is applied while choosing, so
+        # re-ordering can never push a chosen block past the cut.
+        chosen = []
+        remaining = self.text_budget
+        for score, index, text in sorted(self._blocks, key=lambda block: (-block[0], block[1])):
+            if not chosen and len(text) > remaining:
+                text = text[:remaining].rstrip()
+            if len(text) > remaining:
                 continue
+            chosen.append((index, text))
+            remaining -= len(text) + 1
+            if remaining < self.MIN_BLOCK_CHARS:
+                break
+        return ' '.join(text for _, text in sorted(chosen))
+
+def extract_page_from_stream(stream, base_url, charset='utf-8', chunk_size=16 * 1024,
+                             image_scan_bytes=HTML_IMAGE_SCAN_BYTES, max_bytes=HTML_MAX_BYTES, mode=None):
+    """
+    Extract (text, image_urls, bytes_read) from a readable HTML byte stream.
+
+    Stops reading once enough text is buffered (the text budget in legacy mode, a few
+    budgets of candidate blocks in readability mode) and either the image budget is
+    also full or image_scan_bytes more bytes have been scanned for images, so memory
+    and latency stay bounded on multi-megabyte pages.
+    """
+    extractor = StreamingHTMLExtractor(base_url, mode=mode)
+    decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+    bytes_read = 0
+    text_full_at = None
+
+    while bytes_read < max_bytes:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        bytes_read += len(chunk)
+        extractor.feed(decoder.decode(chunk))
+
+        if extractor.enough_text:
+            if text_full_at is None:
+                text_full_at = bytes_read
+            if extractor.images_full or bytes_read - text_full_at >= image_scan_bytes:
+                break
+    else:
+        print(f"Stopped reading {base_url} at the {max_bytes} byte limit")
+
+    extractor.feed(decoder.decode(b'', final=True))
+    extractor.close()
+    return extractor.text, extractor.image_urls, bytes_read
+
+def response_charset(response, default='utf-8'):
+    """Return the charset from a response's Content-Type header, if it is a known codec"""
+    match = re.search(r'charset=["\']?([\w-]+)', response.headers.get('Content-Type', ''), re.IGNORECASE)
+    if match:
+        try:
+            return codecs.lookup(match.group(1)).name
+        except LookupError:
+            pass
+    return default
+
+class HTTPSession:
+    """
+    Keep-alive HTTP client over urllib3 connection pools (urllib3 ships with botocore).
+
+    One module-level instance (HTTP_SESSION) is shared by the crawler, web search and
+    image fetcher, so it survives across invocations of a warm Lambda container and
+    repeated requests to the same host reuse an open TLS connection. HTTP(S)_PROXY and
+    NO_PROXY from the environment are honoured.
+    """
+
+    def __init__(self, max_idle_per_host=8, user_agent='Mozilla/5.0'):
+        import urllib3
+
+        self._urllib3 = urllib3
+        self.user_agent = user_agent
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'connections': 0}
+        self._direct = self._counted(urllib3.PoolManager(maxsize=max_idle_per_host))
+        self._proxies = {
+            scheme: self._counted(urllib3.ProxyManager(proxy, maxsize=max_idle_per_host))
+            for scheme, proxy in urllib.request.getproxies().items() if scheme in ('http', 'https')
+        }
 
-        images.append(img_url)
+    def _counted(self, manager):
+        """Swap a manager's pool classes for subclasses that count requests and new connections"""
+        session = self
+
+        def counting(pool_class):
+            class CountingPool(pool_class):
+                def _new_conn(self):
+                    session._count('connections')
+                    return super()._new_conn()
+
+                def _make_request(self, *args, **kwargs):
+                    session._count('requests')
+                    return super()._make_request(*args, **kwargs)
+            return CountingPool
+
+        manager.pool_classes_by_scheme = {scheme: counting(pool_class) for scheme, pool_class in manager.pool_classes_by_scheme.items()}
+        return manager
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self, since=None):
+        """
+        Return the request, new-connection and pool-hit counters; with since (an
+        earlier snapshot) only what happened after that snapshot is counted.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        if since:
+            stats = {key: value - since.get(key, 0) for key, value in stats.items()}
+        stats['pool_hits'] = max(0, stats['requests'] - stats['connections'])
+        return stats
+
+    def close(self):
+        """Close all pooled connections"""
+        self._direct.clear()
+        for manager in self._proxies.values():
+            manager.clear()
+
+    def request(self, url, method='GET', headers=None, timeout=15, max_redirects=5):
+        """
+        Send a request and return the urllib3 response, unread: read(amt) returns
+        decoded bytes and the connection goes back to the pool once the body is read.
+
+        Follows redirects, retries once on a connection or read error (such as a
+        keep-alive connection the server dropped) and raises urllib.error.HTTPError
+        for 4xx/5xx responses, matching what callers previously got from urlopen.
+        """
+        parsed = urlparse(url)
+        scheme = parsed.scheme.lower()
+        if scheme not in ('http', 'https'):
+            raise ValueError(f"Unsupported URL scheme: {url}")
+        manager = self._direct
+        if scheme in self._proxies and not urllib.request.proxy_bypass(parsed.hostname or ''):
+            manager = self._proxies[scheme]
+
+        request_headers = self._urllib3.make_headers(keep_alive=True, accept_encoding=True, user_agent=self.user_agent)
+        request_headers.update(headers or {})
+        response = manager.request(
+            method, url, headers=request_headers, preload_content=False,
+            timeout=self._urllib3.Timeout(connect=timeout, read=timeout),
+            retries=self._urllib3.Retry(total=max_redirects + 2, connect=1, read=1, redirect=max_redirects, status=0)
+        )
+        if response.status >= 400:
+            response.drain_conn()
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        return response
+
+    def get(self, url, headers=None, timeout=15):
+        return self.request(url, 'GET', headers=headers, timeout=timeout)
+
+
+# Shared across invocations while the Lambda container stays warm
+HTTP_SESSION = HTTPSession(max_idle_per_host=int(os.environ.get('HTTP_POOL_MAX_IDLE_PER_HOST', '8')))
+
+class CrawlCache:
+    """
+    Two-tier cache for crawled pages and images, keyed by namespace and URL.
+
+    Entries live on local disk (CRAWL_CACHE_DIR, under /tmp on Lambda) with LRU
+    eviction once the directory grows past max_bytes, and are optionally mirrored
+    to S3 so other containers can reuse them. Each entry is one blob: a JSON
+    metadata line (URL, ETag, Last-Modified, fetched_at, extracted fields)
+    followed by optional raw bytes.
+    """
 
-    return images[:10]  # Return up to 10 images
+    def __init__(self, directory, max_bytes, ttl_seconds, s3_bucket=None, s3_prefix='crawl-cache/', enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.s3_bucket = s3_bucket
+        self.s3_prefix = s3_prefix
+        self.enabled = enabled
+        self._s3_client = None
+        self._lock = threading.Lock()
+        self._disk_bytes = None  # Size of the disk tier, scanned once and then tracked per write
+        self._stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 's3_hits': 0, 'evictions': 0}
+
+    def record(self, event):
+        """Increment one of the hit/miss counters reported by stats()"""
+        with self._lock:
+            self._stats[event] = self._stats.get(event, 0) + 1
+
+    def stats(self, since=None):
+        """
+        Return the cache hit/miss/revalidation counters and the hit rate; with since
+        (an earlier snapshot) only what happened after that snapshot is counted.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        if since:
+            stats = {key: value - since.get(key, 0) for key, value in stats.items()}
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        return stats
+
+    def _key(self, namespace, url):
+        return hashlib.sha256(f"{namespace}:{url}".encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.cache')
+
+    def _s3(self):
+        if self._s3_client is None:
+            self._s3_client = boto3.client('s3')
+        return self._s3_client
+
+    @staticmethod
+    def _pack(meta, data):
+        return json.dumps(meta).encode('utf-8') + b'\n' + (data or b'')
+
+    @staticmethod
+    def _unpack(blob):
+        header, _, data = blob.partition(b'\n')
+        meta = json.loads(header.decode('utf-8'))
+        meta['data'] = data if meta.get('has_data') else None
+        return meta
+
+    def get(self, namespace, url):
+        """Return the cached entry for url (metadata dict with 'data' bytes) or None"""
+        if not self.enabled:
+            return None
+        key = self._key(namespace, url)
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = self._unpack(f.read())
+            os.utime(path)  # Mark as recently used for LRU eviction
+            return entry
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error reading crawl cache entry for {url}: {str(e)}")
+
+        if self.s3_bucket:
+            try:
+                obj = self._s3().get_object(Bucket=self.s3_bucket, Key=f"{self.s3_prefix}{namespace}/{key}")
+                blob = obj['Body'].read()
+                self._write_disk(key, blob)
+                self.record('s3_hits')
+                return self._unpack(blob)
+            except self._s3().exceptions.NoSuchKey:
+                pass
+            except Exception as e:
+                print(f"Error reading S3 crawl cache entry for {url}: {str(e)}")
+        return None
+
+    def put(self, namespace, url, meta, data=None):
+        """Store an entry; meta must be JSON serializable, data is optional raw bytes"""
+        if not self.enabled:
+            return
+        meta = dict(meta, url=url, has_data=data is not None)
+        meta.setdefault('fetched_at', time.time())
+        meta.pop('data', None)
+        key = self._key(namespace, url)
+        blob = self._pack(meta, data)
+        self._write_disk(key, blob)
+        if self.s3_bucket:
+            try:
+                self._s3().put_object(Bucket=self.s3_bucket, Key=f"{self.s3_prefix}{namespace}/{key}", Body=blob)
+            except Exception as e:
+                print(f"Error writing S3 crawl cache entry for {url}: {str(e)}")
+
+    def touch(self, namespace, url, entry):
+        """Record a successful revalidation (304 Not Modified) and restart the TTL"""
+        self.record('revalidated')
+        self.put(namespace, url, dict(entry, fetched_at=time.time()), entry.get('data'))
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry.get('fetched_at', 0) < self.ttl_seconds
+
+    def conditional_headers(self, entry):
+        """Build If-None-Match / If-Modified-Since headers for revalidating an entry"""
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _write_disk(self, key, blob):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp_path, path)
+            with self._lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.directory)
+                                           if entry.name.endswith('.cache'))
+                else:
+                    self._disk_bytes += len(blob) - replaced
+                over = self._disk_bytes > self.max_bytes
+            if over:
+                self._evict()
+        except Exception as e:
+            print(f"Error writing crawl cache entry: {str(e)}")
+
+    def _evict(self, low_water=0.9):
+        """
+        Delete least recently used entries until the disk tier is back under
+        low_water * max_bytes. Only called once the tracked size passes max_bytes,
+        so the directory is scanned once per eviction rather than on every write.
+        """
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.cache'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * low_water:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    self._stats['evictions'] += 1
+                except FileNotFoundError:
+                    pass
+            self._disk_bytes = total
+
+
+CRAWL_CACHE = CrawlCache(
+    directory=os.environ.get('CRAWL_CACHE_DIR', '/tmp/crawl_cache'),
+    max_bytes=int(os.environ.get('CRAWL_CACHE_MAX_BYTES', str(128 * 1024 * 1024))),
+    ttl_seconds=float(os.environ.get('CRAWL_CACHE_TTL_SECONDS', '3600')),
+    s3_bucket=os.environ.get('CRAWL_CACHE_S3_BUCKET') or None,
+    enabled=os.environ.get('CRAWL_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+)
+
+# Claude data analyses keyed by data_fingerprint (see analyze_data_with_claude)
+ANALYSIS_CACHE = CrawlCache(
+    directory=os.environ.get('ANALYSIS_CACHE_DIR', '/tmp/analysis_cache'),
+    max_bytes=int(os.environ.get('ANALYSIS_CACHE_MAX_BYTES', str(16 * 1024 * 1024))),
+    ttl_seconds=float(os.environ.get('ANALYSIS_CACHE_TTL_SECONDS', '86400')),
+    s3_bucket=os.environ.get('ANALYSIS_CACHE_S3_BUCKET') or None,
+    s3_prefix='analysis-cache/',
+    enabled=os.environ.get('ANALYSIS_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+)
 
 def search_web(query, num_results=3):
     """Search the web for a query and return top result URLs"""
@@ -462,14 +2241,13 @@ def search_web(query, num_results=3):
         # Use DuckDuckGo HTML search (no API key needed)
         search_url = f"https://html.duckduckgo.com/html/?q={quote(query)}"
 
-        req = urllib.request.Request(
+        with HTTP_SESSION.get(
             search_url,
             headers={
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-        )
-
-        with urllib.request.urlopen(req, timeout=10) as response:
+            },
+            timeout=10
+        ) as response:
             html = response.read().decode('utf-8')
 
         # Extract URLs from DuckDuckGo results
@@ -502,62 +2280,2280 @@ def search_web(query, num_results=3):
         wiki_query = query.replace(' ', '_')
         return [f"https://en.wikipedia.org/wiki/{wiki_query}"]
 
-def download_and_encode_image(image_url):
+def download_image_bytes(image_url, timeout=IMAGE_URL_TIMEOUT, cancel_event=None, prefix=None, validator=None):
+    """
+    Download raw image bytes and return (data, content_type).
+
+    Reads in chunks so an oversized body stops at MAX_IMAGE_BYTES + 1 and a set
+    cancel_event aborts the transfer, in which case (None, None) is returned.
+    prefix holds the leading bytes probe_image already read: the download resumes
+    after them with a Range request, guarded by If-Range when validator (the
+    probe's ETag or Last-Modified) is known, and starts over if the server sends
+    the whole body instead.
+    """
+    cached = CRAWL_CACHE.get('image', image_url)
+    if cached and cached.get('data') is not None and CRAWL_CACHE.is_fresh(cached):
+        CRAWL_CACHE.record('hits')
+        return cached['data'], cached.get('content_type', '')
+
+    if prefix:
+        headers = {'Range': f"bytes={len(prefix)}-", 'Accept-Encoding': 'identity'}
+        if validator:
+            headers['If-Range'] = validator
+    else:
+        headers = CRAWL_CACHE.conditional_headers(cached) if cached and cached.get('data') is not None else {}
+    with HTTP_SESSION.get(image_url, headers=headers, timeout=timeout) as response:
+        if response.status == 304 and headers and not prefix:
+            CRAWL_CACHE.touch('image', image_url, cached)
+            return cached['data'], cached.get('content_type', '')
+        CRAWL_CACHE.record('misses')
+
+        content_type = response.headers.get('Content-Type', '').lower()
+        chunks = [prefix] if prefix and response.status == 206 else []
+        total = sum(len(chunk) for chunk in chunks)
+        while total <= MAX_IMAGE_BYTES:
+            if cancel_event is not None and cancel_event.is_set():
+                return None, None
+            chunk = response.read(64 * 1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            total += len(chunk)
+        image_data = b''.join(chunks)
+
+        # Truncated (oversized) bodies are rejected anyway, so only complete downloads are cached
+        if total <= MAX_IMAGE_BYTES:
+            CRAWL_CACHE.put('image', image_url, {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_type': content_type
+            }, image_data)
+        return image_data, content_type
+
+def encode_image(image_url, image_data, content_type):
+    """Validate downloaded image bytes and convert to a base64 image dict"""
+    # Check file size (skip very small images - likely icons)
+    # Limit to 3.75MB (Claude's per-image limit)
+    if len(image_data) < 2048:  # Skip images smaller than 2KB (likely icons)
+        return None
+    if len(image_data) > MAX_IMAGE_BYTES:  # Claude limit is 3.75MB per image
+        print(f"Skipping large image: {len(image_data)} bytes")
+        return None
+
+    if 'image' not in content_type:
+        return None
+
+    # Only accept Claude-supported formats
+    supported = ['jpeg', 'jpg', 'png', 'gif', 'webp']
+    if not any(fmt in content_type for fmt in supported):
+        print(f"Unsupported format: {content_type}")
+        return None
+
+    # Determine media type
+    if 'jpeg' in content_type or 'jpg' in content_type:
+        media_type = 'image/jpeg'
+    elif 'png' in content_type:
+        media_type = 'image/png'
+    elif 'gif' in content_type:
+        media_type = 'image/gif'
+    elif 'webp' in content_type:
+        media_type = 'image/webp'
+    else:
+        return None  # Skip if can't determine
+
+    # Convert to base64
+    base64_image = base64.b64encode(image_data).decode('utf-8')
+    if len(base64_image) == 0:
+        return None
+
+    return {
+        'url': image_url,
+        'base64': base64_image,
+        'media_type': media_type,
+        'size': len(image_data)
+    }
+
+def download_and_encode_image(image_url, cancel_event=None):
     """Download image and convert to base64"""
     try:
-        req = urllib.request.Request(image_url, headers={'User-Agent': 'Mozilla/5.0'})
-        with urllib.request.urlopen(req, timeout=10) as response:
-            image_data = response.read()
+        image_data, content_type = download_image_bytes(image_url, cancel_event=cancel_event)
+        if image_data is None:
+            return None
+        return encode_image(image_url, image_data, content_type)
+    except Exception as e:
+        print(f"Error downloading image {image_url}: {str(e)}")
+        return None
 
-            # Check file size (skip very small images - likely icons)
-            # Limit to 3.75MB (Claude's per-image limit)
-            if len(image_data) < 2048:  # Skip images smaller than 2KB (likely icons)
-                return None
-            if len(image_data) > 3.75 * 1024 * 1024:  # Claude limit is 3.75MB per image
-                print(f"Skipping large image: {len(image_data)} bytes")
-                return None
+def parse_image_header(data):
+    """Return (format, width, height) sniffed from the first bytes of a PNG, JPEG, GIF or WebP file"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24 and data[12:16] == b'IHDR':
+        width, height = struct.unpack('>II', data[16:24])
+        return 'png', width, height
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        width, height = struct.unpack('<HH', data[6:10])
+        return 'gif', width, height
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP' and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b'VP8 ':  # Lossy: 14-bit dimensions after the frame start code
+            width, height = struct.unpack('<HH', data[26:30])
+            return 'webp', width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L':  # Lossless: packed 14-bit (width - 1, height - 1)
+            bits = int.from_bytes(data[21:25], 'little')
+            return 'webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X':  # Extended: 24-bit canvas (width - 1, height - 1)
+            return 'webp', int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+        return 'webp', None, None
+    if data[:2] == b'\xff\xd8':
+        # Walk the JPEG segments up to the first start-of-frame marker
+        i = 2
+        while i + 9 <= len(data):
+            if data[i] != 0xFF:
+                i += 1
+                continue
+            marker = data[i + 1]
+            if marker == 0xFF:
+                i += 1
+                continue
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                i += 2
+                continue
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack('>HH', data[i + 5:i + 9])
+                return 'jpeg', width, height
+            i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+        return 'jpeg', None, None
+    return None
+
+def probe_image(image_url, timeout=IMAGE_PROBE_TIMEOUT, probe_bytes=IMAGE_PROBE_BYTES):
+    """
+    Probe an image with a small Range request and return what its headers reveal.
 
-            # Get content type
+    Returns a dict with content_type, total_bytes (None if unknown), format, width,
+    height, data, prefix and validator. data holds the whole body when it fit inside
+    the probe (or came from CRAWL_CACHE), so small images never need a second
+    request; otherwise prefix holds the bytes read so far and validator the ETag or
+    Last-Modified, so download_image_bytes can resume after them.
+    """
+    validator = None
+    cached = CRAWL_CACHE.get('image', image_url)
+    if cached and cached.get('data') is not None and CRAWL_CACHE.is_fresh(cached):
+        data = cached['data']
+        content_type = cached.get('content_type', '')
+        total_bytes = len(data)
+        complete = True
+    else:
+        headers = {'Range': f"bytes=0-{probe_bytes - 1}", 'Accept-Encoding': 'identity'}
+        with HTTP_SESSION.get(image_url, headers=headers, timeout=timeout) as response:
             content_type = response.headers.get('Content-Type', '').lower()
-            if 'image' not in content_type:
-                return None
-
-            # Only accept Claude-supported formats
-            supported = ['jpeg', 'jpg', 'png', 'gif', 'webp']
-            if not any(fmt in content_type for fmt in supported):
-                print(f"Unsupported format: {content_type}")
-                return None
+            validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            chunks = []
+            length = 0
+            ended = False
+            while length < probe_bytes:
+                chunk = response.read(probe_bytes - length)
+                if not chunk:
+                    ended = True
+                    break
+                chunks.append(chunk)
+                length += len(chunk)
+            data = b''.join(chunks)
 
-            # Determine media type
-            if 'jpeg' in content_type or 'jpg' in content_type:
-                media_type = 'image/jpeg'
-            elif 'png' in content_type:
-                media_type = 'image/png'
-            elif 'gif' in content_type:
-                media_type = 'image/gif'
-            elif 'webp' in content_type:
-                media_type = 'image/webp'
+            if response.status == 206:
+                match = re.search(r'/(\d+)\s*$', response.headers.get('Content-Range', ''))
+                total_bytes = int(match.group(1)) if match else None
             else:
-                return None  # Skip if can't determine
+                # Server ignored the Range header and is sending the whole body
+                content_length = response.headers.get('Content-Length')
+                total_bytes = int(content_length) if content_length and content_length.isdigit() else None
+            complete = ended or (total_bytes is not None and len(data) >= total_bytes)
+            if complete:
+                total_bytes = len(data)
+                CRAWL_CACHE.put('image', image_url, {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'content_type': content_type
+                }, data)
+
+    header = parse_image_header(data) or (None, None, None)
+    return {
+        'content_type': content_type,
+        'total_bytes': total_bytes,
+        'format': header[0],
+        'width': header[1],
+        'height': header[2],
+        'data': data if complete else None,
+        'prefix': None if complete else data,
+        'validator': validator
+    }
+
+def unknown_probe():
+    """Probe result for an image whose probe failed: nothing is known, so it gets a normal capped download"""
+    return {'content_type': '', 'total_bytes': None, 'format': None, 'width': None, 'height': None,
+            'data': None, 'prefix': None, 'validator': None}
+
+def image_probe_rejection(probe):
+    """Return why a probed image should be skipped before downloading it, or None"""
+    content_type = probe['content_type']
+    if content_type and ('image' not in content_type or not any(fmt in content_type for fmt in ('jpeg', 'jpg', 'png', 'gif', 'webp'))):
+        return f"unsupported type {content_type or 'unknown'}"
+    total_bytes = probe['total_bytes']
+    if total_bytes is not None and total_bytes < 2048:
+        return f"too small ({total_bytes} bytes)"
+    if total_bytes is not None and total_bytes > MAX_IMAGE_BYTES:
+        return f"too large ({total_bytes} bytes)"
+    if probe['width'] and probe['height'] and min(probe['width'], probe['height']) < IMAGE_MIN_DIMENSION:
+        return f"too small ({probe['width']}x{probe['height']})"
+    return None
+
+def image_probe_score(probe):
+    """Rank probed images: larger (up to Claude's recommended size) and less extreme aspect ratios first"""
+    width, height = probe['width'], probe['height']
+    if not width or not height:
+        return 0.25  # Dimensions unknown (e.g. JPEG frame header past the probe range)
+    score = min(width * height, IMAGE_RANK_PIXEL_CAP) / IMAGE_RANK_PIXEL_CAP
+    aspect = max(width, height) / min(width, height)
+    if aspect > 3:
+        score *= 3 / aspect  # Banners and strips rarely make good slide visuals
+    return score
+
+def image_phash(image_data):
+    """
+    Return the 64-bit difference hash (dHash) of image bytes as a hex string.
 
-            # Convert to base64
-            base64_image = base64.b64encode(image_data).decode('utf-8')
-            if len(base64_image) == 0:
-                return None
+    Near-identical images (the same picture resized or recompressed) differ in only a
+    few bits. Hashes are cached in CRAWL_CACHE by content hash, so an image is only
+    decoded for hashing once.
+    """
+    content_hash = hashlib.sha256(image_data).hexdigest()
+    cached = CRAWL_CACHE.get('image-phash', content_hash)
+    if cached:
+        return cached['phash']
+
+    from PIL import Image
+
+    with Image.open(BytesIO(image_data)) as source:
+        source.draft('L', (64, 64))  # Let the JPEG decoder skip detail the hash never sees
+        gray = source.convert('L').resize((9, 8), Image.LANCZOS)
+        pixels = list(gray.getdata())
+
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    phash = f"{bits:016x}"
+    CRAWL_CACHE.put('image-phash', content_hash, {'phash': phash})
+    return phash
+
+def phash_distance(first, second):
+    """Number of differing bits between two image_phash values"""
+    return bin(int(first, 16) ^ int(second, 16)).count('1')
+
+def image_pixels(image):
+    return (image.get('width') or 0) * (image.get('height') or 0)
+
+def find_near_duplicate(image, images, max_distance=IMAGE_DUPLICATE_MAX_DISTANCE):
+    """Return the index of an image in images that looks the same as image, or None"""
+    if not image.get('phash'):
+        return None
+    for i, other in enumerate(images):
+        if other.get('phash') and phash_distance(image['phash'], other['phash']) <= max_distance:
+            return i
+    return None
 
-            return {
-                'url': image_url,
-                'base64': base64_image,
-                'media_type': media_type,
-                'size': len(image_data)
-            }
-    except Exception as e:
-        print(f"Error downloading image {image_url}: {str(e)}")
+def best_known_copy(image_url, phash, width, height):
+    """
+    Look up the phash index for a higher-resolution copy of the same image.
+
+    The index (CRAWL_CACHE namespace 'phash-index', keyed by hash) remembers the largest
+    copy seen across requests. Returns (data, content_type, url, width, height) if that
+    copy is bigger and its bytes are still cached, otherwise None.
+    """
+    entry = CRAWL_CACHE.get('phash-index', phash)
+    if not entry or entry['source_url'] == image_url or entry['pixels'] <= (width or 0) * (height or 0):
+        return None
+    cached = CRAWL_CACHE.get('image', entry['source_url'])
+    if not cached or cached.get('data') is None:
         return None
+    return cached['data'], cached.get('content_type', ''), entry['source_url'], entry['width'], entry['height']
 
-def lambda_handler(event, context):
+def update_phash_index(image, phash=None):
+    """
+    Remember image as the best known copy for phash (default: its own hash) if it is
+    the largest seen so far. Collapsed duplicates are indexed under their own hashes
+    too, since near-identical copies rarely hash to exactly the same value.
+    """
+    phash = phash or image.get('phash')
+    if not phash or image.get('is_chart'):
+        return
+    entry = CRAWL_CACHE.get('phash-index', phash)
+    if entry is None or entry['pixels'] < image_pixels(image):
+        CRAWL_CACHE.put('phash-index', phash, {
+            'source_url': image['url'],
+            'width': image.get('width'),
+            'height': image.get('height'),
+            'pixels': image_pixels(image)
+        })
+
+def download_images(image_urls, max_images=MAX_IMAGES_TO_SEND, max_workers=IMAGE_MAX_WORKERS,
+                    deadline_seconds=IMAGE_DEADLINE_SECONDS):
+    """
+    Probe, rank and download image candidates concurrently until max_images usable images are collected.
+
+    Every candidate is first probed with a small Range request (see probe_image);
+    unsupported types, icons and oversized files are filtered out without a full
+    transfer, and the rest are downloaded best-first (image_probe_score).
+    Near-duplicates (by perceptual hash) are collapsed as images are accepted, keeping
+    the highest-resolution copy, so they don't take up Claude's image slots. Returns
+    (images, stats). Images are the first max_images usable candidates in ranked
+    order, so the selection does not depend on download timing. Once that selection
+    is settled, queued downloads are cancelled and in-flight transfers are aborted.
+    stats has one entry per candidate with its status, dimensions, latency and bytes.
+    """
+    stats = [{'url': url, 'status': 'cancelled', 'width': None, 'height': None,
+              'probe_ms': None, 'latency_ms': None, 'bytes': 0} for url in image_urls]
+    if not image_urls or max_images <= 0:
+        return [], []
+
+    started = time.monotonic()
+    deadline = started + deadline_seconds
+    cancel_event = threading.Event()
+
+    def probe(index):
+        stat = stats[index]
+        probe_started = time.monotonic()
+        try:
+            remaining = deadline - probe_started
+            if cancel_event.is_set() or remaining <= 0:
+                return None
+            result = probe_image(image_urls[index], timeout=min(IMAGE_PROBE_TIMEOUT, remaining))
+            stat['width'] = result['width']
+            stat['height'] = result['height']
+            rejection = image_probe_rejection(result)
+            if rejection:
+                stat['status'] = 'filtered'
+                stat['bytes'] = len(result['data'] or b'')
+                print(f"Skipping image {image_urls[index]}: {rejection}")
+                return None
+            return result
+        except Exception as e:
+            if cancel_event.is_set():
+                return None
+            # Some servers reject or mishandle Range requests, so a failed probe isn't a rejection
+            print(f"Could not probe image {image_urls[index]}, downloading it unprobed: {str(e)}")
+            return unknown_probe()
+        finally:
+            stat['probe_ms'] = round((time.monotonic() - probe_started) * 1000, 1)
+
+    def fetch(index, probe_result):
+        stat = stats[index]
+        if cancel_event.is_set():
+            return None
+        fetch_started = time.monotonic()
+        try:
+            remaining = deadline - fetch_started
+            if remaining <= 0:
+                return None
+            if probe_result['data'] is not None:
+                # The probe already returned the whole image
+                image_data, content_type = probe_result['data'], probe_result['content_type']
+            else:
+                image_data, content_type = download_image_bytes(
+                    image_urls[index], timeout=min(IMAGE_URL_TIMEOUT, remaining), cancel_event=cancel_event,
+                    prefix=probe_result['prefix'], validator=probe_result['validator'])
+                if image_data is None:
+                    return None
+            stat['bytes'] = len(image_data)
+            header = parse_image_header(image_data) or (None, probe_result['width'], probe_result['height'])
+            width, height = header[1], header[2]
+
+            phash = None
+            source_url = image_urls[index]
+            try:
+                phash = image_phash(image_data)
+                # A larger copy of the same picture from an earlier request may already be cached
+                better = best_known_copy(image_urls[index], phash, width, height)
+                if better:
+                    image_data, content_type, source_url, width, height = better
+                    print(f"Using cached higher-resolution copy {source_url} for {image_urls[index]}")
+            except Exception as e:
+                print(f"Could not hash image {image_urls[index]}: {str(e)}")
+
+            # url names where the bytes came from; original_url the candidate that led to the copy
+            image = encode_image(source_url, image_data, content_type)
+            if image:
+                image['width'] = width
+                image['height'] = height
+                image['phash'] = phash
+                if source_url != image_urls[index]:
+                    image['original_url'] = image_urls[index]
+            stat['status'] = 'ok' if image else 'rejected'
+            return image
+        except Exception as e:
+            if cancel_event.is_set():
+                return None  # Aborted by early termination or the stage deadline
+            print(f"Error downloading image {image_urls[index]}: {str(e)}")
+            stat['status'] = 'error'
+            return None
+        finally:
+            stat['latency_ms'] = round((time.monotonic() - fetch_started) * 1000, 1)
+
+    images = []
+    image_indices = []
+    image_hashes = []
+
+    def accept(index, image):
+        # Collapse near-duplicates, keeping the highest-resolution copy in the earlier slot
+        duplicate = find_near_duplicate(image, images)
+        if duplicate is None:
+            images.append(image)
+            image_indices.append(index)
+            image_hashes.append({image.get('phash')})
+            return
+        image_hashes[duplicate].add(image['phash'])
+        if image_pixels(image) > image_pixels(images[duplicate]):
+            stats[image_indices[duplicate]]['status'] = 'duplicate'
+            images[duplicate] = image
+            image_indices[duplicate] = index
+        else:
+            stats[index]['status'] = 'duplicate'
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(image_urls))))
+    try:
+        # Phase 1: probe every candidate, then rank the survivors (ties keep candidate order)
+        probe_futures = [executor.submit(probe, i) for i in range(len(image_urls))]
+        wait(probe_futures, timeout=max(0, deadline - time.monotonic()))
+        probes = {i: f.result() for i, f in enumerate(probe_futures)
+                  if f.done() and not f.cancelled() and f.result()}
+        order = sorted(probes, key=lambda i: (-image_probe_score(probes[i]), i))
+
+        # Phase 2: download best-first, accepting images in ranked order
+        results = {}
+        next_position = 0
+        futures = {executor.submit(fetch, i, probes[i]): i for i in order}
+        try:
+            for future in as_completed(futures, timeout=max(0, deadline - time.monotonic())):
+                results[futures[future]] = future.result()
+
+                # Accept an image once every higher-ranked candidate has settled
+                while next_position < len(order) and order[next_position] in results and len(images) < max_images:
+                    if results[order[next_position]]:
+                        accept(order[next_position], results[order[next_position]])
+                    next_position += 1
+                if len(images) >= max_images:
+                    break
+        except FuturesTimeoutError:
+            print(f"Image download deadline of {deadline_seconds}s exceeded")
+            # Keep whatever finished in time, still in ranked order
+            for index in order[next_position:]:
+                if results.get(index) and len(images) < max_images:
+                    accept(index, results[index])
+    finally:
+        cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for image, hashes in zip(images, image_hashes):
+        for phash in hashes:
+            update_phash_index(image, phash)
+
+    report = [dict(stat) for stat in stats]
+    filtered = sum(1 for stat in report if stat['status'] == 'filtered')
+    duplicates = sum(1 for stat in report if stat['status'] == 'duplicate')
+    print(f"Selected {len(images)} images from {len(image_urls)} candidates "
+          f"({filtered} filtered by probe, {duplicates} duplicates) in {time.monotonic() - started:.2f}s")
+    return images, report
+
+def resize_image_bytes(image_data, max_width, max_height, output_format, quality=IMAGE_QUALITY):
+    """
+    Downscale image bytes to fit max_width x max_height and re-encode them with Pillow.
+
+    output_format is 'JPEG', 'WEBP' or 'PNG'; transparency is flattened onto white for
+    JPEG. Returns (bytes, media_type, resized).
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(image_data)) as source:
+        source.seek(0)  # First frame of animated GIF/WebP
+        image = ImageOps.exif_transpose(source)
+        width, height = image.size
+        scale = min(1.0, max_width / width, max_height / height)
+        resized = scale < 1.0
+        if resized:
+            image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+        if output_format == 'JPEG':
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            image = image.convert('RGBA')
+
+        out = BytesIO()
+        if output_format == 'PNG':
+            image.save(out, 'PNG', optimize=True)
+        elif output_format == 'JPEG':
+            image.save(out, 'JPEG', quality=quality, optimize=True)
+        else:
+            image.save(out, output_format, quality=quality)
+        return out.getvalue(), f"image/{output_format.lower()}", resized
+
+def image_variant(image_data, media_type, variant, is_chart=False):
+    """
+    Return (bytes, media_type) of an image prepared for 'vision' (Claude input) or 'slide' (PPTX embed).
+
+    Vision variants fit Claude's recommended edge length; slide variants fit the
+    picture box at SLIDE_IMAGE_DPI and always use a format PowerPoint can embed
+    (JPEG, or PNG for charts). Variants are cached by content hash in CRAWL_CACHE.
+    The original is returned when it is already small enough and no smaller
+    encoding is found.
+    """
+    if variant == 'vision':
+        max_width = max_height = CLAUDE_IMAGE_MAX_EDGE
+        output_format = 'PNG' if is_chart else IMAGE_OUTPUT_FORMAT
+        must_convert = False
+    else:
+        max_width = round(SLIDE_IMAGE_WIDTH_INCHES * SLIDE_IMAGE_DPI)
+        max_height = round(SLIDE_IMAGE_MAX_HEIGHT_INCHES * SLIDE_IMAGE_DPI)
+        output_format = 'PNG' if is_chart else 'JPEG'
+        must_convert = media_type not in ('image/jpeg', 'image/png', 'image/gif')
+
+    cache_key = (f"{hashlib.sha256(image_data).hexdigest()}:{variant}:"
+                 f"{max_width}x{max_height}:{output_format}:{IMAGE_QUALITY}")
+    cached = CRAWL_CACHE.get('image-variant', cache_key)
+    if cached and cached.get('data') is not None:
+        return cached['data'], cached['media_type']
+
+    data, variant_media_type, resized = resize_image_bytes(image_data, max_width, max_height, output_format)
+    if not resized and not must_convert and len(data) >= len(image_data):
+        data, variant_media_type = image_data, media_type  # Re-encoding would not help
+    CRAWL_CACHE.put('image-variant', cache_key, {'media_type': variant_media_type}, data)
+    return data, variant_media_type
+
+def prepare_image_variants(image):
+    """
+    Replace an image dict's payload with its vision variant and attach a slide-embed variant.
+
+    Adds 'original_size', 'slide_base64', 'slide_media_type' and 'slide_size'. If
+    Pillow is unavailable or the image can't be decoded, the original is used for both.
+    """
+    if not image.get('base64'):
+        # Native chart without a PNG preview; nothing to normalize
+        image['original_size'] = image['slide_size'] = image['size']
+        return image
+    original = base64.b64decode(image['base64'])
+    image['original_size'] = len(original)
+    try:
+        vision_data, vision_media_type = image_variant(original, image['media_type'], 'vision', image.get('is_chart'))
+        slide_data, slide_media_type = image_variant(original, image['media_type'], 'slide', image.get('is_chart'))
+    except Exception as e:
+        print(f"Image normalization skipped for {image['url']}: {str(e)}")
+        image['slide_base64'] = image['base64']
+        image['slide_media_type'] = image['media_type']
+        image['slide_size'] = image['size']
+        return image
+
+    image['base64'] = base64.b64encode(vision_data).decode('utf-8')
+    image['media_type'] = vision_media_type
+    image['size'] = len(vision_data)
+    image['slide_base64'] = base64.b64encode(slide_data).decode('utf-8')
+    image['slide_media_type'] = slide_media_type
+    image['slide_size'] = len(slide_data)
+    print(f"Normalized image {image['url']}: {len(original)} -> vision {len(vision_data)}, slide {len(slide_data)} bytes")
+    return image
+
+def crawl_url(url, timeout=CRAWL_URL_TIMEOUT):
+    """
+    Fetch a single URL and extract its text and image candidates.
+
+    Uses CRAWL_CACHE: a fresh entry skips the network and parsing entirely, and a
+    stale one is revalidated with a conditional GET (304 reuses the cached text).
+    """
+    print(f"Crawling URL: {url}")
+    cache_namespace = f"page-{HTML_EXTRACTION_MODE}"
+    cached = CRAWL_CACHE.get(cache_namespace, url)
+    if CRAWL_CACHE.is_fresh(cached):
+        CRAWL_CACHE.record('hits')
+        print(f"Using cached content for {url}")
+        return cached_page(url, cached)
+
+    with HTTP_SESSION.get(url, headers=CRAWL_CACHE.conditional_headers(cached), timeout=timeout) as response:
+        if response.status == 304 and cached:
+            CRAWL_CACHE.touch(cache_namespace, url, cached)
+            print(f"Cached content for {url} is still valid (304 Not Modified)")
+            return cached_page(url, cached)
+        CRAWL_CACHE.record('misses')
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+
+        # Extract text and images while streaming; stops reading once both budgets are met
+        clean_text, image_urls, bytes_read = extract_page_from_stream(response, url, charset=response_charset(response))
+    print(f"Read {bytes_read} bytes from {url}")
+    print(f"Extracted {len(clean_text)} characters of text from {url}")
+    print(f"Found {len(image_urls)} images on {url}")
+
+    CRAWL_CACHE.put(cache_namespace, url, {
+        'etag': etag,
+        'last_modified': last_modified,
+        'content': clean_text,
+        'image_urls': image_urls
+    })
+
+    return {
+        'url': url,
+        'content': clean_text,
+        'image_count': len(image_urls),
+        'image_urls': image_urls
+    }
+
+def cached_page(url, entry):
+    """Build a crawl result from a cached page entry"""
+    return {
+        'url': url,
+        'content': entry.get('content', ''),
+        'image_count': len(entry.get('image_urls', [])),
+        'image_urls': list(entry.get('image_urls', []))
+    }
+
+def crawl_urls(urls, max_workers=CRAWL_MAX_WORKERS, per_host_limit=CRAWL_PER_HOST_LIMIT,
+               deadline_seconds=CRAWL_DEADLINE_SECONDS):
+    """
+    Crawl URLs concurrently and return one result per URL, in input order.
+
+    Fetches run on a bounded thread pool, at most per_host_limit at a time per host,
+    and the whole stage stops waiting once deadline_seconds have elapsed. Failed or
+    unfinished URLs are returned as {'url': ..., 'error': ...} entries.
+    """
+    if not urls:
+        return []
+
+    started = time.monotonic()
+    deadline = started + deadline_seconds
+    host_locks = {}
+    for url in urls:
+        host = urlparse(url).netloc.lower()
+        if host not in host_locks:
+            host_locks[host] = threading.BoundedSemaphore(max(1, per_host_limit))
+
+    def crawl_with_limits(url):
+        host_lock = host_locks[urlparse(url).netloc.lower()]
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not host_lock.acquire(timeout=remaining):
+            raise TimeoutError("Crawl deadline exceeded while waiting for host slot")
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Crawl deadline exceeded")
+            return crawl_url(url, timeout=min(CRAWL_URL_TIMEOUT, remaining))
+        finally:
+            host_lock.release()
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls))))
+    try:
+        futures = [executor.submit(crawl_with_limits, url) for url in urls]
+        wait(futures, timeout=max(0, deadline - time.monotonic()))
+    finally:
+        # Don't block the request on fetches that overran the deadline
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for url, future in zip(urls, futures):
+        if not future.done():
+            future.cancel()
+            print(f"Error crawling {url}: deadline of {deadline_seconds}s exceeded")
+            results.append({'url': url, 'error': f"Crawl deadline of {deadline_seconds}s exceeded"})
+            continue
+        try:
+            results.append(future.result())
+        except Exception as e:
+            print(f"Error crawling {url}: {str(e)}")
+            results.append({'url': url, 'error': str(e)})
+
+    print(f"Crawled {len(urls)} URLs in {time.monotonic() - started:.2f}s")
+    return results
+
+BEDROCK_STREAMING = os.environ.get('BEDROCK_STREAMING', 'true').lower() != 'false'
+
+# Input token budget for the source material in the slide prompt (document, data
+# insights, crawled pages); the static instructions and images come on top of it
+CONTENT_TOKEN_BUDGET = int(os.environ.get('CONTENT_TOKEN_BUDGET', '40000'))
+CONTENT_MIN_SHARE = 0.05  # Every source keeps at least this share of the budget (if it needs it)
+CONTENT_PRIORITIES = {'uploaded_document': 0, 'data_analysis': 1, 'data_insights': 1}  # Anything else (crawled pages) is 2
+CHUNK_TARGET_TOKENS = 120
+STOPWORDS = frozenset("""a an and are as at be by for from has have in is it its of on or that the this to was
+were will with about into over than then them they their there these those which who what when where how why
+your you our we not but can also more most such""".split())
+
+def estimate_tokens(text):
+    """Rough Claude token count for text (about 4 characters per token)"""
+    return (len(text) + 3) // 4
+
+def estimate_image_tokens(img):
+    """Claude bills images at about width*height/750 tokens after the 1568px downscale"""
+    if not img.get('base64') and img.get('chart_data'):
+        return estimate_tokens(describe_chart(img['chart_data']))
+    width, height = img.get('width') or CLAUDE_IMAGE_MAX_EDGE, img.get('height') or CLAUDE_IMAGE_MAX_EDGE
+    scale = min(1.0, CLAUDE_IMAGE_MAX_EDGE / max(width, height))
+    return int(width * scale * height * scale / 750)
+
+def tokenize_terms(text):
+    return [term for term in re.findall(r'[a-z0-9]+', text.lower()) if term not in STOPWORDS and len(term) > 1]
+
+def split_into_chunks(text, target_tokens=CHUNK_TARGET_TOKENS):
+    """Split text into roughly target_tokens-sized chunks along paragraph, then sentence, boundaries"""
+    chunks = []
+    target_chars = target_tokens * 4
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= target_chars:
+            chunks.append(paragraph)
+            continue
+        current = ''
+        for sentence in re.split(r'(?<=[.!?])\s+|\n', paragraph):
+            if current and len(current) + len(sentence) > target_chars:
+                chunks.append(current)
+                current = ''
+            current = f"{current} {sentence}".strip()
+            while len(current) > target_chars * 2:  # No sentence boundaries (tables, code): hard split
+                chunks.append(current[:target_chars])
+                current = current[target_chars:]
+        if current:
+            chunks.append(current)
+    return chunks
+
+class DocumentIndex:
+    """
+    BM25 index over a document's chunks (see split_into_chunks).
+
+    Postings are stored as NumPy arrays grouped by term (CSR layout: indptr, chunk ids
+    and precomputed BM25 term weights), so scoring a query is a handful of vectorized
+    adds per query term.
+    """
+
+    def __init__(self, text, k1=1.5, b=0.75):
+        import numpy as np
+
+        self.chunks = split_into_chunks(text)
+        vocabulary = {}
+        term_ids, chunk_ids, counts, lengths = [], [], [], []
+        for chunk_id, chunk in enumerate(self.chunks):
+            terms = tokenize_terms(chunk)
+            lengths.append(len(terms))
+            frequencies = {}
+            for term in terms:
+                frequencies[term] = frequencies.get(term, 0) + 1
+            for term, count in frequencies.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                chunk_ids.append(chunk_id)
+                counts.append(count)
+        self.vocabulary = vocabulary
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind='stable')
+        self._chunk_ids = np.array(chunk_ids, dtype=np.int64)[order]
+        tf = np.array(counts, dtype=np.float64)[order]
+        self._indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=self._indptr[1:])
+
+        lengths = np.array(lengths, dtype=np.float64)
+        average_length = max(lengths.mean(), 1.0) if len(lengths) else 1.0
+        norm = k1 * (1 - b + b * lengths / average_length)
+        self._weights = tf * (k1 + 1) / (tf + norm[self._chunk_ids])
+        document_frequency = np.diff(self._indptr)
+        self._idf = np.log(1 + (len(self.chunks) - document_frequency + 0.5) / (document_frequency + 0.5))
+        self.token_counts = np.array([estimate_tokens(chunk) + 1 for chunk in self.chunks], dtype=np.int64)
+
+    def scores(self, query):
+        """BM25 score of every chunk for query"""
+        import numpy as np
+
+        scores = np.zeros(len(self.chunks))
+        for term in set(tokenize_terms(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self._indptr[term_id], self._indptr[term_id + 1]
+            # A term appears once per chunk in its postings, so plain fancy-index add is safe
+            scores[self._chunk_ids[start:end]] += self._idf[term_id] * self._weights[start:end]
+        return scores
+
+    def top_chunks(self, query, token_limit, k=None):
+        """
+        Indices (in document order) of the best-scoring chunks that fit in token_limit.
+
+        A small bonus for leading chunks breaks ties towards the start of the
+        document, which tends to hold the summary.
+        """
+        import numpy as np
+
+        positions = np.arange(len(self.chunks))
+        scores = self.scores(query) + 1.0 / (1 + positions)
+        selected = []
+        used = 0
+        for i in np.lexsort((positions, -scores)):
+            if k is not None and len(selected) >= k:
+                break
+            if used + self.token_counts[i] > token_limit:
+                continue
+            selected.append(int(i))
+            used += int(self.token_counts[i])
+        return sorted(selected)
+
+    def select(self, query, token_limit, k=None):
+        return '\n\n'.join(self.chunks[i] for i in self.top_chunks(query, token_limit, k))
+
+# Per-document BM25 indexes, reused across requests while the container is warm
+DOCUMENT_INDEX_CACHE_SIZE = int(os.environ.get('DOCUMENT_INDEX_CACHE_SIZE', '8'))
+RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', '0')) or None  # None: fill the token allocation
+_document_indexes = OrderedDict()
+_document_indexes_lock = threading.Lock()
+
+def document_index(text):
+    """Return the DocumentIndex for text, building it only on the first request for that document"""
+    key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    with _document_indexes_lock:
+        index = _document_indexes.get(key)
+        if index is not None:
+            _document_indexes.move_to_end(key)
+            return index
+
+    started = time.monotonic()
+    index = DocumentIndex(text)
+    print(f"Indexed {len(index.chunks)} chunks ({len(index.vocabulary)} terms) in {time.monotonic() - started:.2f}s")
+    with _document_indexes_lock:
+        _document_indexes[key] = index
+        while len(_document_indexes) > DOCUMENT_INDEX_CACHE_SIZE:
+            _document_indexes.popitem(last=False)
+    return index
+
+def compress_text(text, token_limit, query):
+    """
+    Extractive compression: keep the chunks of text most relevant to query (BM25 over
+    a cached DocumentIndex), in their original order, within token_limit.
+    """
+    return document_index(text).select(query, token_limit, k=RETRIEVAL_TOP_K)
+
+def outline_query(topic, outline):
+    """Retrieval query for the fill phase: topic plus the outline's titles and key messages"""
+    return ' '.join([topic] + [f"{slide['title']} {slide.get('focus', '')}" for slide in outline])
+
+def allocate_token_budget(needs, priorities, budget, min_share=CONTENT_MIN_SHARE):
+    """
+    Split budget across sources: each gets min(need, budget * min_share) first, then
+    the rest goes to sources by priority (lower first), shared evenly within a
+    priority level. Returns allocations in the order of needs.
+    """
+    allocations = [min(need, int(budget * min_share)) for need in needs]
+    remaining = budget - sum(allocations)
+    for priority in sorted(set(priorities)):
+        members = [i for i, p in enumerate(priorities) if p == priority]
+        # Water-fill: repeatedly split what's left evenly among members that still need more
+        while remaining > 0:
+            hungry = [i for i in members if allocations[i] < needs[i]]
+            if not hungry:
+                break
+            share = max(1, remaining // len(hungry))
+            for i in hungry:
+                grant = min(share, needs[i] - allocations[i], remaining)
+                allocations[i] += grant
+                remaining -= grant
+    return allocations
+
+def plan_prompt_content(extracted_content, data_context, topic, budget=CONTENT_TOKEN_BUDGET):
+    """
+    Fit the prompt's source material into the token budget.
+
+    Sources are the uploaded document, the data insights and the crawled pages, in that
+    priority. Sources over their allocation are compressed with compress_text. Returns
+    (all_content, data_context, report).
+    """
+    sources = [item for item in extracted_content if item.get('content')]
+    labels = [item.get('source') or item.get('url', 'page') for item in sources]
+    texts = [item['content'] for item in sources]
+    if data_context:
+        labels.append('data_insights')
+        texts.append(data_context)
+    needs = [estimate_tokens(text) for text in texts]
+    priorities = [CONTENT_PRIORITIES.get(label, 2) for label in labels]
+    allocations = allocate_token_budget(needs, priorities, budget)
+
+    report = {'budget': budget, 'sources': []}
+    final_texts = []
+    for label, text, need, allocation in zip(labels, texts, needs, allocations):
+        compressed = need > allocation
+        if compressed:
+            text = compress_text(text, allocation, topic)
+        final_texts.append(text)
+        report['sources'].append({
+            'source': label,
+            'estimated_tokens': need,
+            'allocated_tokens': allocation,
+            'final_tokens': estimate_tokens(text),
+            'compressed': compressed
+        })
+        print(f"Content budget: {label[:60]} {need} -> {estimate_tokens(text)} tokens"
+              f"{' (compressed)' if compressed else ''}")
+
+    if data_context:
+        data_context = final_texts.pop()
+    all_content = '\n\n'.join(final_texts)
+    report['content_tokens'] = sum(source['final_tokens'] for source in report['sources'])
+    return all_content, data_context, report
+
+def build_data_context(data_analysis):
+    """Prompt section with the data analysis insights (empty without uploaded data)"""
+    data_context = ""
+    if data_analysis:
+        data_context = f"""
+
+DATA ANALYSIS INSIGHTS:
+{json.dumps(data_analysis, indent=2)}
+
+IMPORTANT: Use these data insights in your presentation. The charts visualizing this data are included in the images."""
+    return data_context
+
+# Static slide-writing rules. Sent as a cached system block so repeated requests only
+# pay full price for the small per-request user prompt.
+SLIDES_SYSTEM_PROMPT = """CRITICAL: Return ONLY valid JSON. Do NOT wrap in markdown code blocks. Do NOT add any explanation before or after the JSON.
+
+Return in this EXACT format (insight-based titles + 6×6 rule):
+{"slides": [
+  {"title": "<Presentation Topic>", "content": ["Overview and key objectives", "Topics covered in presentation", "Main takeaways and insights"], "image_index": null},
+  {"title": "Revenue Growth Accelerated 25% Year Over Year", "content": ["Urban markets driving expansion", "Customer base doubled in Q4", "Profit margins improved significantly"], "image_index": 0},
+  {"title": "Project Delivered Ahead of Schedule and Under Budget", "content": ["Completed two weeks early", "Saved 15% on total costs", "Quality metrics exceeded targets"], "image_index": 1},
+  {"title": "Thank You", "content": ["Questions and discussion welcome", "Thank you for attention"], "image_index": null}
+]}
+
+🔴 NOTICE: The example above shows image_index: 0, 1, 2, etc. on content slides. YOU MUST DO THIS with the images I'm providing!
+
+🔴 SLIDE TITLE RULES - ONE MESSAGE PER SLIDE 🔴:
+Each slide title should answer: "What is the one key takeaway?"
+
+❌ WEAK (topic-based titles):
+- "Market Analysis"
+- "Sales Performance"
+- "Customer Data"
+
+✅ STRONG (insight-based titles):
+- "Market Demand Growing 18% Annually in Urban Areas"
+- "Sales Exceeded Target by $2M in Q4"
+- "Customer Retention Rate Reached Record 94%"
+
+🔴 TITLE REQUIREMENTS - MUST BE VERY SHORT 🔴:
+- **CRITICAL: Maximum 1-2 WORDS per title** (VERY SHORT!)
+- State a CONCLUSION, not just a topic
+- Include the KEY FINDING or insight
+- Use specific numbers/data when available
+- Examples: "Revenue Growth", "Customer Satisfaction", "Market Share", "Performance", "Strategy"
+
+Structure Requirements:
+- **First slide (Slide 1)**: Main title slide with overview
+  - Title: Use the **MAIN TOPIC TITLE** (the presentation topic itself)
+  - Content: 4-6 SHORT bullet points (4-6 words each) listing what topics will be covered (adjust based on presentation scope)
+  - No image on first slide
+  - Example: ["Key concepts and introduction", "Data analysis and findings", "Implementation recommendations", "Next steps and timeline", "Summary and conclusions"]
+
+- **Middle slides (every slide between the first and the last)**: Content slides with ONE KEY MESSAGE each
+  - **ONE MESSAGE PER SLIDE**: Each slide answers "What is the one key takeaway?"
+  - **VERY SHORT INSIGHT-BASED TITLE**: Max 1-2 words stating the conclusion (e.g., "Revenue Growth", "Customer Success", "Market Position")
+  - **3-ZONE LAYOUT**:
+    1. Headline (insight/conclusion) at top
+    2. Visual/Chart in middle (if image available)
+    3. Supporting points at bottom (flexible bullets)
+  - **FLEXIBLE BULLET COUNT (3-8 bullets per slide)**: Adjust based on content importance and complexity
+    - **Simple topics**: 3-4 bullets (keep it concise)
+    - **Standard topics**: 5-6 bullets (balanced coverage)
+    - **Complex/Important topics**: 7-8 bullets (comprehensive detail)
+    - **QUALITY OVER QUANTITY**: Include all important points, don't pad or cut artificially
+  - Include images where relevant using "image_index"
+  - **CRITICAL: Each slide MUST have a UNIQUE title - no two slides should have the same title**
+
+- **Last slide**: Thank you slide
+  - Title: **"Thank You"** or **"Questions?"**
+  - Simple closing slide
+  - 2-3 bullet points max
+
+🔴 BULLET POINT RULES - FLEXIBLE & CONTENT-DRIVEN 🔴:
+- **FLEXIBLE BULLET COUNT: 3-8 bullets per slide** (adjust based on content importance)
+  - Use MORE bullets (6-8) for complex, data-rich, or critical topics
+  - Use FEWER bullets (3-4) for simple concepts or introductory slides
+  - Default to 5-6 bullets for standard topics
+  - **NEVER artificially limit important information** - if there are 7-8 key points, include them all
+- **Maximum 6-8 WORDS per bullet point**
+- SHORT, IMPACTFUL, PUNCHY language
+- No long sentences - use brief, powerful phrases
+- Each bullet conveys ONE key insight
+
+EXAMPLES OF GOOD BULLETS (6-8 words):
+✅ "Revenue increased 25% year over year"
+✅ "Customer satisfaction reached all-time high"
+✅ "Project completed ahead of schedule"
+✅ "Team productivity improved with new tools"
+✅ "New features launched successfully this quarter"
+
+EXAMPLES OF BAD BULLETS (too long):
+❌ "The revenue for our organization increased significantly by approximately 25% when compared to the same period in the previous year"
+❌ "Customer satisfaction scores have shown remarkable improvement and reached the highest levels we have ever seen"
+
+Content Requirements:
+- **UNIQUE TITLES**: Every slide must have a unique, descriptive title
+- **CONCISE**: 6-8 words per bullet point maximum
+- **IMPACTFUL**: Make every word count
+- **PROFESSIONAL**: Use clear, direct language
+- **FOCUSED**: One key idea per bullet
+- **DATA-DRIVEN**: Use numbers and facts when available
+- Use insights from the provided content and analyze any provided images for key data points
+- If your content includes URLs, write them as fully qualified URLs (e.g., https://www.example.com)
+
+🔴 CRITICAL FORMATTING RULES 🔴:
+- MUST have 4-5 bullets per slide (MINIMUM 4, MAXIMUM 5)
+- 6-8 words per bullet (NOT sentences)
+- Use strong action verbs
+- Be specific and concrete
+- Avoid fluff and filler words"""
+
+def build_slides_prompt(description, slide_count, all_content, data_context, images_to_send):
+    """User prompt for generating the whole deck in one call (rules live in SLIDES_SYSTEM_PROMPT)"""
+    if images_to_send:
+        chart_indices = [str(i) for i, img in enumerate(images_to_send) if img.get('is_chart')]
+        has_charts = len(chart_indices) > 0
+
+        image_instruction = f"""
+
+🔴 CRITICAL IMAGE INSTRUCTIONS 🔴
+I'm providing {len(images_to_send)} images. These images are numbered 0 to {len(images_to_send)-1}.
+
+{"🔴 IMPORTANT: Images " + ', '.join(chart_indices) + " are DATA CHARTS/GRAPHS generated from the uploaded data file. YOU MUST INCLUDE THESE CHARTS IN YOUR PRESENTATION!" if has_charts else ""}
+
+REQUIRED ACTIONS:
+1. ANALYZE each image to understand what it shows (charts, graphs, data visualizations, diagrams, photos, etc.)
+2. EXTRACT key insights, data points, and trends from the images
+3. INCORPORATE image insights into your slide bullet points
+4. **YOU MUST ASSIGN AT LEAST {min(len(images_to_send), slide_count - 2)} IMAGES TO SLIDES using "image_index" field**
+
+IMAGE ASSIGNMENT RULES:
+- Set "image_index": 0 to put image #0 on that slide
+- Set "image_index": 1 to put image #1 on that slide
+- Set "image_index": 2 to put image #2 on that slide
+- Set "image_index": null ONLY on the first (title) and last (thank you) slides
+- ALL middle content slides SHOULD have an image assigned where relevant
+{"- 🔴 PRIORITY: Data charts (images " + ', '.join(chart_indices) + ") MUST be included on content slides!" if has_charts else ""}
+
+EXAMPLE of correct usage:
+{{"title": "Revenue Analysis", "content": ["..."], "image_index": 0}}  ← Image #0 appears on this slide
+{{"title": "Team Performance", "content": ["..."], "image_index": 1}}  ← Image #1 appears on this slide
+
+DO NOT set image_index to null on content slides when you have images available!"""
+    else:
+        image_instruction = """
+
+🔴 IMPORTANT: NO IMAGES AVAILABLE 🔴
+- Set "image_index": null on ALL slides (including content slides)
+- Do NOT assign any numeric image_index values
+- Create text-only slides with focused content"""
+
+    prompt_text = f"""Create a {slide_count}-slide PowerPoint presentation about: {description}
+
+Based on this content:
+{all_content}{data_context}{image_instruction}
+
+Follow the output format and rules from the system prompt. The first slide's title is "{description}", slides 2 to {slide_count-1} are content slides and the last slide is the thank you slide. Return ONLY the JSON."""
+    return prompt_text
+
+class SlideStreamParser:
+    """
+    Incremental parser that yields each slide object of Claude's {"slides": [...]} reply
+    as soon as its closing brace arrives.
+
+    feed() only scans the newly received text, tracking bracket depth and string state,
+    so the buffer is never re-parsed. Text outside the JSON (markdown fences, a prose
+    preamble) is skipped: strings are only tracked inside brackets, and slides are only
+    taken from the array that follows a "slides" key.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_key = None
+        self._slides_depth = None
+        self._slide_start = None
+
+    def feed(self, chunk):
+        """Add streamed text and return the list of slide dicts completed by it"""
+        self.text += chunk
+        completed = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_key = text[self._string_start + 1:i]
+                continue
+
+            if char == '"' and self._depth > 0:
+                self._in_string = True
+                self._string_start = i
+            elif char in '{[':
+                self._depth += 1
+                if char == '[' and self._last_key == 'slides' and self._slides_depth is None:
+                    self._slides_depth = self._depth
+                elif char == '{' and self._slides_depth is not None and self._depth == self._slides_depth + 1:
+                    self._slide_start = i
+                self._last_key = None
+            elif char in '}]':
+                if char == '}' and self._slide_start is not None and self._depth == self._slides_depth + 1:
+                    try:
+                        completed.append(json.loads(text[self._slide_start:i + 1]))
+                    except json.JSONDecodeError as e:
+                        print(f"Skipping malformed streamed slide: {str(e)}")
+                    self._slide_start = None
+                elif char == ']' and self._depth == self._slides_depth:
+                    self._slides_depth = None
+                self._depth = max(0, self._depth - 1)
+                self._last_key = None
+            elif char == ',':
+                self._last_key = None
+        self._pos = len(text)
+        return completed
+
+def bedrock_stream_errors():
+    """Exceptions raised while reading a Bedrock response stream when the connection or stream fails"""
+    import socket
+    from botocore.exceptions import ConnectionError as BotocoreConnectionError
+    from botocore.exceptions import EventStreamError, ReadTimeoutError, ResponseStreamingError
+    from urllib3.exceptions import ProtocolError
+
+    return (EventStreamError, ReadTimeoutError, ResponseStreamingError, BotocoreConnectionError, ProtocolError,
+            ConnectionError, socket.timeout)
+
+def invoke_claude_streaming(bedrock_client, model_id, request_body, on_slide=None, on_restart=None):
+    """
+    Call Claude with invoke_model_with_response_stream and pass each completed slide
+    to on_slide while the rest of the reply is still being generated.
+
+    Falls back to a single invoke_model call (slides delivered at the end) if
+    streaming is disabled or unavailable, and retries the same way when reading the
+    stream fails (see bedrock_stream_errors) or it ends before message_stop; errors
+    from on_slide or from parsing the reply propagate. Slides already passed to on_slide are from the
+    interrupted reply, so on_restart is called first to discard them; without
+    on_restart an interrupted stream that delivered slides raises instead of leaving a
+    partial deck. Returns (full_text, usage).
+    """
+    parser = SlideStreamParser()
+    usage = {}
+    started = time.monotonic()
+    delivered = 0
+
+    def emit(text):
+        nonlocal delivered
+        for slide in parser.feed(text):
+            delivered += 1
+            if on_slide:
+                on_slide(slide)
+
+    if BEDROCK_STREAMING:
+        try:
+            response = bedrock_client.invoke_model_with_response_stream(
+                modelId=model_id,
+                body=json.dumps(request_body)
+            )
+        except Exception as e:
+            print(f"Streaming invocation failed, falling back to invoke_model: {str(e)}")
+            response = None
+
+        if response is not None:
+            first_token = None
+            finished = False
+            error = None
+            transport_errors = bedrock_stream_errors()
+            events = iter(response['body'])
+            try:
+                while True:
+                    # Only reading the stream counts as an interruption; errors from parsing
+                    # the reply or building slides (emit, on_slide) propagate
+                    try:
+                        event = next(events)
+                    except StopIteration:
+                        break
+                    except transport_errors as e:
+                        error = e
+                        break
+                    chunk = event.get('chunk')
+                    if not chunk:
+                        continue
+                    data = json.loads(chunk['bytes'])
+                    if data['type'] == 'message_start':
+                        usage.update(data['message'].get('usage', {}))
+                    elif data['type'] == 'content_block_delta' and data['delta'].get('type') == 'text_delta':
+                        if first_token is None:
+                            first_token = time.monotonic() - started
+                        emit(data['delta']['text'])
+                    elif data['type'] == 'message_delta':
+                        usage.update(data.get('usage', {}))
+                    elif data['type'] == 'message_stop':
+                        finished = True
+            finally:
+                # Frees the Bedrock concurrency slot even if on_slide or parsing raised
+                if hasattr(response['body'], 'close'):
+                    response['body'].close()
+
+            if finished:
+                print(f"Streamed Claude response in {time.monotonic() - started:.2f}s "
+                      f"(first token after {first_token or 0:.2f}s): {describe_usage(usage)}")
+                return parser.text, usage
+
+            print(f"Claude stream interrupted after {len(parser.text)} characters and {delivered} slides "
+                  f"({str(error) if error else 'ended before message_stop'}), retrying with invoke_model")
+            if delivered:
+                if on_restart is None:
+                    raise RuntimeError(f"Claude stream interrupted after {delivered} slides") from error
+                on_restart()
+            parser = SlideStreamParser()
+            delivered = 0
+
+    text, reply_usage = invoke_claude(bedrock_client, model_id, request_body)
+    add_usage(usage, reply_usage)
+    emit(text)
+    return parser.text, usage
+
+SLIDE_MODEL_ID = os.environ.get('SLIDE_MODEL_ID', 'us.anthropic.claude-sonnet-4-5-20250929-v1:0')
+OUTLINE_MODEL_ID = os.environ.get('OUTLINE_MODEL_ID', 'us.anthropic.claude-haiku-4-5-20251001-v1:0')
+SLIDE_GENERATION_MODE = os.environ.get('SLIDE_GENERATION_MODE', 'single')  # 'single' or 'outline'
+OUTLINE_FILL_CONCURRENCY = int(os.environ.get('OUTLINE_FILL_CONCURRENCY', '4'))
+
+# Shared limits for every Bedrock call made while handling one request
+BEDROCK_MAX_CONCURRENCY = int(os.environ.get('BEDROCK_MAX_CONCURRENCY', '4'))
+BEDROCK_RATE_PER_SECOND = float(os.environ.get('BEDROCK_RATE_PER_SECOND', '2'))
+BEDROCK_RATE_BURST = int(os.environ.get('BEDROCK_RATE_BURST', '4'))
+BEDROCK_MAX_RETRIES = int(os.environ.get('BEDROCK_MAX_RETRIES', '4'))
+BEDROCK_BACKOFF_BASE = float(os.environ.get('BEDROCK_BACKOFF_BASE', '0.5'))
+BEDROCK_BACKOFF_MAX = float(os.environ.get('BEDROCK_BACKOFF_MAX', '8'))
+BEDROCK_FALLBACK_MODEL_ID = os.environ.get('BEDROCK_FALLBACK_MODEL_ID') or None
+BEDROCK_FALLBACK_AFTER_THROTTLES = int(os.environ.get('BEDROCK_FALLBACK_AFTER_THROTTLES', '3'))
+# ServiceQuotaExceededException is a hard quota, not throttling: retrying it only burns the backoff
+BEDROCK_THROTTLE_CODES = ('ThrottlingException', 'TooManyRequestsException')
+BEDROCK_RETRYABLE_CODES = BEDROCK_THROTTLE_CODES + ('ServiceUnavailableException', 'InternalServerException',
+                                                   'ModelNotReadyException', 'ModelTimeoutException')
+
+class TokenBucket:
+    """Thread-safe token bucket: acquire() blocks until a token is available"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token; returns the seconds spent waiting"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class ReleasingStream:
+    """
+    Streaming response body that frees a BedrockCaller concurrency slot exactly once:
+    when the events are exhausted, when iteration stops early, or on close() for a
+    body that is never iterated.
+    """
+
+    def __init__(self, events, release):
+        self._events = events
+        self._release = release
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            for event in self._events:
+                yield event
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._release()
+        if hasattr(self._events, 'close'):
+            self._events.close()
+
+    def __del__(self):
+        self.close()
+
+class BedrockCaller:
+    """
+    Wraps a bedrock-runtime client so all LLM calls of one request share a concurrency
+    semaphore and a token-bucket rate limit, and throttled or transient failures are
+    retried with full-jitter exponential backoff.
+
+    After BEDROCK_FALLBACK_AFTER_THROTTLES consecutive throttles, calls switch to
+    BEDROCK_FALLBACK_MODEL_ID (if set) for the rest of the request. Exposes the same
+    invoke_model / invoke_model_with_response_stream methods as the boto3 client and
+    records one metrics entry per call (see metrics()).
+    """
+
+    def __init__(self, client, max_concurrency=BEDROCK_MAX_CONCURRENCY, rate_per_second=BEDROCK_RATE_PER_SECOND,
+                 burst=BEDROCK_RATE_BURST, max_retries=BEDROCK_MAX_RETRIES, fallback_model_id=BEDROCK_FALLBACK_MODEL_ID):
+        self.client = client
+        self.max_retries = max_retries
+        self.fallback_model_id = fallback_model_id
+        self._semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._bucket = TokenBucket(rate_per_second, max(1, burst))
+        self._lock = threading.Lock()
+        self._consecutive_throttles = 0
+        self._use_fallback = False
+        self.calls = []
+
+    @staticmethod
+    def error_code(error):
+        return getattr(error, 'response', {}).get('Error', {}).get('Code', type(error).__name__)
+
+    def _model_for(self, model_id):
+        with self._lock:
+            if self._use_fallback and self.fallback_model_id:
+                return self.fallback_model_id
+        return model_id
+
+    def _record_throttle(self, throttled):
+        with self._lock:
+            self._consecutive_throttles = self._consecutive_throttles + 1 if throttled else 0
+            if (throttled and self.fallback_model_id and not self._use_fallback
+                    and self._consecutive_throttles >= BEDROCK_FALLBACK_AFTER_THROTTLES):
+                self._use_fallback = True
+                print(f"Sustained Bedrock throttling, switching to fallback model {self.fallback_model_id}")
+
+    def _call(self, operation, modelId, body, **kwargs):
+        metric = {'operation': operation, 'requested_model': modelId, 'attempts': 0, 'retries': 0,
+                  'throttles': 0, 'rate_wait_ms': 0, 'status': 'ok'}
+        started = time.monotonic()
+        self._semaphore.acquire()
+        release = True
+        try:
+            for attempt in range(self.max_retries + 1):
+                metric['rate_wait_ms'] += int(self._bucket.acquire() * 1000)
+                metric['model'] = self._model_for(modelId)
+                metric['attempts'] += 1
+                try:
+                    response = getattr(self.client, operation)(modelId=metric['model'], body=body, **kwargs)
+                    self._record_throttle(False)
+                    if operation == 'invoke_model_with_response_stream':
+                        # Keep the concurrency slot until the caller has consumed or closed the stream
+                        response = dict(response, body=ReleasingStream(response['body'], self._semaphore.release))
+                        release = False
+                    return response
+                except Exception as e:
+                    code = self.error_code(e)
+                    throttled = code in BEDROCK_THROTTLE_CODES
+                    if throttled:
+                        metric['throttles'] += 1
+                    self._record_throttle(throttled)
+                    if code not in BEDROCK_RETRYABLE_CODES or attempt == self.max_retries:
+                        metric['status'] = code
+                        raise
+                    delay = random.uniform(0, min(BEDROCK_BACKOFF_MAX, BEDROCK_BACKOFF_BASE * 2 ** attempt))
+                    print(f"Bedrock {operation} got {code}, retrying in {delay:.2f}s (attempt {attempt + 1})")
+                    metric['retries'] += 1
+                    time.sleep(delay)
+        finally:
+            if release:
+                self._semaphore.release()
+            metric['latency_ms'] = int((time.monotonic() - started) * 1000)
+            metric['fallback'] = metric.get('model') != modelId
+            with self._lock:
+                self.calls.append(metric)
+            print(json.dumps(dict(metric, metric='bedrock_call')))
+
+    def invoke_model(self, modelId, body, **kwargs):
+        return self._call('invoke_model', modelId, body, **kwargs)
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        return self._call('invoke_model_with_response_stream', modelId, body, **kwargs)
+
+    def metrics(self):
+        """Summary of all calls made through this wrapper"""
+        with self._lock:
+            calls = list(self.calls)
+        latencies = sorted(call['latency_ms'] for call in calls)
+        return {
+            'calls': len(calls),
+            'retries': sum(call['retries'] for call in calls),
+            'throttles': sum(call['throttles'] for call in calls),
+            'failed': sum(1 for call in calls if call['status'] != 'ok'),
+            'fallback_calls': sum(1 for call in calls if call['fallback']),
+            'rate_wait_ms': sum(call['rate_wait_ms'] for call in calls),
+            'latency_ms_p50': latencies[len(latencies) // 2] if latencies else None,
+            'latency_ms_max': latencies[-1] if latencies else None
+        }
+
+def bedrock_caller():
+    """bedrock-runtime client for one request; retries are handled by BedrockCaller, not botocore"""
+    from botocore.config import Config
+
+    return BedrockCaller(boto3.client('bedrock-runtime', region_name='us-west-2',
+                                      config=Config(retries={'max_attempts': 1, 'mode': 'standard'})))
+
+PROMPT_CACHING = os.environ.get('PROMPT_CACHING', 'true').lower() != 'false'
+
+def text_block(text, cache=False):
+    """Text content block; cache=True marks the end of a prompt-cache prefix"""
+    block = {"type": "text", "text": text}
+    if cache and PROMPT_CACHING:
+        block["cache_control"] = {"type": "ephemeral"}
+    return block
+
+def describe_usage(usage):
+    return (f"input={usage.get('input_tokens', 0)} output={usage.get('output_tokens', 0)} "
+            f"cache_read={usage.get('cache_read_input_tokens', 0)} "
+            f"cache_write={usage.get('cache_creation_input_tokens', 0)}")
+
+def claude_image_block(img):
+    if not img.get('base64') and img.get('chart_data'):
+        # Native chart without a rendered preview: describe its data instead
+        return text_block(describe_chart(img['chart_data']))
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": img['media_type'],
+            "data": img['base64']
+        }
+    }
+
+def add_usage(total, usage):
+    """Sum Bedrock token usage dicts in place"""
+    for key, value in usage.items():
+        if isinstance(value, int):
+            total[key] = total.get(key, 0) + value
+    return total
+
+def invoke_claude(bedrock_client, model_id, request_body):
+    """Single invoke_model call; returns (text, usage)"""
+    response = bedrock_client.invoke_model(modelId=model_id, body=json.dumps(request_body))
+    result = json.loads(response['body'].read())
+    usage = result.get('usage', {})
+    print(f"Claude call {model_id}: {describe_usage(usage)}")
+    return result['content'][0]['text'], usage
+
+def build_outline_prompt(description, slide_count, all_content, data_context, images_to_send):
+    """Prompt for the cheap first phase: slide titles, focus and image assignments only"""
+    chart_indices = [str(i) for i, img in enumerate(images_to_send) if img.get('is_chart')]
+    if images_to_send:
+        image_instruction = f"""
+I'm providing {len(images_to_send)} images, numbered 0 to {len(images_to_send)-1}. Assign at least {min(len(images_to_send), slide_count - 2)} of them to middle slides with "image_index" (null on the first and last slides).{" Images " + ', '.join(chart_indices) + " are DATA CHARTS from the uploaded file and MUST be used." if chart_indices else ""}"""
+    else:
+        image_instruction = """
+No images are available: set "image_index": null on every slide."""
+
+    return f"""Plan a {slide_count}-slide PowerPoint presentation about: {description}
+
+Based on this content:
+{all_content}{data_context}
+{image_instruction}
+
+Return ONLY valid JSON, no markdown, in this EXACT format:
+{{"slides": [
+  {{"title": "{description}", "focus": "Overview of the topics covered", "image_index": null}},
+  {{"title": "Revenue Growth", "focus": "Revenue grew 25% year over year, driven by urban markets", "image_index": 0}},
+  {{"title": "Thank You", "focus": "Closing and questions", "image_index": null}}
+]}}
+
+Rules:
+- Exactly {slide_count} slides: the first is the title slide ("{description}"), the last is "Thank You"
+- Middle slides have ONE key message each, with a VERY SHORT insight-based title (1-2 words)
+- Every title must be unique
+- "focus" is one sentence stating the slide's key takeaway, with specific numbers when available"""
+
+def build_fill_context(description, slide_count, all_content, data_context, outline):
+    """Shared first block of every fill call: source content plus the outline (cached across slides)"""
+    outline_text = '\n'.join(f"{i + 1}. {s['title']}" for i, s in enumerate(outline))
+    return f"""Based on this content:
+{all_content}{data_context}
+
+Presentation about: {description} ({slide_count} slides)
+Outline:
+{outline_text}"""
+
+def build_fill_prompt(outline, position):
+    """Slide-specific second block of a fill call: bullets for one slide of the outline"""
+    slide = outline[position]
+    if position == 0:
+        bullet_rules = "4-6 SHORT bullets (4-6 words each) listing the topics the presentation covers"
+    elif position == len(outline) - 1:
+        bullet_rules = "2-3 short closing bullets"
+    else:
+        bullet_rules = ("3-8 bullets depending on how much there is to say (default 5-6), "
+                        "maximum 6-8 words each, one insight per bullet, specific numbers and facts")
+    image_note = ("\nThe attached image appears on this slide: analyze it and use its key data points in the bullets."
+                  if slide.get('image_index') is not None else "")
+
+    return f"""Write the bullet points for slide {position + 1}: "{slide['title']}"
+Key message: {slide.get('focus', '')}{image_note}
+
+Bullets: {bullet_rules}. No long sentences. If a bullet includes a URL, write it fully qualified (e.g., https://www.example.com).
+
+Return ONLY valid JSON, no markdown: {{"content": ["...", "..."]}}"""
+
+def parse_fill_reply(text):
+    """Extract the bullet list from a fill reply, tolerating fences and prose around the JSON"""
+    match = re.search(r'\{[\s\S]*\}', text)
+    if not match:
+        return None
+    try:
+        content = json.loads(match.group(0)).get('content')
+    except json.JSONDecodeError:
+        return None
+    if isinstance(content, list) and content:
+        return [str(item) for item in content]
+    return None
+
+def generate_slides_outline_fill(bedrock_client, description, slide_count, all_content, data_context,
+                                 images_to_send, on_slide=None, max_workers=OUTLINE_FILL_CONCURRENCY,
+                                 retrieve_content=None):
+    """
+    Two-phase slide generation: one cheap outline call (titles, focus and image
+    assignments), then one bullet-filling call per slide with at most max_workers in
+    flight. If given, retrieve_content(outline) re-selects the source content for the
+    fill calls once the outline is known.
+
+    Slides are passed to on_slide in order as soon as each one and all before it are
+    filled. Returns (slides, usage); slides is None if the outline could not be
+    produced, so the caller can fall back to single-shot generation.
+    """
+    usage = {}
+    started = time.monotonic()
+
+    try:
+        outline_request = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": 1000,
+            "temperature": 0.5,
+            "messages": [{"role": "user", "content": [claude_image_block(img) for img in images_to_send] + [
+                {"type": "text", "text": build_outline_prompt(description, slide_count, all_content, data_context, images_to_send)}
+            ]}]
+        }
+        outline_text, outline_usage = invoke_claude(bedrock_client, OUTLINE_MODEL_ID, outline_request)
+        add_usage(usage, outline_usage)
+    except Exception as e:
+        print(f"Outline call failed: {str(e)}")
+        return None, usage
+
+    outline = [s for s in SlideStreamParser().feed(outline_text) if isinstance(s, dict) and s.get('title')]
+    if not outline:
+        print(f"Could not parse outline: {outline_text[:500]}")
+        return None, usage
+    if len(outline) < slide_count:
+        print(f"Outline has {len(outline)} slides instead of {slide_count}: {outline_text[:500]}")
+        return None, usage
+    if len(outline) > slide_count:
+        # Keep the title and content slides up to the count, plus the closing slide
+        print(f"Outline has {len(outline)} slides instead of {slide_count}, dropping the extra content slides")
+        outline = outline[:slide_count - 1] + outline[-1:]
+    for slide in outline:
+        index = slide.get('image_index')
+        if not isinstance(index, int) or not 0 <= index < len(images_to_send):
+            slide['image_index'] = None
+    print(f"Outline with {len(outline)} slides in {time.monotonic() - started:.2f}s: {[s['title'] for s in outline]}")
+    if retrieve_content:
+        all_content = retrieve_content(outline)
+
+    # Identical leading block for every slide, so later fill calls read it from the prompt cache
+    fill_context = text_block(build_fill_context(description, slide_count, all_content, data_context, outline), cache=True)
+
+    def fill(position):
+        slide = outline[position]
+        content = [fill_context]
+        if slide['image_index'] is not None:
+            content.append(claude_image_block(images_to_send[slide['image_index']]))
+        content.append(text_block(build_fill_prompt(outline, position)))
+        text, fill_usage = invoke_claude(bedrock_client, SLIDE_MODEL_ID, {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": 600,
+            "temperature": 0.7,
+            "messages": [{"role": "user", "content": content}]
+        })
+        return parse_fill_reply(text), fill_usage
+
+    slides = [None] * len(outline)
+    next_position = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(outline)))) as executor:
+        # The first fill call goes alone and writes fill_context to the prompt cache; the rest
+        # are sent once it is done, so they read the cache instead of each writing it again
+        futures = {executor.submit(fill, 0): 0}
+        queued = list(range(1, len(outline)))
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                position = futures.pop(future)
+                bullets = None
+                try:
+                    bullets, fill_usage = future.result()
+                    add_usage(usage, fill_usage)
+                except Exception as e:
+                    print(f"Fill call for slide {position + 1} failed: {str(e)}")
+                if not bullets:
+                    bullets = [outline[position].get('focus') or outline[position]['title']]
+                slides[position] = {
+                    "title": outline[position]['title'],
+                    "content": bullets,
+                    "image_index": outline[position]['image_index']
+                }
+
+            # Hand slides over in order as the filled prefix grows
+            while next_position < len(slides) and slides[next_position] is not None:
+                if on_slide:
+                    on_slide(slides[next_position])
+                next_position += 1
+
+            futures.update({executor.submit(fill, position): position for position in queued})
+            queued = []
+
+    print(f"Outline-then-fill generated {len(slides)} slides in {time.monotonic() - started:.2f}s")
+    return slides, usage
+
+def ensure_unique_titles(slides_list, titles_seen=None):
+    """
+    Ensure all slide titles are unique by adding numbers if needed.
+
+    Pass the same titles_seen dict across calls to de-duplicate slides that arrive
+    one at a time.
+    """
+    if titles_seen is None:
+        titles_seen = {}
+    for slide in slides_list:
+        original_title = slide['title']
+        if original_title in titles_seen:
+            # Title is duplicate, add number
+            titles_seen[original_title] += 1
+            slide['title'] = f"{original_title} ({titles_seen[original_title]})"
+        else:
+            titles_seen[original_title] = 1
+    return slides_list
+
+class PresentationBuilder:
+    """
+    Builds the deck one slide at a time, so slides can be added as Claude streams them.
+
+    Raises ImportError if python-pptx is not available.
+    """
+
+    def __init__(self, all_images):
+        from pptx import Presentation
+        from pptx.util import Inches, Pt
+        from pptx.dml.color import RGBColor
+
+        self.all_images = all_images
+        self.images_inserted = 0
+
+        self.prs = Presentation()
+        self.prs.slide_width = Inches(10)  # Standard widescreen
+        self.prs.slide_height = Inches(7.5)
+
+        # Professional design constants - Following modern corporate standards
+        # Modern professional fonts: Calibri, Arial, Helvetica, Segoe UI
+        self.title_font = 'Calibri'  # Modern corporate standard
+        self.body_font = 'Calibri'   # Consistent, professional
+        self.title_size = Pt(36)     # Professional title (28-40pt range)
+        self.body_size = Pt(20)      # Professional body (18-24pt range)
+        self.title_color = RGBColor(31, 56, 100)  # Professional dark blue (primary color)
+        self.body_color = RGBColor(64, 64, 64)    # Dark gray - high contrast on white
+
+    def add_slide(self, slide_data):
+        from pptx.util import Inches, Pt
+        from pptx.enum.text import PP_ALIGN, MSO_ANCHOR
+
+        prs = self.prs
+        all_images = self.all_images
+        TITLE_FONT, BODY_FONT = self.title_font, self.body_font
+        TITLE_SIZE, BODY_SIZE = self.title_size, self.body_size
+        TITLE_COLOR, BODY_COLOR = self.title_color, self.body_color
+
+        # Check if slide has an image
+        has_image = slide_data.get('image_index') is not None
+        image_index = slide_data.get('image_index')
+
+        if has_image and image_index is not None and image_index < len(all_images):
+            # Try to add image, fall back to text-only if it fails
+            try:
+                # Use blank layout for custom positioning
+                slide_layout = prs.slide_layouts[6]  # Blank layout
+                slide = prs.slides.add_slide(slide_layout)
+
+                # 3-ZONE LAYOUT: Zone 1 - Headline (key message/insight)
+                # Add title with professional formatting - positioned at top to minimize gaps
+                title_box = slide.shapes.add_textbox(Inches(0.6), Inches(0.3), Inches(8.8), Inches(0.9))
+                title_frame = title_box.text_frame
+                title_frame.text = slide_data['title']
+                title_frame.word_wrap = True
+                title_para = title_frame.paragraphs[0]
+                title_para.font.name = TITLE_FONT
+                title_para.font.size = TITLE_SIZE
+                title_para.font.bold = True
+                title_para.font.color.rgb = TITLE_COLOR
+                title_para.alignment = PP_ALIGN.LEFT
+                title_para.space_after = Pt(6)  # Space below title
+
+                # Add image
+                img_data = all_images[image_index]
+
+                img_path = None
+                if img_data.get('chart_data'):
+                    # 3-ZONE LAYOUT: Zone 2 - Visual/Chart (middle)
+                    # Data charts go in as native PowerPoint charts so they stay editable
+                    picture = add_native_chart(
+                        slide, img_data['chart_data'], Inches(5.6), Inches(1.4),
+                        Inches(SLIDE_IMAGE_WIDTH_INCHES), Inches(SLIDE_IMAGE_WIDTH_INCHES * 0.6)
+                    )
+                else:
+                    # Determine file extension from media type
+                    ext_map = {
+                        'image/jpeg': 'jpg',
+                        'image/png': 'png',
+                        'image/gif': 'gif',
+                        'image/webp': 'webp'
+                    }
+                    ext = ext_map.get(img_data['slide_media_type'], 'jpg')
+                    img_path = f"/tmp/slide_img_{uuid.uuid4().hex[:8]}.{ext}"
+
+                    # Decode and save image (slide-embed variant sized for the picture box)
+                    with open(img_path, 'wb') as img_file:
+                        img_file.write(base64.b64decode(img_data['slide_base64']))
+
+                    # 3-ZONE LAYOUT: Zone 2 - Visual/Chart (middle)
+                    # Insert image (right side) - positioned higher to fill space
+                    picture = slide.shapes.add_picture(img_path, Inches(5.6), Inches(1.4), width=Inches(SLIDE_IMAGE_WIDTH_INCHES))
+
+                # Add alt text to image (accessibility requirement)
+                if img_data.get('is_chart'):
+                    # For generated charts
+                    alt_text = img_data.get('chart_title', f"Data visualization chart for {slide_data['title']}")
+                else:
+                    # For web images
+                    alt_text = f"Image related to {slide_data['title']}"
+
+                # Set the alternative text for the picture
+                picture._element._nvXxPr.cNvPr.set('descr', alt_text)
+
+                # Track successful image insertion
+                self.images_inserted += 1
+
+                # 3-ZONE LAYOUT: Zone 3 - Supporting points (bottom/left)
+                # Add bullet points - maximize vertical fill with minimal margins
+                text_box = slide.shapes.add_textbox(Inches(0.6), Inches(1.3), Inches(4.6), Inches(6.0))
+                tf = text_box.text_frame
+                tf.word_wrap = True
+                tf.vertical_anchor = MSO_ANCHOR.TOP
+                tf.margin_left = Inches(0.1)
+                tf.margin_right = Inches(0.1)
+                tf.margin_top = Inches(0.05)
+                tf.margin_bottom = Inches(0.05)
+
+                # Bullet Point Rule: 3-8 bullets (flexible based on content), max 6-8 words per bullet
+                content_items = slide_data['content'][:8]
+
+                # First bullet point with URL hyperlinks
+                p = tf.paragraphs[0]
+                # Limit to 8 words for slides with images (slightly relaxed for readability)
+                words = content_items[0].split()
+                bullet_text = ' '.join(words[:8]) + ('...' if len(words) > 8 else '')
+                add_hyperlinks_to_paragraph(p, bullet_text)
+                p.font.name = BODY_FONT
+                p.font.size = BODY_SIZE
+                p.font.color.rgb = BODY_COLOR
+                p.space_after = Pt(24)
+                p.level = 0
+                # Enable bullet point with explicit character
+                from pptx.oxml.xmlchemy import OxmlElement
+                pPr = p._element.get_or_add_pPr()
+                # Add bullet character element
+                buChar = OxmlElement('a:buChar')
+                buChar.set('char', '•')
+                pPr.append(buChar)
+
+                # Additional bullet points with URL hyperlinks
+                for bullet_point in content_items[1:]:
+                    p = tf.add_paragraph()
+                    # Limit to 8 words per bullet
+                    words = bullet_point.split()
+                    bullet_text = ' '.join(words[:8]) + ('...' if len(words) > 8 else '')
+                    add_hyperlinks_to_paragraph(p, bullet_text)
+                    p.font.name = BODY_FONT
+                    p.font.size = BODY_SIZE
+                    p.font.color.rgb = BODY_COLOR
+                    p.space_after = Pt(24)
+                    p.level = 0
+                    # Enable bullet point with explicit character
+                    from pptx.oxml.xmlchemy import OxmlElement
+                    pPr = p._element.get_or_add_pPr()
+                    # Add bullet character element
+                    buChar = OxmlElement('a:buChar')
+                    buChar.set('char', '•')
+                    pPr.append(buChar)
+
+                # Enable auto-fit to prevent text overflow
+                tf.auto_size = None
+                tf.word_wrap = True
+
+                # Clean up temp image
+                if img_path and os.path.exists(img_path):
+                    os.remove(img_path)
+
+            except Exception as img_error:
+                # If image fails, create text-only slide instead
+                print(f"Error adding image: {str(img_error)}, falling back to text-only")
+
+                # Remove the failed slide if it was created
+                if len(prs.slides) > 0:
+                    try:
+                        rId = prs.slides._sldIdLst[-1].rId
+                        prs.part.drop_rel(rId)
+                        del prs.slides._sldIdLst[-1]
+                    except:
+                        pass
+
+                # Create text-only slide instead with professional formatting
+                slide_layout = prs.slide_layouts[6]  # Use blank layout for consistency
+                slide = prs.slides.add_slide(slide_layout)
+
+                # 3-ZONE LAYOUT: Zone 1 - Headline (fallback slide)
+                # Add title - positioned at top to minimize gaps
+                title_box = slide.shapes.add_textbox(Inches(0.6), Inches(0.3), Inches(8.8), Inches(0.9))
+                title_frame = title_box.text_frame
+                title_frame.text = slide_data['title']
+                title_frame.word_wrap = True
+                title_para = title_frame.paragraphs[0]
+                title_para.font.name = TITLE_FONT
+                title_para.font.size = TITLE_SIZE
+                title_para.font.bold = True
+                title_para.font.color.rgb = TITLE_COLOR
+                title_para.alignment = PP_ALIGN.LEFT
+                title_para.space_after = Pt(6)
+
+                # 3-ZONE LAYOUT: Zone 3 - Supporting points (centered)
+                # Add content - maximize vertical fill with minimal margins
+                text_box = slide.shapes.add_textbox(Inches(1.2), Inches(1.3), Inches(7.6), Inches(6.0))
+                tf = text_box.text_frame
+                tf.word_wrap = True
+                tf.vertical_anchor = MSO_ANCHOR.TOP
+                tf.margin_left = Inches(0.15)
+                tf.margin_right = Inches(0.15)
+                tf.margin_top = Inches(0.1)
+                tf.margin_bottom = Inches(0.1)
+
+                # Bullet Point Rule: 3-8 bullets (flexible based on content), max 6-8 words per bullet
+                content_items = slide_data['content'][:8]
+
+                # First bullet point with URL hyperlinks
+                p = tf.paragraphs[0]
+                # Limit to 10 words for full-width slides (more space available)
+                words = content_items[0].split()
+                bullet_text = ' '.join(words[:10]) + ('...' if len(words) > 10 else '')
+                add_hyperlinks_to_paragraph(p, bullet_text)
+                p.font.name = BODY_FONT
+                p.font.size = BODY_SIZE
+                p.font.color.rgb = BODY_COLOR
+                p.space_after = Pt(24)
+                p.level = 0
+                # Enable bullet point with explicit character
+                from pptx.oxml.xmlchemy import OxmlElement
+                pPr = p._element.get_or_add_pPr()
+                # Add bullet character element
+                buChar = OxmlElement('a:buChar')
+                buChar.set('char', '•')
+                pPr.append(buChar)
+
+                # Additional bullet points with URL hyperlinks
+                for bullet_point in content_items[1:]:
+                    p = tf.add_paragraph()
+                    # Limit to 10 words per bullet
+                    words = bullet_point.split()
+                    bullet_text = ' '.join(words[:10]) + ('...' if len(words) > 10 else '')
+                    add_hyperlinks_to_paragraph(p, bullet_text)
+                    p.font.name = BODY_FONT
+                    p.font.size = BODY_SIZE
+                    p.font.color.rgb = BODY_COLOR
+                    p.space_after = Pt(24)
+                    p.level = 0
+                    # Enable bullet point with explicit character
+                    from pptx.oxml.xmlchemy import OxmlElement
+                    pPr = p._element.get_or_add_pPr()
+                    # Add bullet character element
+                    buChar = OxmlElement('a:buChar')
+                    buChar.set('char', '•')
+                    pPr.append(buChar)
+
+                # Enable auto-fit to prevent text overflow
+                tf.auto_size = None
+                tf.word_wrap = True
+
+                # Clean up temp image file if it exists
+                try:
+                    if 'img_path' in locals() and img_path and os.path.exists(img_path):
+                        os.remove(img_path)
+                except:
+                    pass
+
+        else:
+            # Regular text-only slide with professional formatting
+            slide_layout = prs.slide_layouts[6]  # Blank layout for consistency
+            slide = prs.slides.add_slide(slide_layout)
+
+            # 3-ZONE LAYOUT: Zone 1 - Headline (key message)
+            # Add title - positioned at top to minimize gaps
+            title_box = slide.shapes.add_textbox(Inches(0.6), Inches(0.3), Inches(8.8), Inches(0.9))
+            title_frame = title_box.text_frame
+            title_frame.text = slide_data['title']
+            title_frame.word_wrap = True
+            title_para = title_frame.paragraphs[0]
+            title_para.font.name = TITLE_FONT
+            title_para.font.size = TITLE_SIZE
+            title_para.font.bold = True
+            title_para.font.color.rgb = TITLE_COLOR
+            title_para.alignment = PP_ALIGN.LEFT
+            title_para.space_after = Pt(6)
+
+            # 3-ZONE LAYOUT: Zone 3 - Supporting points (centered with whitespace)
+            # Add content - maximize vertical fill with minimal margins
+            text_box = slide.shapes.add_textbox(Inches(1.2), Inches(1.3), Inches(7.6), Inches(6.0))
+            tf = text_box.text_frame
+            tf.word_wrap = True
+            tf.vertical_anchor = MSO_ANCHOR.TOP
+            tf.margin_left = Inches(0.15)
+            tf.margin_right = Inches(0.15)
+            tf.margin_top = Inches(0.1)
+            tf.margin_bottom = Inches(0.1)
+
+            # Bullet Point Rule: 3-8 bullets (flexible based on content), max 6-8 words per bullet
+            content_items = slide_data['content'][:8]
+
+            # First bullet point with hyperlinks
+            p = tf.paragraphs[0]
+            # Limit to 10 words for full-width slides (more space available)
+            words = content_items[0].split()
+            bullet_text = ' '.join(words[:10]) + ('...' if len(words) > 10 else '')
+            add_hyperlinks_to_paragraph(p, bullet_text)
+            p.font.name = BODY_FONT
+            p.font.size = BODY_SIZE
+            p.font.color.rgb = BODY_COLOR
+            p.space_after = Pt(24)
+            p.level = 0
+            # Enable bullet point with explicit character
+            from pptx.oxml.xmlchemy import OxmlElement
+            pPr = p._element.get_or_add_pPr()
+            # Add bullet character element
+            buChar = OxmlElement('a:buChar')
+            buChar.set('char', '•')
+            pPr.append(buChar)
+
+            # Additional bullet points with hyperlinks
+            for bullet_point in content_items[1:]:
+                p = tf.add_paragraph()
+                # Limit to 10 words per bullet
+                words = bullet_point.split()
+                bullet_text = ' '.join(words[:10]) + ('...' if len(words) > 10 else '')
+                add_hyperlinks_to_paragraph(p, bullet_text)
+                p.font.name = BODY_FONT
+                p.font.size = BODY_SIZE
+                p.font.color.rgb = BODY_COLOR
+                p.space_after = Pt(24)
+                p.level = 0
+                # Enable bullet point with explicit character
+                from pptx.oxml.xmlchemy import OxmlElement
+                pPr = p._element.get_or_add_pPr()
+                # Add bullet character element
+                buChar = OxmlElement('a:buChar')
+                buChar.set('char', '•')
+                pPr.append(buChar)
+
+            # Enable auto-fit to prevent text overflow
+            tf.auto_size = None
+            tf.word_wrap = True
+
+# Async job mode: POST /jobs returns a job id immediately, the generation runs in a
+# second (Event) Lambda invocation or a local worker thread, and GET /jobs/{job_id}
+# reports stage progress and the download URL once the deck is ready.
+JOB_STORE_BACKEND = os.environ.get('JOB_STORE', 's3' if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') else 'sqlite')
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', '/tmp/ppt_jobs.sqlite3')
+JOB_STORE_S3_BUCKET = os.environ.get('JOB_STORE_S3_BUCKET', os.environ.get('S3_BUCKET', 'ppt-generator-1759467436-803633136603'))
+JOB_RUNNER = os.environ.get('JOB_RUNNER', 'lambda' if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') else 'thread')
+JOB_STAGES = ['queued', 'parsing_data', 'crawling', 'downloading_images', 'generating_slides',
+              'building_pptx', 'uploading', 'done']
+
+class JobStore(abc.ABC):
+    """
+    Interface for async job persistence.
+
+    A job is a dict with job_id, status (queued/running/done/failed), stage,
+    progress (0-1), created_at, updated_at and, when finished, result or error.
+    The original request body is stored separately since it can be several MB.
+    """
+
+    @abc.abstractmethod
+    def create(self, job_id, request_body):
+        """Store a new queued job and its request body; returns the job"""
+
+    @abc.abstractmethod
+    def get(self, job_id):
+        """The job dict, or None for an unknown job id"""
+
+    @abc.abstractmethod
+    def get_request(self, job_id):
+        """The stored request body, or None for an unknown job id"""
+
+    @abc.abstractmethod
+    def update(self, job_id, **fields):
+        """Merge fields into the job and bump updated_at; returns the job, or None if unknown"""
+
+    @staticmethod
+    def new_job(job_id):
+        now = time.time()
+        return {
+            'job_id': job_id,
+            'status': 'queued',
+            'stage': 'queued',
+            'progress': 0.0,
+            'created_at': now,
+            'updated_at': now
+        }
+
+class SQLiteJobStore(JobStore):
+    """Job store in a local SQLite file, for local development and single-host workers"""
+
+    def __init__(self, path):
+        import sqlite3
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, job TEXT, request TEXT)')
+        self._db.commit()
+
+    def create(self, job_id, request_body):
+        job = self.new_job(job_id)
+        with self._lock:
+            self._db.execute('INSERT INTO jobs VALUES (?, ?, ?)', (job_id, json.dumps(job), json.dumps(request_body)))
+            self._db.commit()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute('SELECT job FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_request(self, job_id):
+        with self._lock:
+            row = self._db.execute('SELECT request FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            row = self._db.execute('SELECT job FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if not row:
+                return None
+            job = json.loads(row[0])
+            job.update(fields, updated_at=time.time())
+            self._db.execute('UPDATE jobs SET job = ? WHERE job_id = ?', (json.dumps(job), job_id))
+            self._db.commit()
+        return job
+
+class S3JobStore(JobStore):
+    """Job store in S3 (jobs/<job_id>/job.json and request.json), shared by all Lambda containers"""
+
+    def __init__(self, bucket, prefix='jobs/'):
+        self.bucket = bucket
+        self.prefix = prefix
+        self._s3 = boto3.client('s3')
+
+    def _read(self, job_id, name):
+        try:
+            obj = self._s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}{job_id}/{name}")
+            return json.loads(obj['Body'].read())
+        except self._s3.exceptions.NoSuchKey:
+            return None
+
+    def _write(self, job_id, name, value):
+        self._s3.put_object(Bucket=self.bucket, Key=f"{self.prefix}{job_id}/{name}",
+                            Body=json.dumps(value).encode('utf-8'), ContentType='application/json')
+
+    def create(self, job_id, request_body):
+        job = self.new_job(job_id)
+        self._write(job_id, 'request.json', request_body)
+        self._write(job_id, 'job.json', job)
+        return job
+
+    def get(self, job_id):
+        return self._read(job_id, 'job.json')
+
+    def get_request(self, job_id):
+        return self._read(job_id, 'request.json')
+
+    def update(self, job_id, **fields):
+        # Only the single worker running the job writes to it, so read-modify-write is safe
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.update(fields, updated_at=time.time())
+        self._write(job_id, 'job.json', job)
+        return job
+
+_job_store = None
+_job_store_lock = threading.Lock()
+_job_context = threading.local()
+
+def get_job_store():
+    """Return the process-wide job store selected by JOB_STORE ('sqlite' or 's3')"""
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            if JOB_STORE_BACKEND == 's3':
+                _job_store = S3JobStore(JOB_STORE_S3_BUCKET)
+            else:
+                _job_store = SQLiteJobStore(JOB_STORE_PATH)
+        return _job_store
+
+def report_progress(stage, **details):
+    """Record the current pipeline stage on the job being run by this thread (no-op for sync requests)"""
+    job_id = getattr(_job_context, 'job_id', None)
+    if not job_id:
+        return
+    try:
+        progress = JOB_STAGES.index(stage) / (len(JOB_STAGES) - 1)
+        get_job_store().update(job_id, status='running', stage=stage, progress=round(progress, 2), details=details)
+    except Exception as e:
+        print(f"Could not record progress for job {job_id}: {str(e)}")
+
+def run_job(job_id):
+    """Run a queued job to completion and store its result or error"""
+    store = get_job_store()
+    body = store.get_request(job_id)
+    if body is None:
+        print(f"Job {job_id} not found")
+        return None
+
+    _job_context.job_id = job_id
+    try:
+        response = generate_presentation(body)
+        result = json.loads(response['body'])
+        if response['statusCode'] == 200:
+            return store.update(job_id, status='done', stage='done', progress=1.0,
+                                download_url=result.get('download_url'), result=result)
+        return store.update(job_id, status='failed', error=result.get('error', 'Generation failed'))
+    except Exception as e:
+        print(f"ERROR in job {job_id}: {str(e)}")
+        return store.update(job_id, status='failed', error=str(e))
+    finally:
+        _job_context.job_id = None
+
+_job_executor = None
+
+def start_job(job_id, context=None):
+    """Hand a queued job to the background runner selected by JOB_RUNNER"""
+    global _job_executor
+    if JOB_RUNNER == 'lambda':
+        # Event invocations return immediately; the payload only carries the id since
+        # request bodies can exceed the 256 KB async invocation limit
+        boto3.client('lambda').invoke(
+            FunctionName=context.function_name if context else os.environ['AWS_LAMBDA_FUNCTION_NAME'],
+            InvocationType='Event',
+            Payload=json.dumps({'job_id': job_id}).encode('utf-8')
+        )
+    else:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('JOB_WORKERS', '2')))
+        _job_executor.submit(run_job, job_id)
+
+def api_response(status_code, data):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Methods': 'GET, POST, OPTIONS'
+        },
+        'body': json.dumps(data)
+    }
+
+def read_json_body(event):
+    """The request body as a dict, or None when it is missing or not a JSON object"""
     try:
         body = json.loads(event['body'])
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"ERROR reading request body: {str(e)}")
+        return None
+    return body if isinstance(body, dict) else None
+
+def submit_job(event, context):
+    """POST /jobs: store the request and return a job id without waiting for generation"""
+    body = read_json_body(event)
+    if body is None:
+        return api_response(400, {'error': 'Request body must be a JSON object'})
+    try:
+        job_id = uuid.uuid4().hex
+        job = get_job_store().create(job_id, body)
+        start_job(job_id, context)
+        print(f"Submitted job {job_id}")
+        return api_response(202, job)
+    except Exception as e:
+        print(f"ERROR submitting job: {str(e)}")
+        return api_response(500, {'error': str(e)})
+
+def job_status(event):
+    """GET /jobs/{job_id}: current stage, progress and (when done) the download URL"""
+    job_id = (event.get('pathParameters') or {}).get('job_id')
+    try:
+        job = get_job_store().get(job_id) if job_id else None
+    except Exception as e:
+        print(f"ERROR reading job {job_id}: {str(e)}")
+        return api_response(500, {'error': str(e)})
+    if job is None:
+        return api_response(404, {'error': f"Job {job_id} not found"})
+    job['stages'] = JOB_STAGES
+    return api_response(200, job)
+
+def lambda_handler(event, context):
+    # Background invocation started by submit_job
+    if 'job_id' in event and 'body' not in event:
+        run_job(event['job_id'])
+        return {'job_id': event['job_id']}
+
+    resource = event.get('resource') or event.get('path') or ''
+    if resource.startswith('/jobs'):
+        if event.get('httpMethod') == 'GET':
+            return job_status(event)
+        return submit_job(event, context)
+
+    body = read_json_body(event)
+    if body is None:
+        return api_response(400, {'error': 'Request body must be a JSON object'})
+    return generate_presentation(body)
+
+def generate_presentation(body):
+    """Run the full pipeline for one request body and return the API Gateway response"""
+    try:
         description = body.get('description', 'Create a presentation')
         urls = body.get('urls', [])
         csv_data_b64 = body.get('csv_data', None)  # Base64 encoded CSV/Excel data
@@ -573,66 +4569,99 @@ def lambda_handler(event, context):
             # Fallback to plain text (backward compatibility)
             document_text = body.get('document_text', None)
 
+        # One Bedrock wrapper per request, so retries, rate limit and concurrency are shared by all calls
+        bedrock = bedrock_caller()
+        # The pool and cache counters live as long as the container; pptx_info reports this request's share
+        stats_before = {'http_pool': HTTP_SESSION.stats(), 'crawl_cache': CRAWL_CACHE.stats(), 'analysis_cache': ANALYSIS_CACHE.stats()}
+
         # Initialize variables
         extracted_content = []
         all_images = []
         data_analysis = None
         generated_charts = []
+        data_sheets = []
 
         # Process CSV/Excel data if provided
         if csv_data_b64:
+            report_progress('parsing_data')
             try:
                 print(f"Processing {file_extension} data")
-                file_bytes = base64.b64decode(csv_data_b64)
-
-                # Parse Excel/CSV data
-                data_summary, data_rows = parse_excel_data(file_bytes, file_extension)
+                # Parse Excel/CSV data; large CSVs are streamed in chunks straight from the base64 payload.
+                # Workbooks get every sheet parsed; charts read the dataset of their candidate's sheet.
+                sheet_datasets = {}
+                if file_extension == '.csv' and len(csv_data_b64) * 3 // 4 >= CSV_STREAM_MIN_BYTES:
+                    data_summary, dataset = parse_csv_stream(csv_data_b64)
+                elif file_extension in ['.xlsx', '.xls']:
+                    data_summary, sheet_datasets = parse_workbook(base64.b64decode(csv_data_b64), file_extension)
+                    dataset = sheet_datasets.get(data_summary['primary_sheet']) if data_summary else None
+                    data_sheets = data_summary.get('sheets', []) if data_summary else []
+                else:
+                    file_bytes = base64.b64decode(csv_data_b64)
+                    data_summary, dataset = parse_excel_data(file_bytes, file_extension)
 
-                if data_summary and data_rows:
+                if data_summary and dataset:
                     print(f"Parsed CSV: {data_summary['row_count']} rows, {len(data_summary['columns'])} columns")
 
                     # Analyze data with Claude
-                    bedrock = boto3.client('bedrock-runtime', region_name='us-west-2')
-                    data_analysis = analyze_data_with_claude(bedrock, data_summary, data_rows)
+                    data_analysis = analyze_data_with_claude(
+                        bedrock, data_summary, dataset, use_cache=not body.get('bypass_cache', False)
+                    )
 
                     if data_analysis:
                         print(f"Claude analysis complete: {len(data_analysis.get('visualizations', []))} visualizations suggested")
 
                         # Generate charts based on Claude's suggestions
+                        charts = []
                         for viz in data_analysis.get('visualizations', []):
                             try:
                                 x_col = viz.get('x_column')
                                 y_col = viz.get('y_column')
+                                chart_dataset = sheet_datasets.get(viz.get('sheet'), dataset)
 
                                 print(f"Attempting to generate chart: {viz.get('title')}")
+                                if viz.get('sheet'):
+                                    print(f"  Sheet: {viz.get('sheet')}")
                                 print(f"  X column: {x_col}")
                                 print(f"  Y column: {y_col}")
                                 print(f"  Chart type: {viz.get('chart_type', 'line')}")
-                                print(f"  Available columns: {list(data_rows[0].keys()) if data_rows else 'None'}")
+                                print(f"  Available columns: {chart_dataset.columns}")
 
-                                chart_bytes = generate_chart_with_matplotlib(
-                                    data_rows,
+                                chart = extract_chart_series(
+                                    chart_dataset,
                                     x_col,
                                     y_col,
-                                    viz.get('chart_type', 'line')
+                                    viz.get('chart_type', 'line'),
+                                    aggregation=viz.get('aggregation')
                                 )
-
-                                if chart_bytes:
-                                    # Add chart as an image
-                                    chart_b64 = base64.b64encode(chart_bytes).decode('utf-8')
-                                    all_images.append({
-                                        'url': f"chart_{viz.get('x_column')}_{viz.get('y_column')}",
-                                        'base64': chart_b64,
-                                        'media_type': 'image/png',
-                                        'size': len(chart_bytes),
-                                        'is_chart': True,
-                                        'chart_title': viz.get('title', 'Data Visualization')
-                                    })
-                                    generated_charts.append(viz)
-                                    print(f"Generated chart: {viz.get('title')}")
+                                if chart:
+                                    charts.append((viz, chart))
                             except Exception as chart_error:
                                 print(f"Error generating chart: {str(chart_error)}")
 
+                        # The deck gets an editable native chart; the PNG is only Claude's preview
+                        # (or the slide picture when native charts are turned off). All previews
+                        # render in parallel on the chart worker pool.
+                        chart_pngs = [None] * len(charts)
+                        if charts and (CHART_VISION_PREVIEW or not NATIVE_CHARTS):
+                            render_started = time.monotonic()
+                            chart_pngs = render_charts([chart for _, chart in charts])
+                            print(f"Rendered {len(charts)} chart previews in {time.monotonic() - render_started:.2f}s")
+
+                        for (viz, chart), chart_bytes in zip(charts, chart_pngs):
+                            if chart_bytes or NATIVE_CHARTS:
+                                # Add chart as an image
+                                all_images.append({
+                                    'url': f"chart_{viz.get('x_column')}_{viz.get('y_column')}",
+                                    'base64': base64.b64encode(chart_bytes).decode('utf-8') if chart_bytes else '',
+                                    'media_type': 'image/png',
+                                    'size': len(chart_bytes) if chart_bytes else 0,
+                                    'is_chart': True,
+                                    'chart_title': viz.get('title', 'Data Visualization'),
+                                    'chart_data': chart if NATIVE_CHARTS else None
+                                })
+                                generated_charts.append(viz)
+                                print(f"Generated chart: {viz.get('title')}")
+
                         # Add data insights to extracted content
                         insights_text = '\n'.join(data_analysis.get('insights', []))
                         extracted_content.append({
@@ -687,43 +4716,26 @@ def lambda_handler(event, context):
             urls = search_web(description, num_results=3)
             print(f"Using search results: {urls}")
 
-        # Extract text and images from URLs
-        print(f"Starting URL crawling loop with {len(urls)} URLs: {urls}")
-        for url in urls:
-            try:
-                print(f"Crawling URL: {url}")
-                req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-                with urllib.request.urlopen(req, timeout=15) as response:
-                    html_content = response.read().decode('utf-8')
-                    print(f"Successfully fetched {len(html_content)} bytes from {url}")
-
-                # Extract text
-                clean_text = extract_text_from_html(html_content)
-                print(f"Extracted {len(clean_text)} characters of text from {url}")
-
-                # Extract images
-                image_urls = extract_images_from_html(html_content, url)
-                print(f"Found {len(image_urls)} images on {url}")
-
-                extracted_content.append({
-                    'url': url,
-                    'content': clean_text,
-                    'image_count': len(image_urls)
-                })
-
-                # Download and encode images
-                for img_url in image_urls:
-                    encoded_img = download_and_encode_image(img_url)
-                    if encoded_img:
-                        all_images.append(encoded_img)
+        # Extract text and images from URLs (fetched concurrently, results kept in URL order)
+        report_progress('crawling', urls=len(urls))
+        print(f"Starting URL crawling stage with {len(urls)} URLs: {urls}")
+        image_candidates = []
+        for page in crawl_urls(urls):
+            for img_url in page.pop('image_urls', []):
+                if img_url not in image_candidates:
+                    image_candidates.append(img_url)
+            extracted_content.append(page)
+
+        # Download and encode images concurrently, stopping once Claude's image slots are filled
+        report_progress('downloading_images', candidates=len(image_candidates))
+        web_images, image_download_stats = download_images(
+            image_candidates,
+            max_images=max(0, MAX_IMAGES_TO_SEND - len(all_images))
+        )
+        all_images.extend(web_images)
 
-            except Exception as e:
-                print(f"Error crawling {url}: {str(e)}")
-                extracted_content.append({'url': url, 'error': str(e)})
-        
         # Generate slides with Bedrock
-        bedrock = boto3.client('bedrock-runtime', region_name='us-west-2')
-        all_content = '\n\n'.join([item.get('content', '') for item in extracted_content if 'content' in item])
+        report_progress('generating_slides')
 
         slide_count = body.get('slide_count', 6)
         content_slides = slide_count - 2  # Subtract title and thank you slides
@@ -731,160 +4743,37 @@ def lambda_handler(event, context):
         # Build message content with text and images
         message_content = []
 
+        # Downscale/recompress images for Claude and for the slides
+        with ThreadPoolExecutor(max_workers=max(1, min(IMAGE_MAX_WORKERS, len(all_images)))) as executor:
+            all_images = list(executor.map(prepare_image_variants, all_images))
+        image_bytes_saved = {
+            'vision': sum(img['original_size'] - img['size'] for img in all_images),
+            'slide': sum(img['original_size'] - img['slide_size'] for img in all_images)
+        }
+        print(f"Image normalization saved {image_bytes_saved['vision']} bytes for Claude, "
+              f"{image_bytes_saved['slide']} bytes in the deck")
+
         # Add text prompt
         # Limit images sent to Claude to 5 max
-        images_to_send = all_images[:5]
-
-        if images_to_send:
-            chart_indices = [str(i) for i, img in enumerate(images_to_send) if img.get('is_chart')]
-            has_charts = len(chart_indices) > 0
-
-            image_instruction = f"""
-
-🔴 CRITICAL IMAGE INSTRUCTIONS 🔴
-I'm providing {len(images_to_send)} images. These images are numbered 0 to {len(images_to_send)-1}.
-
-{"🔴 IMPORTANT: Images " + ', '.join(chart_indices) + " are DATA CHARTS/GRAPHS generated from the uploaded data file. YOU MUST INCLUDE THESE CHARTS IN YOUR PRESENTATION!" if has_charts else ""}
-
-REQUIRED ACTIONS:
-1. ANALYZE each image to understand what it shows (charts, graphs, data visualizations, diagrams, photos, etc.)
-2. EXTRACT key insights, data points, and trends from the images
-3. INCORPORATE image insights into your slide bullet points
-4. **YOU MUST ASSIGN AT LEAST {min(len(images_to_send), slide_count - 2)} IMAGES TO SLIDES using "image_index" field**
-
-IMAGE ASSIGNMENT RULES:
-- Set "image_index": 0 to put image #0 on that slide
-- Set "image_index": 1 to put image #1 on that slide
-- Set "image_index": 2 to put image #2 on that slide
-- Set "image_index": null ONLY on the first (title) and last (thank you) slides
-- ALL middle content slides SHOULD have an image assigned where relevant
-{"- 🔴 PRIORITY: Data charts (images " + ', '.join(chart_indices) + ") MUST be included on content slides!" if has_charts else ""}
-
-EXAMPLE of correct usage:
-{{"title": "Revenue Analysis", "content": ["..."], "image_index": 0}}  ← Image #0 appears on this slide
-{{"title": "Team Performance", "content": ["..."], "image_index": 1}}  ← Image #1 appears on this slide
-
-DO NOT set image_index to null on content slides when you have images available!"""
-        else:
-            image_instruction = """
-
-🔴 IMPORTANT: NO IMAGES AVAILABLE 🔴
-- Set "image_index": null on ALL slides (including content slides)
-- Do NOT assign any numeric image_index values
-- Create text-only slides with focused content"""
-
-        # Add data analysis context if available
-        data_context = ""
-        if data_analysis:
-            data_context = f"""
-
-DATA ANALYSIS INSIGHTS:
-{json.dumps(data_analysis, indent=2)}
-
-IMPORTANT: Use these data insights in your presentation. The charts visualizing this data are included in the images."""
-
-        prompt_text = f"""Create a {slide_count}-slide PowerPoint presentation about: {description}
-
-Based on this content:
-{all_content}{data_context}{image_instruction}
-
-CRITICAL: Return ONLY valid JSON. Do NOT wrap in markdown code blocks. Do NOT add any explanation before or after the JSON.
-
-Return in this EXACT format (insight-based titles + 6×6 rule):
-{{"slides": [
-  {{"title": "{description}", "content": ["Overview and key objectives", "Topics covered in presentation", "Main takeaways and insights"], "image_index": null}},
-  {{"title": "Revenue Growth Accelerated 25% Year Over Year", "content": ["Urban markets driving expansion", "Customer base doubled in Q4", "Profit margins improved significantly"], "image_index": 0}},
-  {{"title": "Project Delivered Ahead of Schedule and Under Budget", "content": ["Completed two weeks early", "Saved 15% on total costs", "Quality metrics exceeded targets"], "image_index": 1}},
-  {{"title": "Thank You", "content": ["Questions and discussion welcome", "Thank you for attention"], "image_index": null}}
-]}}
-
-🔴 NOTICE: The example above shows image_index: 0, 1, 2, etc. on content slides. YOU MUST DO THIS with the images I'm providing!
-
-🔴 SLIDE TITLE RULES - ONE MESSAGE PER SLIDE 🔴:
-Each slide title should answer: "What is the one key takeaway?"
-
-❌ WEAK (topic-based titles):
-- "Market Analysis"
-- "Sales Performance"
-- "Customer Data"
-
-✅ STRONG (insight-based titles):
-- "Market Demand Growing 18% Annually in Urban Areas"
-- "Sales Exceeded Target by $2M in Q4"
-- "Customer Retention Rate Reached Record 94%"
-
-🔴 TITLE REQUIREMENTS - MUST BE VERY SHORT 🔴:
-- **CRITICAL: Maximum 1-2 WORDS per title** (VERY SHORT!)
-- State a CONCLUSION, not just a topic
-- Include the KEY FINDING or insight
-- Use specific numbers/data when available
-- Examples: "Revenue Growth", "Customer Satisfaction", "Market Share", "Performance", "Strategy"
-
-Structure Requirements:
-- **First slide (Slide 1)**: Main title slide with overview
-  - Title: Use the **MAIN TOPIC TITLE** (the presentation topic itself, e.g., "{description}")
-  - Content: 4-6 SHORT bullet points (4-6 words each) listing what topics will be covered (adjust based on presentation scope)
-  - No image on first slide
-  - Example: ["Key concepts and introduction", "Data analysis and findings", "Implementation recommendations", "Next steps and timeline", "Summary and conclusions"]
-
-- **Middle slides (Slides 2 to {slide_count-1})**: Content slides with ONE KEY MESSAGE each
-  - **ONE MESSAGE PER SLIDE**: Each slide answers "What is the one key takeaway?"
-  - **VERY SHORT INSIGHT-BASED TITLE**: Max 1-2 words stating the conclusion (e.g., "Revenue Growth", "Customer Success", "Market Position")
-  - **3-ZONE LAYOUT**:
-    1. Headline (insight/conclusion) at top
-    2. Visual/Chart in middle (if image available)
-    3. Supporting points at bottom (flexible bullets)
-  - **FLEXIBLE BULLET COUNT (3-8 bullets per slide)**: Adjust based on content importance and complexity
-    - **Simple topics**: 3-4 bullets (keep it concise)
-    - **Standard topics**: 5-6 bullets (balanced coverage)
-    - **Complex/Important topics**: 7-8 bullets (comprehensive detail)
-    - **QUALITY OVER QUANTITY**: Include all important points, don't pad or cut artificially
-  - Include images where relevant using "image_index"
-  - **CRITICAL: Each slide MUST have a UNIQUE title - no two slides should have the same title**
-
-- **Last slide**: Thank you slide
-  - Title: **"Thank You"** or **"Questions?"**
-  - Simple closing slide
-  - 2-3 bullet points max
-
-🔴 BULLET POINT RULES - FLEXIBLE & CONTENT-DRIVEN 🔴:
-- **FLEXIBLE BULLET COUNT: 3-8 bullets per slide** (adjust based on content importance)
-  - Use MORE bullets (6-8) for complex, data-rich, or critical topics
-  - Use FEWER bullets (3-4) for simple concepts or introductory slides
-  - Default to 5-6 bullets for standard topics
-  - **NEVER artificially limit important information** - if there are 7-8 key points, include them all
-- **Maximum 6-8 WORDS per bullet point**
-- SHORT, IMPACTFUL, PUNCHY language
-- No long sentences - use brief, powerful phrases
-- Each bullet conveys ONE key insight
-
-EXAMPLES OF GOOD BULLETS (6-8 words):
-✅ "Revenue increased 25% year over year"
-✅ "Customer satisfaction reached all-time high"
-✅ "Project completed ahead of schedule"
-✅ "Team productivity improved with new tools"
-✅ "New features launched successfully this quarter"
-
-EXAMPLES OF BAD BULLETS (too long):
-❌ "The revenue for our organization increased significantly by approximately 25% when compared to the same period in the previous year"
-❌ "Customer satisfaction scores have shown remarkable improvement and reached the highest levels we have ever seen"
-
-Content Requirements:
-- **UNIQUE TITLES**: Every slide must have a unique, descriptive title
-- **CONCISE**: 6-8 words per bullet point maximum
-- **IMPACTFUL**: Make every word count
-- **PROFESSIONAL**: Use clear, direct language
-- **FOCUSED**: One key idea per bullet
-- **DATA-DRIVEN**: Use numbers and facts when available
-- Use insights from the provided content{"and analyze the images for key data points" if all_images else ""}
-- If your content includes URLs, write them as fully qualified URLs (e.g., https://www.example.com)
-
-🔴 CRITICAL FORMATTING RULES 🔴:
-- MUST have 4-5 bullets per slide (MINIMUM 4, MAXIMUM 5)
-- 6-8 words per bullet (NOT sentences)
-- Use strong action verbs
-- Be specific and concrete
-- Avoid fluff and filler words"""
+        images_to_send = all_images[:MAX_IMAGES_TO_SEND]
+
+        # Fit document, data insights and crawled pages into the content token budget
+        full_data_context = build_data_context(data_analysis)
+        all_content, data_context, content_budget = plan_prompt_content(extracted_content, full_data_context, description)
+        sources_compressed = any(source['compressed'] for source in content_budget['sources'])
+
+        def retrieve_content(outline):
+            # Sources were cut down for the topic alone; the outline gives a sharper retrieval query.
+            # Re-plan from the uncompressed data context so the budget split matches the first plan
+            return plan_prompt_content(extracted_content, full_data_context, outline_query(description, outline))[0]
+        prompt_text = build_slides_prompt(description, slide_count, all_content, data_context, images_to_send)
+        content_budget['estimated_input_tokens'] = (
+            estimate_tokens(SLIDES_SYSTEM_PROMPT) + estimate_tokens(prompt_text)
+            + sum(estimate_image_tokens(img) for img in images_to_send)
+        )
+        print(f"Estimated input tokens for slide generation: {content_budget['estimated_input_tokens']} "
+              f"(content {content_budget['content_tokens']} of {content_budget['budget']} budget, "
+              f"{len(images_to_send)} images)")
 
         message_content.append({
             "type": "text",
@@ -897,15 +4786,11 @@ Content Requirements:
         for idx, img in enumerate(images_to_send):
             try:
                 # Validate image data before adding
-                if img['base64'] and img['media_type'] and len(img['base64']) > 0:
-                    message_content.append({
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": img['media_type'],
-                            "data": img['base64']
-                        }
-                    })
+                if img.get('chart_data') and not img.get('base64'):
+                    message_content.append(claude_image_block(img))
+                    print(f"Added chart {idx} as text: {img['chart_title']}")
+                elif img['base64'] and img['media_type'] and len(img['base64']) > 0:
+                    message_content.append(claude_image_block(img))
                     print(f"Added image {idx}: {img['media_type']}, size: {img['size']} bytes")
                 else:
                     print(f"Skipping invalid image {idx}")
@@ -915,48 +4800,97 @@ Content Requirements:
 
         print(f"Final message has {len(message_content)} content blocks")
 
-        response = bedrock.invoke_model(
-            modelId='us.anthropic.claude-sonnet-4-5-20250929-v1:0',
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 4000,
-                "temperature": 0.7,
-                "messages": [{"role": "user", "content": message_content}]
-            })
-        )
-        
-        result = json.loads(response['body'].read())
-        slides_text = result['content'][0]['text']
+        # Build slides while Claude is still writing the rest of the reply
+        try:
+            builder = PresentationBuilder(all_images)
+        except ImportError:
+            builder = None
+        titles_seen = {}
+        streamed_slides = []
+
+        def on_slide(slide_data):
+            if not isinstance(slide_data, dict) or 'title' not in slide_data or not slide_data.get('content'):
+                print(f"Skipping incomplete streamed slide: {slide_data}")
+                return
+            ensure_unique_titles([slide_data], titles_seen)
+            streamed_slides.append(slide_data)
+            if builder:
+                builder.add_slide(slide_data)
+            print(f"Built slide {len(streamed_slides)}: {slide_data['title']}")
+            report_progress('generating_slides', slides_built=len(streamed_slides))
+
+        def on_restart():
+            # The slide stream broke off; its slides are replaced by those of the retried call
+            nonlocal builder
+            print(f"Discarding {len(streamed_slides)} slides built from the interrupted stream")
+            streamed_slides.clear()
+            titles_seen.clear()
+            if builder:
+                builder = PresentationBuilder(all_images)
+
+        # Optional two-phase generation: cheap outline, then per-slide bullets in parallel
+        usage = {}
+        slides_text = ''
+        if body.get('generation_mode', SLIDE_GENERATION_MODE) == 'outline':
+            outline_slides, usage = generate_slides_outline_fill(
+                bedrock, description, slide_count, all_content, data_context, images_to_send, on_slide=on_slide,
+                retrieve_content=retrieve_content if sources_compressed else None
+            )
+            if outline_slides:
+                slides_text = json.dumps({"slides": outline_slides})
+            else:
+                print("Outline-then-fill failed, falling back to single-shot generation")
+
+        if not streamed_slides:
+            slides_text, single_usage = invoke_claude_streaming(
+                bedrock,
+                SLIDE_MODEL_ID,
+                {
+                    "anthropic_version": "bedrock-2023-05-31",
+                    "max_tokens": 4000,
+                    "temperature": 0.7,
+                    "system": [text_block(SLIDES_SYSTEM_PROMPT, cache=True)],
+                    "messages": [{"role": "user", "content": message_content}]
+                },
+                on_slide=on_slide,
+                on_restart=on_restart
+            )
+            add_usage(usage, single_usage)
+        print(f"Claude usage for this request: {describe_usage(usage)}")
 
         # Log the raw response for debugging
         print(f"Claude response: {slides_text[:500]}")
 
-        # Try to extract JSON from the response
+        # Slides that streamed in are already built; otherwise parse the whole reply
         # Claude might wrap JSON in markdown code blocks
-        try:
-            # First, try direct parsing
-            slides_json = json.loads(slides_text)
-        except json.JSONDecodeError:
-            # Try to extract JSON from markdown code blocks
-            json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', slides_text, re.DOTALL)
-            if json_match:
-                try:
-                    slides_json = json.loads(json_match.group(1))
-                    print("Successfully extracted JSON from markdown code block")
-                except json.JSONDecodeError:
-                    json_match = None
-
-            # Try to find JSON object directly
-            if not json_match:
-                json_match = re.search(r'\{[\s\S]*"slides"[\s\S]*\}', slides_text)
+        slides_json = None
+        if streamed_slides:
+            slides_json = {"slides": streamed_slides}
+        else:
+            try:
+                # First, try direct parsing
+                slides_json = json.loads(slides_text)
+            except json.JSONDecodeError:
+                # Try to extract JSON from markdown code blocks
+                json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', slides_text, re.DOTALL)
                 if json_match:
                     try:
-                        slides_json = json.loads(json_match.group(0))
-                        print("Successfully extracted JSON from text")
+                        slides_json = json.loads(json_match.group(1))
+                        print("Successfully extracted JSON from markdown code block")
                     except json.JSONDecodeError:
+                        json_match = None
+
+                # Try to find JSON object directly
+                if not json_match:
+                    json_match = re.search(r'\{[\s\S]*"slides"[\s\S]*\}', slides_text)
+                    if json_match:
+                        try:
+                            slides_json = json.loads(json_match.group(0))
+                            print("Successfully extracted JSON from text")
+                        except json.JSONDecodeError:
+                            slides_json = None
+                    else:
                         slides_json = None
-                else:
-                    slides_json = None
 
         # If still no valid JSON, use fallback
         if not slides_json or 'slides' not in slides_json:
@@ -1000,339 +4934,22 @@ Content Requirements:
 
             slides_json = {"slides": fallback_slides[:slide_count]}
 
-        # Ensure unique slide titles (accessibility requirement)
-        def ensure_unique_titles(slides_list):
-            """Ensure all slide titles are unique by adding numbers if needed."""
-            titles_seen = {}
-            for slide in slides_list:
-                original_title = slide['title']
-                if original_title in titles_seen:
-                    # Title is duplicate, add number
-                    titles_seen[original_title] += 1
-                    slide['title'] = f"{original_title} ({titles_seen[original_title]})"
-                else:
-                    titles_seen[original_title] = 1
-            return slides_list
-
-        slides_json['slides'] = ensure_unique_titles(slides_json['slides'])
+        # Ensure unique slide titles (accessibility requirement); streamed slides were
+        # already de-duplicated and built as they arrived
+        if not streamed_slides:
+            slides_json['slides'] = ensure_unique_titles(slides_json['slides'], titles_seen)
+            if builder:
+                for slide_data in slides_json['slides']:
+                    builder.add_slide(slide_data)
 
         # Create PowerPoint using local python-pptx and upload
+        report_progress('building_pptx', slides=len(slides_json['slides']))
         try:
-            # Import python-pptx (will work locally)
-            from pptx import Presentation
-            from pptx.util import Inches, Pt
-            from pptx.enum.text import PP_ALIGN, MSO_ANCHOR
-            from pptx.dml.color import RGBColor
-
-            prs = Presentation()
-            prs.slide_width = Inches(10)  # Standard widescreen
-            prs.slide_height = Inches(7.5)
-
-            # Professional design constants - Following modern corporate standards
-            # Modern professional fonts: Calibri, Arial, Helvetica, Segoe UI
-            TITLE_FONT = 'Calibri'  # Modern corporate standard
-            BODY_FONT = 'Calibri'   # Consistent, professional
-            TITLE_SIZE = Pt(36)     # Professional title (28-40pt range)
-            BODY_SIZE = Pt(20)      # Professional body (18-24pt range)
-            TITLE_COLOR = RGBColor(31, 56, 100)  # Professional dark blue (primary color)
-            BODY_COLOR = RGBColor(64, 64, 64)    # Dark gray - high contrast on white
-
-            # Track actual image insertions
-            actual_images_inserted = 0
-
-            for slide_data in slides_json['slides']:
-                # Check if slide has an image
-                has_image = slide_data.get('image_index') is not None
-                image_index = slide_data.get('image_index')
-
-                if has_image and image_index is not None and image_index < len(all_images):
-                    # Try to add image, fall back to text-only if it fails
-                    try:
-                        # Use blank layout for custom positioning
-                        slide_layout = prs.slide_layouts[6]  # Blank layout
-                        slide = prs.slides.add_slide(slide_layout)
-
-                        # 3-ZONE LAYOUT: Zone 1 - Headline (key message/insight)
-                        # Add title with professional formatting - positioned at top to minimize gaps
-                        title_box = slide.shapes.add_textbox(Inches(0.6), Inches(0.3), Inches(8.8), Inches(0.9))
-                        title_frame = title_box.text_frame
-                        title_frame.text = slide_data['title']
-                        title_frame.word_wrap = True
-                        title_para = title_frame.paragraphs[0]
-                        title_para.font.name = TITLE_FONT
-                        title_para.font.size = TITLE_SIZE
-                        title_para.font.bold = True
-                        title_para.font.color.rgb = TITLE_COLOR
-                        title_para.alignment = PP_ALIGN.LEFT
-                        title_para.space_after = Pt(6)  # Space below title
-
-                        # Add image
-                        img_data = all_images[image_index]
-
-                        # Determine file extension from media type
-                        ext_map = {
-                            'image/jpeg': 'jpg',
-                            'image/png': 'png',
-                            'image/gif': 'gif',
-                            'image/webp': 'webp'
-                        }
-                        ext = ext_map.get(img_data['media_type'], 'jpg')
-                        img_path = f"/tmp/slide_img_{uuid.uuid4().hex[:8]}.{ext}"
-
-                        # Decode and save image
-                        with open(img_path, 'wb') as img_file:
-                            img_file.write(base64.b64decode(img_data['base64']))
-
-                        # 3-ZONE LAYOUT: Zone 2 - Visual/Chart (middle)
-                        # Insert image (right side) - positioned higher to fill space
-                        picture = slide.shapes.add_picture(img_path, Inches(5.6), Inches(1.4), width=Inches(3.8))
-
-                        # Add alt text to image (accessibility requirement)
-                        if img_data.get('is_chart'):
-                            # For generated charts
-                            alt_text = img_data.get('chart_title', f"Data visualization chart for {slide_data['title']}")
-                        else:
-                            # For web images
-                            alt_text = f"Image related to {slide_data['title']}"
-
-                        # Set the alternative text for the picture
-                        picture._element._nvXxPr.cNvPr.set('descr', alt_text)
-
-                        # Track successful image insertion
-                        actual_images_inserted += 1
-
-                        # 3-ZONE LAYOUT: Zone 3 - Supporting points (bottom/left)
-                        # Add bullet points - maximize vertical fill with minimal margins
-                        text_box = slide.shapes.add_textbox(Inches(0.6), Inches(1.3), Inches(4.6), Inches(6.0))
-                        tf = text_box.text_frame
-                        tf.word_wrap = True
-                        tf.vertical_anchor = MSO_ANCHOR.TOP
-                        tf.margin_left = Inches(0.1)
-                        tf.margin_right = Inches(0.1)
-                        tf.margin_top = Inches(0.05)
-                        tf.margin_bottom = Inches(0.05)
-
-                        # Bullet Point Rule: 3-8 bullets (flexible based on content), max 6-8 words per bullet
-                        content_items = slide_data['content'][:8]
-
-                        # First bullet point with URL hyperlinks
-                        p = tf.paragraphs[0]
-                        # Limit to 8 words for slides with images (slightly relaxed for readability)
-                        words = content_items[0].split()
-                        bullet_text = ' '.join(words[:8]) + ('...' if len(words) > 8 else '')
-                        add_hyperlinks_to_paragraph(p, bullet_text)
-                        p.font.name = BODY_FONT
-                        p.font.size = BODY_SIZE
-                        p.font.color.rgb = BODY_COLOR
-                        p.space_after = Pt(24)
-                        p.level = 0
-                        # Enable bullet point with explicit character
-                        from pptx.oxml.xmlchemy import OxmlElement
-                        pPr = p._element.get_or_add_pPr()
-                        # Add bullet character element
-                        buChar = OxmlElement('a:buChar')
-                        buChar.set('char', '•')
-                        pPr.append(buChar)
-
-                        # Additional bullet points with URL hyperlinks
-                        for bullet_point in content_items[1:]:
-                            p = tf.add_paragraph()
-                            # Limit to 8 words per bullet
-                            words = bullet_point.split()
-                            bullet_text = ' '.join(words[:8]) + ('...' if len(words) > 8 else '')
-                            add_hyperlinks_to_paragraph(p, bullet_text)
-                            p.font.name = BODY_FONT
-                            p.font.size = BODY_SIZE
-                            p.font.color.rgb = BODY_COLOR
-                            p.space_after = Pt(24)
-                            p.level = 0
-                            # Enable bullet point with explicit character
-                            from pptx.oxml.xmlchemy import OxmlElement
-                            pPr = p._element.get_or_add_pPr()
-                            # Add bullet character element
-                            buChar = OxmlElement('a:buChar')
-                            buChar.set('char', '•')
-                            pPr.append(buChar)
-
-                        # Enable auto-fit to prevent text overflow
-                        tf.auto_size = None
-                        tf.word_wrap = True
-
-                        # Clean up temp image
-                        if os.path.exists(img_path):
-                            os.remove(img_path)
-
-                    except Exception as img_error:
-                        # If image fails, create text-only slide instead
-                        print(f"Error adding image: {str(img_error)}, falling back to text-only")
-
-                        # Remove the failed slide if it was created
-                        if len(prs.slides) > 0:
-                            try:
-                                rId = prs.slides._sldIdLst[-1].rId
-                                prs.part.drop_rel(rId)
-                                del prs.slides._sldIdLst[-1]
-                            except:
-                                pass
-
-                        # Create text-only slide instead with professional formatting
-                        slide_layout = prs.slide_layouts[6]  # Use blank layout for consistency
-                        slide = prs.slides.add_slide(slide_layout)
-
-                        # 3-ZONE LAYOUT: Zone 1 - Headline (fallback slide)
-                        # Add title - positioned at top to minimize gaps
-                        title_box = slide.shapes.add_textbox(Inches(0.6), Inches(0.3), Inches(8.8), Inches(0.9))
-                        title_frame = title_box.text_frame
-                        title_frame.text = slide_data['title']
-                        title_frame.word_wrap = True
-                        title_para = title_frame.paragraphs[0]
-                        title_para.font.name = TITLE_FONT
-                        title_para.font.size = TITLE_SIZE
-                        title_para.font.bold = True
-                        title_para.font.color.rgb = TITLE_COLOR
-                        title_para.alignment = PP_ALIGN.LEFT
-                        title_para.space_after = Pt(6)
-
-                        # 3-ZONE LAYOUT: Zone 3 - Supporting points (centered)
-                        # Add content - maximize vertical fill with minimal margins
-                        text_box = slide.shapes.add_textbox(Inches(1.2), Inches(1.3), Inches(7.6), Inches(6.0))
-                        tf = text_box.text_frame
-                        tf.word_wrap = True
-                        tf.vertical_anchor = MSO_ANCHOR.TOP
-                        tf.margin_left = Inches(0.15)
-                        tf.margin_right = Inches(0.15)
-                        tf.margin_top = Inches(0.1)
-                        tf.margin_bottom = Inches(0.1)
-
-                        # Bullet Point Rule: 3-8 bullets (flexible based on content), max 6-8 words per bullet
-                        content_items = slide_data['content'][:8]
-
-                        # First bullet point with URL hyperlinks
-                        p = tf.paragraphs[0]
-                        # Limit to 10 words for full-width slides (more space available)
-                        words = content_items[0].split()
-                        bullet_text = ' '.join(words[:10]) + ('...' if len(words) > 10 else '')
-                        add_hyperlinks_to_paragraph(p, bullet_text)
-                        p.font.name = BODY_FONT
-                        p.font.size = BODY_SIZE
-                        p.font.color.rgb = BODY_COLOR
-                        p.space_after = Pt(24)
-                        p.level = 0
-                        # Enable bullet point with explicit character
-                        from pptx.oxml.xmlchemy import OxmlElement
-                        pPr = p._element.get_or_add_pPr()
-                        # Add bullet character element
-                        buChar = OxmlElement('a:buChar')
-                        buChar.set('char', '•')
-                        pPr.append(buChar)
-
-                        # Additional bullet points with URL hyperlinks
-                        for bullet_point in content_items[1:]:
-                            p = tf.add_paragraph()
-                            # Limit to 10 words per bullet
-                            words = bullet_point.split()
-                            bullet_text = ' '.join(words[:10]) + ('...' if len(words) > 10 else '')
-                            add_hyperlinks_to_paragraph(p, bullet_text)
-                            p.font.name = BODY_FONT
-                            p.font.size = BODY_SIZE
-                            p.font.color.rgb = BODY_COLOR
-                            p.space_after = Pt(24)
-                            p.level = 0
-                            # Enable bullet point with explicit character
-                            from pptx.oxml.xmlchemy import OxmlElement
-                            pPr = p._element.get_or_add_pPr()
-                            # Add bullet character element
-                            buChar = OxmlElement('a:buChar')
-                            buChar.set('char', '•')
-                            pPr.append(buChar)
-
-                        # Enable auto-fit to prevent text overflow
-                        tf.auto_size = None
-                        tf.word_wrap = True
-
-                        # Clean up temp image file if it exists
-                        try:
-                            if 'img_path' in locals() and os.path.exists(img_path):
-                                os.remove(img_path)
-                        except:
-                            pass
-
-                else:
-                    # Regular text-only slide with professional formatting
-                    slide_layout = prs.slide_layouts[6]  # Blank layout for consistency
-                    slide = prs.slides.add_slide(slide_layout)
-
-                    # 3-ZONE LAYOUT: Zone 1 - Headline (key message)
-                    # Add title - positioned at top to minimize gaps
-                    title_box = slide.shapes.add_textbox(Inches(0.6), Inches(0.3), Inches(8.8), Inches(0.9))
-                    title_frame = title_box.text_frame
-                    title_frame.text = slide_data['title']
-                    title_frame.word_wrap = True
-                    title_para = title_frame.paragraphs[0]
-                    title_para.font.name = TITLE_FONT
-                    title_para.font.size = TITLE_SIZE
-                    title_para.font.bold = True
-                    title_para.font.color.rgb = TITLE_COLOR
-                    title_para.alignment = PP_ALIGN.LEFT
-                    title_para.space_after = Pt(6)
-
-                    # 3-ZONE LAYOUT: Zone 3 - Supporting points (centered with whitespace)
-                    # Add content - maximize vertical fill with minimal margins
-                    text_box = slide.shapes.add_textbox(Inches(1.2), Inches(1.3), Inches(7.6), Inches(6.0))
-                    tf = text_box.text_frame
-                    tf.word_wrap = True
-                    tf.vertical_anchor = MSO_ANCHOR.TOP
-                    tf.margin_left = Inches(0.15)
-                    tf.margin_right = Inches(0.15)
-                    tf.margin_top = Inches(0.1)
-                    tf.margin_bottom = Inches(0.1)
-
-                    # Bullet Point Rule: 3-8 bullets (flexible based on content), max 6-8 words per bullet
-                    content_items = slide_data['content'][:8]
-
-                    # First bullet point with hyperlinks
-                    p = tf.paragraphs[0]
-                    # Limit to 10 words for full-width slides (more space available)
-                    words = content_items[0].split()
-                    bullet_text = ' '.join(words[:10]) + ('...' if len(words) > 10 else '')
-                    add_hyperlinks_to_paragraph(p, bullet_text)
-                    p.font.name = BODY_FONT
-                    p.font.size = BODY_SIZE
-                    p.font.color.rgb = BODY_COLOR
-                    p.space_after = Pt(24)
-                    p.level = 0
-                    # Enable bullet point with explicit character
-                    from pptx.oxml.xmlchemy import OxmlElement
-                    pPr = p._element.get_or_add_pPr()
-                    # Add bullet character element
-                    buChar = OxmlElement('a:buChar')
-                    buChar.set('char', '•')
-                    pPr.append(buChar)
+            if builder is None:
+                raise ImportError("python-pptx is not available")
+            prs = builder.prs
+            actual_images_inserted = builder.images_inserted
 
-                    # Additional bullet points with hyperlinks
-                    for bullet_point in content_items[1:]:
-                        p = tf.add_paragraph()
-                        # Limit to 10 words per bullet
-                        words = bullet_point.split()
-                        bullet_text = ' '.join(words[:10]) + ('...' if len(words) > 10 else '')
-                        add_hyperlinks_to_paragraph(p, bullet_text)
-                        p.font.name = BODY_FONT
-                        p.font.size = BODY_SIZE
-                        p.font.color.rgb = BODY_COLOR
-                        p.space_after = Pt(24)
-                        p.level = 0
-                        # Enable bullet point with explicit character
-                        from pptx.oxml.xmlchemy import OxmlElement
-                        pPr = p._element.get_or_add_pPr()
-                        # Add bullet character element
-                        buChar = OxmlElement('a:buChar')
-                        buChar.set('char', '•')
-                        pPr.append(buChar)
-
-                    # Enable auto-fit to prevent text overflow
-                    tf.auto_size = None
-                    tf.word_wrap = True
-            
             # Save and upload
             filename = f"presentation_{uuid.uuid4().hex[:8]}.pptx"
             local_path = f"/tmp/{filename}"
@@ -1340,6 +4957,7 @@ Content Requirements:
             
             file_size = os.path.getsize(local_path)
             
+            report_progress('uploading', size_bytes=file_size)
             bucket_name = os.environ.get('S3_BUCKET', 'ppt-generator-1759467436-803633136603')
             s3 = boto3.client('s3')
             s3.upload_file(local_path, bucket_name, filename)
@@ -1362,7 +4980,15 @@ Content Requirements:
                     'slide_count': len(slides_json['slides']),
                     'format': 'pptx',
                     'images_processed': len(all_images),
-                    'images_inserted': actual_images_inserted
+                    'images_inserted': actual_images_inserted,
+                    'image_downloads': image_download_stats,
+                    'http_pool': HTTP_SESSION.stats(since=stats_before['http_pool']),
+                    'crawl_cache': CRAWL_CACHE.stats(since=stats_before['crawl_cache']),
+                    'analysis_cache': ANALYSIS_CACHE.stats(since=stats_before['analysis_cache']),
+                    'image_bytes_saved': image_bytes_saved,
+                    'claude_usage': usage,
+                    'bedrock_calls': bedrock.metrics(),
+                    'content_budget': content_budget
                 }
             }
 
@@ -1373,6 +4999,8 @@ Content Requirements:
                     'charts_generated': len(generated_charts),
                     'visualizations': generated_charts
                 }
+                if data_sheets:
+                    response_data['data_analysis']['sheets'] = data_sheets
 
             return {
                 'statusCode': 200,
@@ -1403,13 +5031,21 @@ Content Requirements:
                         'slide_count': len(slides_json['slides']),
                         'format': 'json',
                         'images_processed': len(all_images),
+                        'image_downloads': image_download_stats,
+                        'http_pool': HTTP_SESSION.stats(since=stats_before['http_pool']),
+                        'crawl_cache': CRAWL_CACHE.stats(since=stats_before['crawl_cache']),
+                        'analysis_cache': ANALYSIS_CACHE.stats(since=stats_before['analysis_cache']),
+                        'image_bytes_saved': image_bytes_saved,
+                        'claude_usage': usage,
+                        'bedrock_calls': bedrock.metrics(),
+                        'content_budget': content_budget,
                         'note': 'Use local python-pptx to create PowerPoint file'
                     }
                 })
             }
 
     except Exception as e:
-        print(f"ERROR in lambda_handler: {str(e)}")
+        print(f"ERROR in generate_presentation: {str(e)}")
         import traceback
         traceback.print_exc()
         return {